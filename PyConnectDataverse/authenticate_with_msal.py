@@ -2,25 +2,107 @@ import msal
 import requests 
 import json
 import logging
+import os
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Optional logging
 # logging.basicConfig(level=logging.DEBUG)  # Enable DEBUG log for entire script
 # logging.getLogger("msal").setLevel(logging.INFO)  # Optionally disable MSAL DEBUG logs
 
-def getAuthenticatedSession(envJson: str):
+def _session(poolSize, accessToken=None):
+    session = requests.Session()
+    if accessToken:
+        session.headers.update(dict(Authorization='Bearer {}'.format(accessToken)))
+    session.headers.update({'OData-MaxVersion': '4.0', 'OData-Version': '4.0', 'If-None-Match': 'null', 'Accept': 'application/json'})
+
+    # One connection pool shared by every thread of the batch engine. Connection errors
+    # and gateway errors (idempotent methods only) are retried here, throttling (429/503)
+    # is handled by the callers so they can slow down (urllib3 would otherwise retry
+    # the 429/503 carrying a Retry-After header itself, out of their sight).
+    retries = Retry(total=3, connect=3, read=2, status=2, backoff_factor=0.5, status_forcelist=(502, 504),
+                    respect_retry_after_header=False)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=poolSize, max_retries=retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+# One MSAL application per client and authority, so that the tokens it caches (and the
+# refresh token of an interactive sign-in) are reused by the next sessions of the process
+_applications = {}
+
+
+def _client_secret(config):
+    return config.get("clientSecret") or os.environ.get("DATAVERSE_CLIENT_SECRET")
+
+
+def _application(config, clientID, authority):
+    secret = _client_secret(config)
+    key = (clientID, authority, bool(secret))
+    if key not in _applications:
+        if secret:
+            _applications[key] = msal.ConfidentialClientApplication(
+                clientID, authority=authority, client_credential=secret)
+        else:
+            _applications[key] = msal.PublicClientApplication(
+                clientID, authority=authority,
+                # allow_broker=True,  # If opted in, you will be guided to meet the prerequisites, when applicable
+                                    # See also: https://docs.microsoft.com/en-us/azure/active-directory/develop/scenario-desktop-acquire-token-wam#wam-value-proposition
+                )
+    return _applications[key]
+
+
+def requires_sign_in(envJson: str):
+    """True if getAuthenticatedSession would open a browser window: no mock server, no
+    client secret (clientSecret in the JSON or DATAVERSE_CLIENT_SECRET) and no account
+    signed in earlier by this process."""
+    config = json.load(open(envJson))
+    if config.get("mock") or _client_secret(config):
+        return False
+    authority = config["authorityBase"] + config["tenantID"]
+    return not _application(config, config["clientID"], authority).get_accounts()
+
+
+def _session_or_error(result, poolSize, environmentURI):
+    if "access_token" in result:
+        # Calling graph using the access token
+        print("Token received successfully")
+        return _session(poolSize, result['access_token']), environmentURI
+
+    else:
+        print(result.get("error"))
+        print(result.get("error_description"))
+        print(result.get("correlation_id"))
+
+
+def getAuthenticatedSession(envJson: str, poolSize: int = 16):
 
     config = json.load(open(envJson))
 
     environmentURI = config["environmentURI"]
+
+    if config.get("mock"):
+        # Local stand-in server (mock_dataverse.py at the root of the repo), no sign-in
+        print("Using the local mock server at " + environmentURI)
+        return _session(poolSize), environmentURI
+
     scope = [environmentURI + '/' + config["scopeSuffix"]]
     clientID = config["clientID"]
     authority = config["authorityBase"] + config["tenantID"]
 
-    app = msal.PublicClientApplication(
-        clientID, authority=authority,
-        # allow_broker=True,  # If opted in, you will be guided to meet the prerequisites, when applicable
-                            # See also: https://docs.microsoft.com/en-us/azure/active-directory/develop/scenario-desktop-acquire-token-wam#wam-value-proposition
-        )
+    app = _application(config, clientID, authority)
+
+    if _client_secret(config):
+        # Application user (client credentials): no sign-in window, suited to a server
+        result = app.acquire_token_for_client(scopes=[environmentURI.rstrip('/') + '/.default'])
+        return _session_or_error(result, poolSize, environmentURI)
+
+    # Account already signed in by this process: cached or refreshed token, no window
+    accounts = app.get_accounts()
+    if accounts:
+        result = app.acquire_token_silent(scope, account=accounts[0])
+        if result and "access_token" in result:
+            return _session(poolSize, result['access_token']), environmentURI
 
     # The pattern to acquire a token looks like this.
     result = None
@@ -42,16 +124,4 @@ def getAuthenticatedSession(envJson: str):
             # Prerequisite: https://docs.microsoft.com/en-us/azure/active-directory/external-identities/self-service-sign-up-user-flow
         )
 
-    if "access_token" in result:
-        # Calling graph using the access token
-        print("Token received successfully")
-        session = requests.Session()
-        session.headers.update(dict(Authorization='Bearer {}'.format(result['access_token'])))
-        session.headers.update({'OData-MaxVersion': '4.0', 'OData-Version': '4.0', 'If-None-Match': 'null', 'Accept': 'application/json'})
-
-        return session, environmentURI
-
-    else:
-        print(result("error"))
-        print(result("error_description"))
-        print(result("correlation_id"))
\ No newline at end of file
+    return _session_or_error(result, poolSize, environmentURI)
@@ -0,0 +1,347 @@
+import gzip
+import re
+import threading
+import time
+import uuid
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Concurrent $batch submission engine used by the bulk scripts.
+# https://learn.microsoft.com/en-us/power-apps/developer/data-platform/webapi/execute-batch-operations-using-web-api
+#
+# Several batches are kept in flight at once. The number of batches in flight (K)
+# starts at `concurrency`, grows by one after K consecutive successes and is halved
+# every time Dataverse answers 429 (service protection limits) or 503. The
+# `x-ms-dop-hint` response header, when present, caps K to the degree of
+# parallelism recommended by the server.
+#
+# Results are always handed back in submission order, so output CSVs keep the
+# same row order as the input.
+
+API_PATH = '/api/data/v9.2/'
+MAX_BATCH_SIZE = 1000  # Dataverse rejects batches with more than 1000 requests
+
+THROTTLED_STATUS_CODES = (429, 503)
+
+# Longest pause before a retry, whatever the Retry-After header asks for: the pause
+# holds back every batch of the engine
+MAX_RETRY_AFTER = 60
+
+# Request bodies smaller than this are not worth compressing
+MIN_COMPRESSED_BYTES = 16 * 1024
+
+_BOUNDARY_RE = re.compile(r'boundary=("?)([^";\r\n]+)\1')
+
+# method: GET/POST/PATCH/DELETE, url: path relative to API_PATH (e.g. "contacts(GUID)"),
+# body: bytes or None, headers: dict of extra headers for the part or None
+BatchPart = namedtuple('BatchPart', ['method', 'url', 'body', 'headers'], defaults=[None, None])
+
+# status: int (0 when the part was never executed), reason: "No Content", etc.
+PartResult = namedtuple('PartResult', ['status', 'reason', 'headers', 'body'])
+
+# index: position of the batch in submission order, boundary: batch boundary used
+BatchOutcome = namedtuple('BatchOutcome', ['index', 'boundary', 'results', 'elapsed'])
+
+
+def code_of(result):
+    """Status line as written by the original scripts, e.g. '204 No Content'."""
+    return f"{result.status} {result.reason}".strip()
+
+
+def is_success(result):
+    return 200 <= result.status < 300
+
+
+def build_batch_body(boundary, parts, changeset=None):
+    """Builds the multipart/mixed body of a $batch request.
+
+    When `changeset` is given, the parts are wrapped in a single changeset so they
+    are executed as one transaction."""
+    lines = []
+
+    if changeset:
+        lines.append(f'--{boundary}')
+        lines.append(f'Content-Type: multipart/mixed; boundary="{changeset}"')
+        lines.append('')
+        part_boundary = changeset
+    else:
+        part_boundary = boundary
+
+    chunks = []
+    for content_id, part in enumerate(parts, start=1):
+        lines.append(f'--{part_boundary}')
+        lines.append('Content-Type: application/http')
+        lines.append('Content-Transfer-Encoding: binary')
+        if changeset:
+            lines.append(f'Content-ID: {content_id}')
+        lines.append('')
+        lines.append(f'{part.method} {API_PATH}{part.url} HTTP/1.1')
+        if part.body is not None:
+            lines.append('Content-Type: application/json; type=entry')
+        for name, value in (part.headers or {}).items():
+            lines.append(f'{name}: {value}')
+        lines.append('')
+        chunks.append('\r\n'.join(lines).encode())
+        chunks.append(b'\r\n')
+        if part.body is not None:
+            chunks.append(part.body)
+        chunks.append(b'\r\n')
+        lines = []
+
+    if changeset:
+        lines.append(f'--{changeset}--')
+        lines.append('')
+    lines.append(f'--{boundary}--')
+    lines.append('')
+    chunks.append('\r\n'.join(lines).encode())
+    return b''.join(chunks)
+
+
+def _parse_multipart(text, boundary):
+    results = []
+
+    for chunk in text.split(f'--{boundary}')[1:]:
+        if chunk.startswith('--'):
+            break
+
+        head, _, payload = chunk.lstrip('\r\n').partition('\r\n\r\n')
+        nested = _BOUNDARY_RE.search(head)
+        if nested and 'multipart/mixed' in head.lower():
+            results.extend(_parse_multipart(payload, nested.group(2)))
+            continue
+
+        status_line, _, rest = payload.partition('\r\n')
+        status = status_line.split(' ', 2)  # HTTP/1.1 204 No Content
+        raw_headers, _, body = rest.partition('\r\n\r\n')
+
+        headers = {}
+        for line in raw_headers.split('\r\n'):
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip()] = value.strip()
+
+        results.append(PartResult(
+            int(status[1]) if len(status) > 1 and status[1].isdigit() else 0,
+            status[2] if len(status) > 2 else '',
+            headers,
+            body.strip()
+        ))
+
+    return results
+
+
+def parse_batch_response(response, expected):
+    """Splits a $batch response into one PartResult per submitted part.
+
+    If the whole batch failed (no multipart body), every part receives the batch
+    status. Parts that were not executed (batch stopped at the first error) get
+    status 0."""
+    content_type = response.headers.get('Content-Type', '')
+    match = _BOUNDARY_RE.search(content_type)
+
+    if response.status_code != 200 or not match:
+        result = PartResult(response.status_code, response.reason or '', dict(response.headers),
+                            response.content.decode('utf-8', errors='replace'))
+        return [result] * expected
+
+    results = _parse_multipart(response.content.decode('utf-8'), match.group(2))
+    if len(results) < expected:
+        results.extend([PartResult(0, 'Not Executed', {}, '')] * (expected - len(results)))
+    return results[:expected]
+
+
+def retry_after(response, attempt):
+    value = response.headers.get('Retry-After')
+    try:
+        wait = float(value)
+    except (TypeError, ValueError):
+        wait = 2 ** attempt
+    if wait != wait:  # NaN
+        wait = MAX_RETRY_AFTER
+    return min(max(wait, 0.0), MAX_RETRY_AFTER)
+
+
+class AdaptiveConcurrency:
+    """Limits the number of batches in flight and adapts the limit to throttling."""
+
+    def __init__(self, initial, maximum):
+        self.maximum = max(1, maximum)
+        self.limit = max(1, min(initial, self.maximum))
+        self.in_flight = 0
+        self.throttled = 0
+        self._successes = 0
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    self._condition.wait(pause)
+                elif self.in_flight >= self.limit:
+                    self._condition.wait()
+                else:
+                    self.in_flight += 1
+                    return
+
+    def release(self, throttled=False, retry_after=0.0, dop_hint=None):
+        with self._condition:
+            self.in_flight -= 1
+
+            if dop_hint:
+                self.maximum = max(1, min(self.maximum, dop_hint))
+                self.limit = min(self.limit, self.maximum)
+
+            if throttled:
+                self.throttled += 1
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._successes = 0
+
+            self._condition.notify_all()
+
+
+class BatchEngine:
+    """Submits $batch requests concurrently and returns their results in order.
+
+    Args:
+        session: authenticated requests.Session (from getAuthenticatedSession)
+        environment_uri: environment URI ending with '/'
+        concurrency: number of batches in flight at start
+        max_concurrency: upper bound for the number of batches in flight
+        continue_on_error: send 'Prefer: odata.continue-on-error'
+        max_retries: number of resubmissions of a throttled batch
+        compress_requests: gzip the request bodies of MIN_COMPRESSED_BYTES or more
+            ('Content-Encoding: gzip'). Responses are compressed in any case.
+    """
+
+    def __init__(self, session, environment_uri, concurrency=4, max_concurrency=16,
+                 continue_on_error=True, max_retries=5, compress_requests=False):
+        self.session = session
+        self.api_uri = f'{environment_uri}api/data/v9.2/'
+        self.batch_uri = f'{self.api_uri}$batch'
+        self.limiter = AdaptiveConcurrency(concurrency, max_concurrency)
+        self.continue_on_error = continue_on_error
+        self.max_retries = max_retries
+        self.compress_requests = compress_requests
+
+    def _request(self, label, method, url, body, headers):
+        """Sends one HTTP request within the concurrency limit, retrying when throttled."""
+        if self.compress_requests and body is not None and len(body) >= MIN_COMPRESSED_BYTES:
+            body = gzip.compress(body, compresslevel=6)
+            headers = {**headers, 'Content-Encoding': 'gzip'}
+
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                r = self.session.request(method, url, data=body, headers=headers)
+            except BaseException:
+                self.limiter.release()
+                raise
+
+            dop_hint = r.headers.get('x-ms-dop-hint')
+            dop_hint = int(dop_hint) if dop_hint and dop_hint.isdigit() else None
+
+            if r.status_code in THROTTLED_STATUS_CODES and attempt < self.max_retries:
+                wait = retry_after(r, attempt)
+                self.limiter.release(throttled=True, retry_after=wait, dop_hint=dop_hint)
+                print(f"{label} throttled ({r.status_code}), retrying in {wait} seconds. "
+                      f"Concurrency is now {self.limiter.limit}.")
+                attempt += 1
+                continue
+
+            self.limiter.release(dop_hint=dop_hint)
+            return r
+
+    def _send(self, index, parts, changeset):
+        boundary = f"batch_{uuid.uuid4()}"
+        changeset_boundary = f"changeset_{uuid.uuid4()}" if changeset else None
+        body = build_batch_body(boundary, parts, changeset_boundary)
+        headers = {'Content-Type': f'multipart/mixed; boundary="{boundary}"'}
+        if self.continue_on_error and not changeset:
+            headers['Prefer'] = 'odata.continue-on-error'
+
+        timeStart = time.perf_counter()
+        r = self._request(f"Batch {index}", 'POST', self.batch_uri, body, headers)
+        results = parse_batch_response(r, len(parts))
+        return BatchOutcome(index, boundary, results, time.perf_counter() - timeStart)
+
+    def _send_one(self, index, part):
+        headers = dict(part.headers or {})
+        if part.body is not None:
+            headers['Content-Type'] = 'application/json'
+
+        timeStart = time.perf_counter()
+        r = self._request(f"Request {index}", part.method, self.api_uri + part.url, part.body, headers)
+        result = PartResult(r.status_code, r.reason or '', dict(r.headers), r.content.decode('utf-8', errors='replace'))
+        return BatchOutcome(index, "", [result], time.perf_counter() - timeStart)
+
+    def _in_order(self, jobs):
+        window = self.limiter.maximum * 2
+        pending = deque()
+
+        with ThreadPoolExecutor(max_workers=self.limiter.maximum) as executor:
+            try:
+                for job in jobs:
+                    pending.append(executor.submit(*job))
+
+                    while len(pending) >= window:
+                        outcome = pending[0].result()
+                        pending.popleft()
+                        yield outcome
+
+                while pending:
+                    outcome = pending[0].result()
+                    pending.popleft()
+                    yield outcome
+            except GeneratorExit:
+                for future in pending:
+                    future.cancel()
+                raise
+            except BaseException:
+                # The run stops (Ctrl+C, error while reading the input...): the batches
+                # that were not started are dropped, the outcomes of those already sent
+                # are still yielded so they get recorded and are not sent again on resume.
+                for future in pending:
+                    future.cancel()
+                for future in pending:
+                    if future.cancelled() or future.exception() is not None:
+                        break
+                    yield future.result()
+                raise
+
+    def submit(self, batches, changeset=False):
+        """Submits every batch (an iterable of lists of BatchPart) and yields a
+        BatchOutcome per batch, in submission order."""
+        def jobs():
+            for index, parts in enumerate(batches):
+                parts = list(parts)
+                if len(parts) > MAX_BATCH_SIZE:
+                    raise ValueError(f"A batch can contain at most {MAX_BATCH_SIZE} requests")
+                yield self._send, index, parts, changeset
+
+        return self._in_order(jobs())
+
+    def submit_each(self, parts):
+        """Sends every BatchPart as its own request (used for bulk messages such as
+        UpdateMultiple) and yields a BatchOutcome per part, in submission order."""
+        return self._in_order((self._send_one, index, part) for index, part in enumerate(parts))
+
+
+def chunked(items, size):
+    """Splits a sequence into lists of at most `size` items."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,97 @@
+import json
+from collections import deque
+from batch_engine import MAX_BATCH_SIZE, BatchPart, PartResult, is_success
+
+# CreateMultiple / UpdateMultiple / UpsertMultiple support for the bulk operations.
+# https://learn.microsoft.com/en-us/power-apps/developer/data-platform/bulk-operations
+#
+# The records are grouped into one bulk message request per chunk (at most
+# `chunk_size` records and MAX_MESSAGE_BYTES of payload). The requests go through
+# the batch engine, so they share its concurrency limit and throttling handling.
+#
+# Tables that do not support the message are sent through $batch instead. When a
+# bulk message request fails, its records are resent in one $batch so each record
+# gets its own status (bulk messages are all or nothing on standard tables).
+
+BULK_MESSAGES = ('CreateMultiple', 'UpdateMultiple', 'UpsertMultiple')
+
+MAX_MESSAGE_BYTES = 8 * 1024 * 1024
+
+
+def supports_message(context, entity, message):
+    """True if the table behind the entity set name supports the bulk message."""
+    cache = context.supported_messages
+    if (entity, message) not in cache:
+        logical_name = context.table_metadata(entity)['LogicalName']
+        request_uri = (f"{context.api_uri}sdkmessagefilters?$select=sdkmessagefilterid&$top=1"
+                       f"&$filter=primaryobjecttypecode eq '{logical_name}' and sdkmessageid/name eq '{message}'")
+        r = context.get(request_uri)
+        cache[(entity, message)] = r.status_code == 200 and bool(json.loads(r.content.decode('utf-8')).get('value'))
+    return cache[(entity, message)]
+
+
+def _chunks(items, chunk_size, max_bytes):
+    chunk = []
+    size = 0
+    for target, part in items:
+        if chunk and (len(chunk) == chunk_size or size + len(target) > max_bytes):
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append((target, part))
+        size += len(target) + 1
+    if chunk:
+        yield chunk
+
+
+def _results(message, result, size):
+    """One result per record of a successful bulk message request."""
+    if message == 'CreateMultiple' and result.body:
+        ids = json.loads(result.body).get('Ids', [])
+        if len(ids) == size:
+            return [PartResult(result.status, result.reason, {'OData-EntityId': record_id}, '') for record_id in ids]
+    return [result] * size
+
+
+def run_multiple(context, entity, message, items, chunk_size=None):
+    """Sends the records with a bulk message and yields one BatchOutcome per request, in order.
+
+    Args:
+        context: BulkContext
+        entity: entity set name
+        message: one of BULK_MESSAGES
+        items: iterable of (target, part) where target is the JSON bytes of the record
+            for the Targets collection (with its '@odata.type' and key) and part is
+            the equivalent BatchPart used when falling back to $batch
+        chunk_size: records per request, defaults to the batch size of the context
+    """
+    if message not in BULK_MESSAGES:
+        raise ValueError(f"Unknown bulk message {message}")
+
+    chunk_size = min(chunk_size or context.batch_size, MAX_BATCH_SIZE)
+
+    if not supports_message(context, entity, message):
+        print(f"{entity} does not support {message}, sending the records in $batch instead.")
+        yield from context.run((part for _, part in items))
+        return
+
+    pending = deque()
+
+    def requests():
+        for chunk in _chunks(items, chunk_size, MAX_MESSAGE_BYTES):
+            pending.append(chunk)
+            body = b'{"Targets":[' + b','.join(target for target, _ in chunk) + b']}'
+            yield BatchPart('POST', f"{entity}/Microsoft.Dynamics.CRM.{message}", body)
+
+    for outcome in context.engine.submit_each(requests()):
+        chunk = pending.popleft()
+        result = outcome.results[0]
+
+        if is_success(result):
+            yield outcome._replace(results=_results(message, result, len(chunk)))
+            continue
+
+        print(f"{message} request {outcome.index} failed ({result.status}), "
+              f"resending its {len(chunk)} records in $batch.")
+        fallback, = context.engine.submit([[part for _, part in chunk]])
+        yield fallback._replace(index=outcome.index)
@@ -0,0 +1,698 @@
+import authenticate_with_msal
+import json
+import os
+import time
+import pandas as pd
+from collections import deque
+from urllib.parse import quote
+from batch_engine import BatchEngine, BatchOutcome, BatchPart, PartResult, chunked, code_of, is_success, retry_after, THROTTLED_STATUS_CODES
+from bulk_messages import run_multiple
+from json_stream import CollectionReader
+from progress_journal import DONE, FAILED, SKIPPED, ProgressJournal
+from serialization import dumps, record_bytes, row_dicts, with_fields
+from request_trace import trace_requests
+from transfer_stats import measure_transfers
+
+# Shared implementation of the bulk operations behind pcd.py and the pcd_* scripts.
+# Every operation turns the CSV rows into BatchParts and runs them through the same
+# BulkContext, which owns the authenticated session, the batch engine, the retry
+# policy and the result reporting.
+
+
+class BulkContext:
+    """Authenticated session, batch engine and settings shared by the bulk operations.
+
+    Args:
+        session: authenticated requests.Session (from getAuthenticatedSession)
+        environmentURI: environment URI ending with '/'
+        batch_size: number of records per $batch request (max 1000)
+        concurrency: number of batches in flight at start
+        max_concurrency: upper bound for the number of batches in flight
+        max_retries: number of resubmissions of a throttled request
+        output_dir: folder receiving the result CSVs
+        compress_requests: gzip the large request bodies (see BatchEngine)
+
+    A ProgressJournal can be attached with open_journal, the operations then record
+    each row in it and, when resuming, only send the rows that are not done yet.
+    """
+
+    def __init__(self, session, environmentURI, batch_size=500, concurrency=4, max_concurrency=16,
+                 max_retries=5, output_dir="output", compress_requests=False):
+        self.session = session
+        self.environmentURI = environmentURI
+        self.api_uri = f'{environmentURI}api/data/v9.2/'
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.output_dir = output_dir
+        self.engine = BatchEngine(session, environmentURI, concurrency=concurrency,
+                                  max_concurrency=max_concurrency, max_retries=max_retries,
+                                  compress_requests=compress_requests)
+        self.transfer_stats = measure_transfers(session)
+        self.request_tracer = trace_requests(session)
+        self._table_metadata = {}
+        self.supported_messages = {}
+        self.journal = None
+        self.resume = False
+
+    @classmethod
+    def from_environment(cls, PathToEnvironmentJSON, **kwargs):
+        """Authenticates once and builds a context sized for the requested concurrency."""
+        pool_size = max(kwargs.get('max_concurrency', 16), 1)
+        session, environmentURI = authenticate_with_msal.getAuthenticatedSession(PathToEnvironmentJSON, pool_size)
+        return cls(session, environmentURI, **kwargs)
+
+    def _request(self, method, url, body=None, headers=None, stream=False):
+        attempt = 0
+        while True:
+            r = self.session.request(method, url, data=body, headers=headers, stream=stream)
+            if r.status_code in THROTTLED_STATUS_CODES and attempt < self.max_retries:
+                r.close()
+                time.sleep(retry_after(r, attempt))
+                attempt += 1
+                continue
+            return r
+
+    def get(self, url, headers=None, stream=False):
+        """GET outside of a batch, retrying when throttled. Returns the requests.Response."""
+        return self._request('GET', url, headers=headers, stream=stream)
+
+    def send(self, part):
+        """Sends a single request outside of a batch, retrying when throttled."""
+        headers = dict(part.headers or {})
+        if part.body is not None:
+            headers['Content-Type'] = 'application/json'
+
+        r = self._request(part.method, self.api_uri + part.url, part.body, headers)
+        return PartResult(r.status_code, r.reason or '', dict(r.headers), r.content.decode('utf-8', errors='replace'))
+
+    def run(self, parts, batch=True):
+        """Runs the parts and yields one BatchOutcome per `batch_size` records, in order.
+
+        With batch=False every part is sent as its own request, the outcomes are
+        grouped the same way so the reporting does not change."""
+        chunks = chunked(parts, self.batch_size)
+
+        if batch:
+            yield from self.engine.submit(chunks)
+            return
+
+        for index, chunk in enumerate(chunks):
+            timeStart = time.perf_counter()
+            results = []
+            try:
+                for part in chunk:
+                    results.append(self.send(part))
+            except BaseException:
+                # The requests already answered are recorded before the error goes up
+                if results:
+                    yield BatchOutcome(index, "", results, time.perf_counter() - timeStart)
+                raise
+            yield BatchOutcome(index, "", results, time.perf_counter() - timeStart)
+
+    def table_metadata(self, entity):
+        """LogicalName and PrimaryIdAttribute of the table behind an entity set name."""
+        if entity not in self._table_metadata:
+            request_uri = (f"{self.api_uri}EntityDefinitions?$select=LogicalName,PrimaryIdAttribute"
+                           f"&$filter=EntitySetName eq '{entity}'")
+            r = self.get(request_uri)
+            values = json.loads(r.content.decode('utf-8')).get('value', []) if r.status_code == 200 else []
+            if not values:
+                raise ValueError(f"No table found for the entity set {entity}. Error {r.status_code}")
+            self._table_metadata[entity] = values[0]
+        return self._table_metadata[entity]
+
+    def open_journal(self, path, operation, input_path, resume=False):
+        """Attaches a progress journal for the next operation. With resume=True, the
+        rows completed by the previous run of the same operation are not sent again."""
+        self.journal = ProgressJournal(path)
+        self.journal.start(operation, input_path, resume=resume)
+        self.resume = resume
+        return self.journal
+
+    def output_path(self, name):
+        os.makedirs(self.output_dir, exist_ok=True)
+        return os.path.join(self.output_dir, name)
+
+
+class ResultReport:
+    """Writes the per-record results of an operation to the output CSV as they arrive.
+
+    The input is read in chunks (DataFrames). Each row keeps its position in the
+    input, and the result CSV is the input with the 'codes', 'messages' and 'batch'
+    columns written by the original scripts. A chunk is appended to the file as soon
+    as all its rows have a result, so only the chunks still in flight are in memory
+    and the rows stay in input order."""
+
+    def __init__(self, context, action, output_name):
+        self.context = context
+        self.action = action
+        self.output_file = context.output_path(output_name)
+        self.total = 0
+        self.successes = 0
+        self.failures = 0
+        self.skipped = 0
+        self.timeStart = time.perf_counter()
+        self._header = True
+        self._chunks = deque()     # [rows, codes, messages, batches, rows without result]
+        self._submitted = deque()  # (chunk, offset) of the rows sent, in submission order
+
+    def pending(self, source):
+        """Yields the rows to send, chunk by chunk, as DataFrames indexed by their position
+        in the input. When resuming, the rows completed by the previous run are filled
+        from the journal and left out."""
+        journal = self.context.journal
+
+        for rows in _chunks_of(source):
+            first = self.total
+            rows = rows.set_axis(pd.RangeIndex(first, first + len(rows.index)), axis=0, copy=False)
+            self.total += len(rows.index)
+            if rows.empty:
+                continue
+
+            size = len(rows.index)
+            chunk = [rows, [""] * size, [""] * size, [""] * size, size]
+            self._chunks.append(chunk)
+
+            if journal is not None and self.context.resume:
+                completed = journal.completed(first, first + size - 1)
+                for position, (state, code, message, batch) in completed.items():
+                    self._set(chunk, position - first, code, message, batch)
+                    if state == SKIPPED:
+                        self.skipped += 1
+                    else:
+                        self.successes += 1
+                if completed:
+                    print(f"Resuming: rows {first} : {first + size - 1}, {len(completed)} completed by the previous run.")
+                    rows = rows.drop(index=list(completed))
+
+            self._flush()
+            if not rows.empty:
+                yield rows
+
+    def track(self, items):
+        """Takes (position, item) pairs and passes the items through, remembering the order
+        in which the rows are submitted and recording it in the journal."""
+        journal = self.context.journal
+        submitted = []
+
+        for position, item in items:
+            self._submitted.append(self._locate(position))
+            if journal is not None:
+                submitted.append(position)
+                if len(submitted) >= self.context.batch_size:
+                    journal.sent(submitted)
+                    submitted = []
+            yield item
+
+        if submitted:
+            journal.sent(submitted)
+
+    def _locate(self, position):
+        for chunk in reversed(self._chunks):
+            first = chunk[0].index[0]
+            if position >= first:
+                return chunk, position - first
+        raise KeyError(position)
+
+    def _set(self, chunk, offset, code, message, batch):
+        chunk[1][offset] = code
+        chunk[2][offset] = message
+        chunk[3][offset] = batch
+        chunk[4] -= 1
+
+    def _flush(self, force=False):
+        while self._chunks and (force or self._chunks[0][4] == 0):
+            rows, codes, messages, batches, _ = self._chunks.popleft()
+            rows = rows.assign(codes=codes, messages=messages, batch=batches)
+            rows.to_csv(self.output_file, mode='w' if self._header else 'a', header=self._header)
+            self._header = False
+
+    def record(self, outcome):
+        """Writes the results of an outcome to the next submitted rows."""
+        positions = []
+        codes = []
+        messages = []
+        failures = 0
+
+        for result in outcome.results:
+            chunk, offset = self._submitted.popleft()
+            code = code_of(result)
+            message = result.body or result.headers.get('OData-EntityId', '')
+            self._set(chunk, offset, code, message, outcome.boundary)
+
+            positions.append(chunk[0].index[offset])
+            codes.append(code)
+            messages.append(message)
+            if not is_success(result):
+                failures += 1
+
+        if self.context.journal is not None:
+            states = [DONE if is_success(result) else FAILED for result in outcome.results]
+            self.context.journal.record(positions, states, codes, messages, outcome.boundary)
+
+        self.failures += failures
+        self.successes += len(outcome.results) - failures
+        self._flush()
+
+        if positions:
+            print(f"Records {positions[0]} : {positions[-1]} sent for {self.action}. {failures} failures.")
+
+    def skip(self, positions, message):
+        """Marks rows that do not need to be sent."""
+        for position in positions:
+            chunk, offset = self._locate(position)
+            self._set(chunk, offset, "skipped", message, "")
+        self.skipped += len(positions)
+
+        if self.context.journal is not None:
+            self.context.journal.record(positions, [SKIPPED] * len(positions), ["skipped"] * len(positions),
+                                        [message] * len(positions), "")
+        self._flush()
+
+    def fail(self, positions, message):
+        """Marks rows that cannot be sent (e.g. an empty key) as failed."""
+        for position in positions:
+            chunk, offset = self._locate(position)
+            self._set(chunk, offset, "invalid", message, "")
+        self.failures += len(positions)
+
+        if self.context.journal is not None:
+            self.context.journal.record(positions, [FAILED] * len(positions), ["invalid"] * len(positions),
+                                        [message] * len(positions), "")
+        self._flush()
+
+    def consume(self, outcomes):
+        """Records every outcome."""
+        for outcome in outcomes:
+            self.record(outcome)
+
+    def finish(self):
+        """Writes the rows left (without result if the operation stopped early), prints the
+        summary and returns the path of the result CSV."""
+        self._flush(force=True)
+        if self._header:
+            pd.DataFrame(columns=['codes', 'messages', 'batch']).to_csv(self.output_file)
+
+        print(f'{self.successes} RECORDS SUCCEEDED OF {self.total} EXPECTED. {self.failures} FAILURES.'
+              + (f' {self.skipped} SKIPPED.' if self.skipped else ''))
+        print(f'{self.action.upper()} TOOK: {round(time.perf_counter() - self.timeStart,0)} SECONDS ')
+        print(f'Transfers: {self.context.transfer_stats.summary()}')
+        print(f'Round trips: {self.context.request_tracer.summary()}')
+        if self.context.journal is not None:
+            print(f'Progress journal: {self.context.journal.path} {self.context.journal.counts()}')
+        print(f'Results written to {self.output_file}')
+        return self.output_file
+
+
+def _chunks_of(source):
+    """Accepts a DataFrame or an iterable of DataFrames (read_csv with chunksize)."""
+    if isinstance(source, pd.DataFrame):
+        return [source]
+    return source
+
+
+def _dtypes(PathToCSV, dtypes=None):
+    header = pd.read_csv(PathToCSV, nrows=0).columns
+    dtypes = dict(dtypes or {})
+    for column in header:
+        if column.endswith('@odata.bind'):
+            dtypes.setdefault(column, "object")
+    return dtypes
+
+
+def read_records_csv(PathToCSV, dtypes=None, chunksize=None):
+    """Reads a CSV of records. Lookup columns ('...@odata.bind') are always read as text.
+
+    With chunksize, returns an iterator of DataFrames of chunksize rows, so the
+    operations can start sending the first rows before the file is read and keep a
+    flat memory use whatever the size of the file."""
+    return pd.read_csv(PathToCSV, dtype=_dtypes(PathToCSV, dtypes), chunksize=chunksize)
+
+
+def _targets(context, entity, bodies, keys=None):
+    """JSON bytes of the records for the Targets collection of a bulk message, built from
+    the already encoded bodies. `keys` gives the primary key value of each record, if any."""
+    metadata = context.table_metadata(entity)
+    odata_type = f"Microsoft.Dynamics.CRM.{metadata['LogicalName']}"
+    if keys is None:
+        return (with_fields({"@odata.type": odata_type}, body) for body in bodies)
+    return (with_fields({"@odata.type": odata_type, metadata['PrimaryIdAttribute']: key}, body)
+            for key, body in zip(keys, bodies))
+
+
+def create_records(context, entity, source, batch=True, create_multiple=False, output_name="imported.csv"):
+    """Creates one record of `entity` (entity set name) per row of source (a DataFrame or
+    an iterator of DataFrames).
+
+    With create_multiple=True the records are sent with the CreateMultiple message,
+    falling back to $batch when the table does not support it."""
+    report = ResultReport(context, "import", output_name)
+
+    def items():
+        for rows in report.pending(source):
+            bodies = record_bytes(rows)
+            parts = (BatchPart('POST', entity, body) for body in bodies)
+            if create_multiple:
+                yield from zip(rows.index, zip(_targets(context, entity, bodies), parts))
+            else:
+                yield from zip(rows.index, parts)
+
+    if create_multiple:
+        report.consume(run_multiple(context, entity, 'CreateMultiple', report.track(items())))
+    else:
+        report.consume(context.run(report.track(items()), batch=batch))
+    return report.finish()
+
+
+def update_records(context, entity, source, batch=True, update_multiple=False, output_name="updated.csv"):
+    """Updates the records whose id is in the GUID column with the other columns.
+
+    With update_multiple=True the records are sent with the UpdateMultiple message,
+    falling back to $batch when the table does not support it."""
+    report = ResultReport(context, "update", output_name)
+
+    def items():
+        for rows in report.pending(source):
+            bodies = record_bytes(rows.drop(columns='GUID'))
+            parts = (BatchPart('PATCH', f"{entity}({guid})", body, {'If-Match': '*'})
+                     for guid, body in zip(rows['GUID'], bodies))
+            if update_multiple:
+                yield from zip(rows.index, zip(_targets(context, entity, bodies, rows['GUID']), parts))
+            else:
+                yield from zip(rows.index, parts)
+
+    if update_multiple:
+        report.consume(run_multiple(context, entity, 'UpdateMultiple', report.track(items())))
+    else:
+        report.consume(context.run(report.track(items()), batch=batch))
+    return report.finish()
+
+
+def _key_literal(value):
+    """OData literal of an alternate key value, percent-encoded for the URL."""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, str):
+        return quote("'" + value.replace("'", "''") + "'", safe="'")
+    if isinstance(value, float):
+        if value != value:
+            raise ValueError("An alternate key value is empty")
+        # Integer columns with empty cells are read as floats: 123.0 is the key 123
+        if value.is_integer():
+            return str(int(value))
+    return str(value)
+
+
+def alternate_key_path(entity, key):
+    """URL of a record identified by an alternate key, e.g. contacts(emailaddress1='a@b.com').
+    `key` maps each key column to its value."""
+    return f"{entity}(" + ",".join(f"{column}={_key_literal(value)}" for column, value in key.items()) + ")"
+
+
+def upsert_records(context, entity, source, alternate_keys=None, batch=True, upsert_multiple=False,
+                   output_name="upserted.csv"):
+    """Creates or updates one record per row, identified by the GUID column or, when
+    alternate_keys (list of columns) is given, by the alternate key made of those columns.
+
+    An upsert can be repeated safely: a rerun after a partial failure updates the records
+    that were already created instead of duplicating them. Rows with an empty key value
+    are not sent and are reported as invalid.
+
+    With upsert_multiple=True the records are sent with the UpsertMultiple message,
+    falling back to $batch when the table does not support it."""
+    report = ResultReport(context, "upsert", output_name)
+    key_columns = list(alternate_keys) if alternate_keys else ['GUID']
+
+    def items():
+        for rows in report.pending(source):
+            # A row without a value for every key column cannot be addressed
+            empty = rows[key_columns].isna().any(axis=1)
+            if empty.any():
+                report.fail(list(rows.index[empty]), f"empty key ({', '.join(key_columns)})")
+                rows = rows[~empty]
+                if rows.empty:
+                    continue
+            bodies = record_bytes(rows.drop(columns=key_columns))
+
+            if alternate_keys:
+                keys = list(row_dicts(rows[key_columns]))
+                paths = [alternate_key_path(entity, key) for key in keys]
+            else:
+                paths = [f"{entity}({guid})" for guid in rows['GUID']]
+
+            parts = (BatchPart('PATCH', path, body) for path, body in zip(paths, bodies))
+
+            if not upsert_multiple:
+                yield from zip(rows.index, parts)
+            elif alternate_keys:
+                odata_type = f"Microsoft.Dynamics.CRM.{context.table_metadata(entity)['LogicalName']}"
+                targets = (with_fields({"@odata.type": odata_type, "@odata.id": path, **key}, body)
+                           for path, key, body in zip(paths, keys, bodies))
+                yield from zip(rows.index, zip(targets, parts))
+            else:
+                yield from zip(rows.index, zip(_targets(context, entity, bodies, rows['GUID']), parts))
+
+    if upsert_multiple:
+        report.consume(run_multiple(context, entity, 'UpsertMultiple', report.track(items())))
+    else:
+        report.consume(context.run(report.track(items()), batch=batch))
+    return report.finish()
+
+
+def delete_records(context, entity, source, batch=True, output_name="changes.csv"):
+    """Deletes the records whose id is in the GUID column."""
+    report = ResultReport(context, "deletion", output_name)
+
+    items = ((position, BatchPart('DELETE', f"{entity}({guid})"))
+             for rows in report.pending(source) for position, guid in rows['GUID'].items())
+
+    report.consume(context.run(report.track(items), batch=batch))
+    return report.finish()
+
+
+def existing_links(context, entity, other_entity, relationship, record_ids):
+    """Reads the records of other_entity already linked to each record of entity
+    through the M:N relationship. Returns a set of (record id, other record id)."""
+    other_key = context.table_metadata(other_entity)['PrimaryIdAttribute']
+    record_ids = list(record_ids)
+    parts = (BatchPart('GET', f"{entity}({record_id})/{relationship}?$select={other_key}")
+             for record_id in record_ids)
+
+    links = set()
+    for record_id, outcome in zip(record_ids, context.engine.submit_each(parts)):
+        result = outcome.results[0]
+        if not is_success(result):
+            raise RuntimeError(f"Could not read the {relationship} links of {record_id}. "
+                               f"Error {result.status}: {result.body}")
+
+        page = json.loads(result.body)
+        while True:
+            links.update((str(record_id).lower(), str(value[other_key]).lower()) for value in page.get('value', []))
+            if '@odata.nextLink' not in page:
+                break
+            r = context.get(page['@odata.nextLink'])
+            page = json.loads(r.content.decode('utf-8'))
+
+    return links
+
+
+def associate_records(context, entity_m, entity_n, relationship, source, batch=True, skip_existing=True,
+                      output_name="associated.csv"):
+    """Links the records of the entity_m column to the records of the entity_n column
+    through the M:N relationship. Column names in the CSV must match entity_m and entity_n.
+
+    With skip_existing=True the current links are read first (from the side with the
+    fewest distinct records) and pairs that are already linked, or repeated in the CSV,
+    are marked as skipped instead of being sent. `source` must then be a DataFrame or a
+    function returning a new iterator of DataFrames, as the ids are read in a first pass."""
+    report = ResultReport(context, "association", output_name)
+
+    def chunks():
+        return source() if callable(source) else _chunks_of(source)
+
+    def pairs(rows):
+        return zip(rows.index, rows[entity_m].astype(str).str.lower(), rows[entity_n].astype(str).str.lower())
+
+    existing = set()
+    if skip_existing:
+        ids_m = set()
+        ids_n = set()
+        for rows in chunks():
+            ids_m.update(rows[entity_m].astype(str).str.lower())
+            ids_n.update(rows[entity_n].astype(str).str.lower())
+
+        if len(ids_m) <= len(ids_n):
+            existing = existing_links(context, entity_m, entity_n, relationship, ids_m)
+        else:
+            existing = {(record_m, record_n) for record_n, record_m in
+                        existing_links(context, entity_n, entity_m, relationship, ids_n)}
+        print(f"{len(existing)} existing links read.")
+
+    seen = set()
+
+    def items():
+        for rows in report.pending(chunks()):
+            already_linked = []
+            repeated = []
+            for position, record_m, record_n in pairs(rows):
+                pair = (record_m, record_n)
+                if pair in existing:
+                    already_linked.append(position)
+                elif skip_existing and pair in seen:
+                    repeated.append(position)
+                else:
+                    seen.add(pair)
+                    yield position, BatchPart('POST', f"{entity_m}({record_m})/{relationship}/$ref",
+                                              dumps({"@odata.id": f"{context.api_uri}{entity_n}({record_n})"}))
+
+            if already_linked:
+                report.skip(already_linked, "already linked")
+            if repeated:
+                report.skip(repeated, "duplicate pair in the CSV")
+
+    report.consume(context.run(report.track(items()), batch=batch))
+    return report.finish()
+
+
+def option_value_payload(option_set, value, label, color, language_code, solution):
+    """Body of an InsertOptionValue request."""
+    localized_label = {
+        "@odata.type": "Microsoft.Dynamics.CRM.LocalizedLabel",
+        "Label": label,
+        "LanguageCode": language_code,
+        "IsManaged": 'false'
+    }
+    return {
+        "OptionSetName": option_set,
+        "Value": value,
+        "Color": color,
+        "Label": {
+            "@odata.type": "Microsoft.Dynamics.CRM.Label",
+            "LocalizedLabels": [localized_label],
+            "UserLocalizedLabel": localized_label
+        },
+        "SolutionUniqueName": solution
+    }
+
+
+def existing_options(context, option_set, language_code=1033):
+    """Values and labels (in the given language) of the options of a global option set."""
+    r = context.get(f"{context.api_uri}GlobalOptionSetDefinitions(Name='{option_set}')")
+    if r.status_code != 200:
+        print(f"Could not read the option set {option_set} ({r.status_code}), existing options are not checked.")
+        return set(), set()
+
+    values = set()
+    labels = set()
+    for option in json.loads(r.content.decode('utf-8')).get('Options', []):
+        values.add(option.get('Value'))
+        for localized_label in (option.get('Label') or {}).get('LocalizedLabels', []):
+            if localized_label.get('LanguageCode') == language_code:
+                labels.add(localized_label.get('Label'))
+    return values, labels
+
+
+def add_options(context, option_set, first_value, source, language_code=1033, solution=None, batch=True,
+                skip_existing=True, output_name="options.csv"):
+    """Inserts one option per row (columns Label and Color) into a global option set.
+    Each new label gets the next value from first_value upwards that is not used yet. Rows
+    whose label already exists (or appears earlier in the CSV) are skipped. With batch, each batch of options is sent as one $batch changeset, so it is
+    applied entirely or not at all; batches are sent one after the other, as metadata changes
+    cannot run in parallel. Stops at the first error like the original script."""
+    report = ResultReport(context, "insertion", output_name)
+
+    values, labels = existing_options(context, option_set, language_code) if skip_existing else (set(), set())
+    if skip_existing:
+        print(f"{len(values)} existing options read.")
+
+    next_value = first_value
+
+    def items():
+        nonlocal next_value
+        for rows in report.pending(source):
+            existing = []
+            for position, label, color in zip(rows.index, rows["Label"], rows["Color"]):
+                if skip_existing:
+                    if label in labels:
+                        existing.append(position)
+                        continue
+                    labels.add(label)
+                while next_value in values:
+                    next_value += 1
+                value = next_value
+                values.add(value)
+                payload = option_value_payload(option_set, value, label, color, language_code, solution)
+                yield position, BatchPart('POST', 'InsertOptionValue', dumps(payload))
+
+            if existing:
+                report.skip(existing, "option already exists")
+
+    for index, chunk in enumerate(chunked(report.track(items()), context.batch_size)):
+        if batch:
+            outcome, = context.engine.submit([chunk], changeset=True)
+            results = outcome.results
+            report.record(outcome._replace(index=index))
+        else:
+            results = []
+            for part in chunk:
+                results.append(context.send(part))
+                if not is_success(results[-1]):
+                    break
+            report.record(BatchOutcome(index, "", results, 0.0))
+
+        failed = [result for result in results if not is_success(result)]
+        if failed:
+            print(failed[0].body)
+            break
+
+    return report.finish()
+
+
+def download_table(context, entity, select=None, filter=None, top=None, output_name=None, page_size=5000):
+    """Downloads the records of `entity` and writes them to a JSON file in the output folder.
+
+    The pages (Prefer: odata.maxpagesize) are followed with @odata.nextLink, like
+    download.py at the root of the repo, and written to the file as they arrive.
+    Returns the number of records, or None if a request failed (no file is written)."""
+    query_options = []
+    if select:
+        query_options.append(f'$select={select}')
+    if filter:
+        query_options.append(f'$filter={filter}')
+    if top:
+        query_options.append(f'$top={top}')
+
+    request_uri = f'{context.api_uri}{entity}'
+    if query_options:
+        request_uri += '?' + '&'.join(query_options)
+    headers = {'Prefer': f'odata.maxpagesize={page_size}'}
+
+    count = 0
+    output_file = context.output_path(output_name or f"{entity}.json")
+    # Written under a temporary name and renamed once complete, so a failed download
+    # never leaves a truncated JSON file under the final name
+    partial_file = output_file + ".part"
+    try:
+        with open(partial_file, "w") as outfile:
+            outfile.write("[")
+            while request_uri:
+                r = context.get(request_uri, headers=headers, stream=True)
+                if r.status_code != 200:
+                    print(f"Request failed. Error code: {r.status_code}")
+                    print(r.content.decode('utf-8'))
+                    return None
+
+                reader = CollectionReader(r, context.transfer_stats)
+                for record in reader:
+                    outfile.write(("\n" if count == 0 else ",\n") + json.dumps(record, indent=True))
+                    count += 1
+                request_uri = reader.next_link
+                print(f"{count} records downloaded" + ("..." if request_uri else "."))
+            outfile.write("\n]")
+        os.replace(partial_file, output_file)
+    finally:
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+
+    print(f"Records written to {output_file}")
+    return count
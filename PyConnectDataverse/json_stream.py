@@ -0,0 +1,134 @@
+import json
+import pandas as pd
+
+try:
+    import ijson  # optional, pip install ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson  # optional, pip install orjson
+except ImportError:
+    orjson = None
+
+# Incremental reading of the collections returned by the Web API
+# ({"@odata.context": ..., "value": [...], "@odata.nextLink": ...}).
+#
+# With ijson, the records are parsed while the (decompressed) body is being
+# downloaded and handed over one by one: neither the whole body nor the list of
+# records of a page is held in memory. Without ijson, the body is read at once and
+# parsed with orjson, or json.
+#
+# ColumnBuffer collects the records straight into one list per column, which is
+# what pd.DataFrame is built from.
+
+READ_SIZE = 64 * 1024
+
+
+class _CountingReader:
+    def __init__(self, raw):
+        self.raw = raw
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.size += len(data)
+        return data
+
+
+class CollectionReader:
+    """Iterates over the records of a collection response requested with stream=True.
+
+    Once the iteration is over, next_link holds '@odata.nextLink' (None on the last
+    page) and found_value tells whether the response had a 'value' array.
+    """
+
+    def __init__(self, response, transfer_stats=None):
+        self.response = response
+        self.transfer_stats = transfer_stats
+        self.next_link = None
+        self.found_value = False
+
+    def __iter__(self):
+        try:
+            if ijson is not None:
+                yield from self._parse_stream()
+            else:
+                yield from self._parse_body()
+        finally:
+            self.response.close()
+
+    def _parse_stream(self):
+        self.response.raw.decode_content = True
+        reader = _CountingReader(self.response.raw)
+        builder = None
+
+        for prefix, event, value in ijson.parse(reader, buf_size=READ_SIZE, use_float=True):
+            if builder is not None:
+                builder.event(event, value)
+                if prefix == 'value.item' and event in ('end_map', 'end_array'):
+                    yield builder.value
+                    builder = None
+            elif prefix == 'value.item':
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+                if event not in ('start_map', 'start_array'):
+                    yield builder.value
+                    builder = None
+            elif prefix == 'value' and event == 'start_array':
+                self.found_value = True
+            elif prefix == '@odata.nextLink':
+                self.next_link = value
+
+        if self.transfer_stats is not None:
+            self.transfer_stats.record_response(self.response, reader.size)
+
+    def _parse_body(self):
+        body = self.response.content
+        raw = orjson.loads(body) if orjson is not None else json.loads(body.decode('utf-8'))
+        if self.transfer_stats is not None:
+            self.transfer_stats.record_response(self.response, len(body))
+
+        self.found_value = 'value' in raw
+        self.next_link = raw.get('@odata.nextLink')
+        values = raw.get('value', [])
+        del raw
+        yield from values
+
+
+class ColumnBuffer:
+    """Records gathered as one list per column.
+
+    Args:
+        keep: function telling whether a column is kept (all columns by default)
+    """
+
+    def __init__(self, keep=None):
+        self.columns = {}
+        self.rows = 0
+        self.keep = keep
+        self._dropped = set()
+
+    def append(self, record):
+        for key, value in record.items():
+            column = self.columns.get(key)
+            if column is None:
+                if key in self._dropped:
+                    continue
+                if self.keep is not None and not self.keep(key):
+                    self._dropped.add(key)
+                    continue
+                column = self.columns[key] = [None] * self.rows
+            column.append(value)
+
+        self.rows += 1
+        for column in self.columns.values():
+            if len(column) < self.rows:
+                column.append(None)
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def to_frame(self):
+        return pd.DataFrame(self.columns)
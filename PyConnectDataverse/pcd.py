@@ -0,0 +1,173 @@
+import argparse
+import os
+import pandas as pd
+import bulk_operations
+from bulk_operations import BulkContext
+
+# Single entry point for the bulk operations.
+#
+#   python pcd.py --env example-env.json create contacts data/pcd_create_records.csv
+#   python pcd.py --env example-env.json update contacts data/pcd_update_records.csv
+#   python pcd.py --env example-env.json upsert contacts data/pcd_update_records.csv --upsert-multiple
+#   python pcd.py --env example-env.json upsert contacts data/contacts.csv --key emailaddress1
+#   python pcd.py --env example-env.json delete contacts data/pcd_delete_records.csv
+#   python pcd.py --env example-env.json associate systemusers teams teammembership_association "data/M to N.csv"
+#   python pcd.py --env example-env.json options "OPTION SET NAME" data/OptionsToAdd.csv --first-value 201300004 --solution "SOLUTION NAME"
+#   python pcd.py --env example-env.json download systemusers --select firstname,lastname
+#
+# All subcommands authenticate once and share the same pooled session, batch engine,
+# retry policy and result CSVs (written to --output-dir).
+#
+# The progress of every row is recorded in a journal (output/<command>-<csv name>.journal.db
+# by default). If a run dies, rerun the same command with --resume to only send the rows
+# that did not succeed.
+#
+# --trace run-trace.json records every call made to Dataverse (URL, status, latency,
+# sizes, x-ms-service-request-id) and writes them as OpenTelemetry spans at the end,
+# see request_trace.py.
+#
+# To try the commands offline, start the local stand-in server at the root of the repo
+# (python mock_dataverse.py --env-file PyConnectDataverse/mock-env.json) and pass
+# --env mock-env.json.
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="pcd", description="Bulk operations on Dataverse tables.")
+    parser.add_argument("--env", default="example-env.json", help="path to the environment JSON file")
+    parser.add_argument("--batch-size", type=int, default=500, help="records per $batch request (max 1000)")
+    parser.add_argument("--concurrency", type=int, default=4, help="batches in flight at start")
+    parser.add_argument("--max-concurrency", type=int, default=16, help="upper limit for batches in flight")
+    parser.add_argument("--max-retries", type=int, default=5, help="resubmissions of a throttled request")
+    parser.add_argument("--output-dir", default="output", help="folder receiving the result CSVs")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="rows read from the CSV at a time")
+    parser.add_argument("--journal", help="progress journal file (default: in the output folder)")
+    parser.add_argument("--resume", action="store_true", help="skip the rows completed by the previous run")
+    parser.add_argument("--compress-requests", action="store_true",
+                        help="gzip the large request bodies (responses are always compressed)")
+    parser.add_argument("--trace", help="write every call made to Dataverse to this file at the end")
+    parser.add_argument("--trace-format", choices=["otlp", "json"], default="otlp",
+                        help="OpenTelemetry spans (OTLP/JSON) or plain JSON records")
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    create = subparsers.add_parser("create", help="create one record per CSV row")
+    create.add_argument("entity", help="entity set name, e.g. contacts")
+    create.add_argument("csv")
+    create.add_argument("--no-batch", action="store_true", help="send one request per record")
+    create.add_argument("--create-multiple", action="store_true", help="use the CreateMultiple message")
+    create.add_argument("--upsert-key", help="upsert on this alternate key (comma separated columns) "
+                                             "instead of creating, so the import can be rerun safely")
+
+    update = subparsers.add_parser("update", help="update the records of the GUID column")
+    update.add_argument("entity")
+    update.add_argument("csv")
+    update.add_argument("--no-batch", action="store_true", help="send one request per record")
+    update.add_argument("--update-multiple", action="store_true", help="use the UpdateMultiple message")
+
+    upsert = subparsers.add_parser("upsert", help="create or update the records of the GUID column or of an alternate key")
+    upsert.add_argument("entity")
+    upsert.add_argument("csv")
+    upsert.add_argument("--key", help="alternate key columns, comma separated (default: GUID column)")
+    upsert.add_argument("--no-batch", action="store_true", help="send one request per record")
+    upsert.add_argument("--upsert-multiple", action="store_true", help="use the UpsertMultiple message")
+
+    delete = subparsers.add_parser("delete", help="delete the records of the GUID column")
+    delete.add_argument("entity")
+    delete.add_argument("csv")
+    delete.add_argument("--no-batch", action="store_true", help="send one request per record")
+
+    associate = subparsers.add_parser("associate", help="link records through an M:N relationship")
+    associate.add_argument("entity_m", help="entity set name, also the name of the first CSV column")
+    associate.add_argument("entity_n", help="entity set name, also the name of the second CSV column")
+    associate.add_argument("relationship", help="e.g. teammembership_association")
+    associate.add_argument("csv")
+    associate.add_argument("--no-batch", action="store_true", help="send one request per link")
+    associate.add_argument("--keep-existing", action="store_true",
+                           help="do not read the current links, send every pair of the CSV")
+
+    options = subparsers.add_parser("options", help="add options (Label, Color columns) to a global option set")
+    options.add_argument("option_set", help="logical name of the option set")
+    options.add_argument("csv")
+    options.add_argument("--first-value", type=int, required=True, help="lowest value given to the added options (values in use are skipped)")
+    options.add_argument("--language", type=int, default=1033)
+    options.add_argument("--solution", help="unique name of the solution")
+    options.add_argument("--no-batch", action="store_true", help="send one request per option")
+    options.add_argument("--keep-existing", action="store_true",
+                         help="do not read the current options, send every row of the CSV")
+
+    download = subparsers.add_parser("download", help="download the records of a table")
+    download.add_argument("entity")
+    download.add_argument("--select")
+    download.add_argument("--filter")
+    download.add_argument("--top", type=int)
+    download.add_argument("--output", help="name of the JSON file in the output folder")
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    context = BulkContext.from_environment(
+        args.env,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        max_concurrency=args.max_concurrency,
+        max_retries=args.max_retries,
+        output_dir=args.output_dir,
+        compress_requests=args.compress_requests
+    )
+
+    if args.command != "download":
+        csv_name = os.path.splitext(os.path.basename(args.csv))[0]
+        journal = args.journal or os.path.join(args.output_dir, f"{args.command}-{csv_name}.journal.db")
+        target = args.option_set if args.command == "options" else getattr(args, "entity", None) or args.relationship
+        context.open_journal(journal, f"{args.command} {target}", os.path.abspath(args.csv), resume=args.resume)
+
+    if args.command == "create":
+        records = bulk_operations.read_records_csv(args.csv, chunksize=args.chunk_size)
+        if args.upsert_key:
+            bulk_operations.upsert_records(context, args.entity, records, alternate_keys=args.upsert_key.split(","),
+                                           batch=not args.no_batch, upsert_multiple=args.create_multiple,
+                                           output_name="imported.csv")
+        else:
+            bulk_operations.create_records(context, args.entity, records, batch=not args.no_batch,
+                                           create_multiple=args.create_multiple)
+
+    elif args.command == "update":
+        records = bulk_operations.read_records_csv(args.csv, chunksize=args.chunk_size)
+        bulk_operations.update_records(context, args.entity, records, batch=not args.no_batch,
+                                       update_multiple=args.update_multiple)
+
+    elif args.command == "upsert":
+        records = bulk_operations.read_records_csv(args.csv, chunksize=args.chunk_size)
+        alternate_keys = args.key.split(",") if args.key else None
+        bulk_operations.upsert_records(context, args.entity, records, alternate_keys=alternate_keys,
+                                       batch=not args.no_batch, upsert_multiple=args.upsert_multiple)
+
+    elif args.command == "delete":
+        records = pd.read_csv(args.csv, chunksize=args.chunk_size)
+        bulk_operations.delete_records(context, args.entity, records, batch=not args.no_batch)
+
+    elif args.command == "associate":
+        records = lambda: pd.read_csv(args.csv, chunksize=args.chunk_size)
+        bulk_operations.associate_records(context, args.entity_m, args.entity_n, args.relationship, records,
+                                          batch=not args.no_batch, skip_existing=not args.keep_existing)
+
+    elif args.command == "options":
+        records = pd.read_csv(args.csv, chunksize=args.chunk_size)
+        bulk_operations.add_options(context, args.option_set, args.first_value, records,
+                                    language_code=args.language, solution=args.solution, batch=not args.no_batch,
+                                    skip_existing=not args.keep_existing)
+
+    elif args.command == "download":
+        bulk_operations.download_table(context, args.entity, select=args.select, filter=args.filter,
+                                       top=args.top, output_name=args.output)
+
+    if args.trace:
+        context.request_tracer.write(args.trace, args.trace_format)
+        print(f"Trace of the calls written to {args.trace}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,12 @@
 # pip install pandas # if needed
 
+import bulk_operations
 import pandas as pd
-import authenticate_with_msal
+from bulk_operations import BulkContext
+
+# The links already present in Dataverse are read first and skipped, the others are
+# sent as $ref requests in batches. The result of each pair is written to output/associated.csv.
+# Same as: python pcd.py associate systemusers teams teammembership_association "data/M to N.csv"
 
 # Parameters
 PathToEnvironmentJSON = "example-env.json"
@@ -9,39 +14,16 @@ PathToCSV = 'data\M to N.csv'
 EntityM = 'systemusers'
 EntityN = 'teams'
 MToNRelationship = 'teammembership_association'
+BatchSize = 500 # can be up to 1000 requests per batch
+Concurrency = 4 # batches in flight at start
+MaxConcurrency = 16 # upper limit for batches in flight
+Resume = False # True to skip the rows completed by the previous run (output/associated.journal.db)
+ChunkSize = 10000 # rows read from the CSV at a time
 # Column names in CSV must match EntityM and EntityN above
 
-# Getting access token.
-authentication = authenticate_with_msal.getAuthenticatedSession(PathToEnvironmentJSON)
-session = authentication[0]
-environmentURI = authentication[1]
-
-# reading the CSV
-df = pd.read_csv(PathToCSV)
-
-successful_updates = 0
-failures = 0
-expected_updates = len(df)
-
-for index, row in df.iterrows():
-    record_m = row[EntityM]
-    record_n = row[EntityN]
-    
-    request_uri = f'{environmentURI}api/data/v9.2/{EntityM}({record_m})/{MToNRelationship}/$ref'
-    odata_id = f'{environmentURI}api/data/v9.2/{EntityN}({record_n})'
-    post_json = { "@odata.id": odata_id }
+context = BulkContext.from_environment(PathToEnvironmentJSON, batch_size=BatchSize,
+                                       concurrency=Concurrency, max_concurrency=MaxConcurrency)
+context.open_journal("output/associated.journal.db", f"associate {MToNRelationship}", PathToCSV, resume=Resume)
 
-    r = session.post(request_uri, json = post_json)
-    
-    if r.status_code != 204:
-        failures += 1
-        raw = r.content.decode('utf-8')
-        print(f'Error linking {record_m} to {record_n}. Error {r.status_code}: \n{raw}\n')
-    
-    else:
-        successful_updates += 1
-        
-    if index % 10 == 0:
-        print(f"Processed: {index + 1}")
-        
-print(f'{successful_updates} UPDATES MADE OF {expected_updates} EXPECTED UPDATES.\n{failures} FAILURES.') 
\ No newline at end of file
+records = lambda: pd.read_csv(PathToCSV, chunksize=ChunkSize)
+bulk_operations.associate_records(context, EntityM, EntityN, MToNRelationship, records)
@@ -1,69 +1,25 @@
 # pip install pandas # if needed
 
+import bulk_operations
 import pandas as pd
-import authenticate_with_msal
+from bulk_operations import BulkContext
+
+# Same as: python pcd.py options "OPTION SET NAME" data/OptionsToAdd.csv --first-value 201300004 --solution "SOLUTION NAME"
 
 # Parameters
 PathToEnvironmentJSON = "example-env.json"
 PathToOptionSetCSV = "data\OptionsToAdd.csv"
-ValueOfFirstAddedOption = 201300004
+ValueOfFirstAddedOption = 201300004 # lowest value given to the added options, values in use are skipped
 OptionSetLogicalName = "OPTION SET NAME"
 LanguageCode = 1033
 UniqueSolutionName = "SOLUTION NAME"
+UseBatch = True # one $batch changeset per batch of options instead of one request per option
+SkipExisting = True # skip the options whose label is already in the option set
+ChunkSize = 10000 # rows read from the CSV at a time
 
-# Getting access token.
-authentication = authenticate_with_msal.getAuthenticatedSession(PathToEnvironmentJSON)
-session = authentication[0]
-environmentURI = authentication[1]
-
-# reading the CSV
-df = pd.read_csv(PathToOptionSetCSV)
-
-successful_updates = 0
-expected_updates = len(df)
-
-request_uri = f'{environmentURI}api/data/v9.2/InsertOptionValue'
-
-print("Adding...")
-
-for index, row in df.iterrows():
-    label = row["Label"]
-    color = row["Color"]
-    
-    post_json = {
-                "OptionSetName": OptionSetLogicalName,
-                "Value": ValueOfFirstAddedOption,
-                "Color": color,
-                "Label": {
-                    "@odata.type": "Microsoft.Dynamics.CRM.Label",
-                    "LocalizedLabels": [
-                    {
-                        "@odata.type": "Microsoft.Dynamics.CRM.LocalizedLabel",
-                        "Label": label,
-                        "LanguageCode": LanguageCode,
-                        "IsManaged": 'false'
-                    }
-                    ],
-                    "UserLocalizedLabel": {
-                        "@odata.type": "Microsoft.Dynamics.CRM.LocalizedLabel",
-                        "Label": label,
-                        "LanguageCode": LanguageCode,
-                        "IsManaged": 'false'
-                    }
-                },
-                "SolutionUniqueName": UniqueSolutionName
-                }
-
-    r = session.post(request_uri, json = post_json)
-
-    if r.status_code != 200:
-        raw = r.content.decode('utf-8')
-        print(raw)
-        break
-
-    else:
-        print(label)
-        successful_updates += 1
-        ValueOfFirstAddedOption += 1
+context = BulkContext.from_environment(PathToEnvironmentJSON)
 
-print(f'{successful_updates} UPDATES MADE OF {expected_updates} EXPECTED UPDATES') 
\ No newline at end of file
+records = pd.read_csv(PathToOptionSetCSV, chunksize=ChunkSize)
+bulk_operations.add_options(context, OptionSetLogicalName, ValueOfFirstAddedOption, records,
+                            language_code=LanguageCode, solution=UniqueSolutionName, batch=UseBatch,
+                            skip_existing=SkipExisting)
@@ -1,14 +1,12 @@
-import authenticate_with_msal
-import json
-import pandas as pd
-import time
-import uuid
-from requests import Request
+import bulk_operations
+from bulk_operations import BulkContext
 
 # Imports using the batch function which is faster for big imports
 # https://learn.microsoft.com/en-us/power-apps/developer/data-platform/webapi/execute-batch-operations-using-web-api
 
-# Known issue: the last record in the batch will fail to import. I am still determining the cause of this.
+# Several batches are sent at the same time, see batch_engine.py. The number of
+# batches in flight is lowered automatically when Dataverse throttles the requests.
+# Same as: python pcd.py create contacts data/pcd_create_records.csv
 
 # When importing a lookup column:
 #   Use the logical name of the RELATIONSHIP and "@odatabind" as the column name
@@ -19,6 +17,13 @@ PathToEnvironmentJSON = "example-env.json"
 EntityBeingAddedTo = "contacts"
 PathToCSVOfRecords = "data\pcd_create_records.csv"
 BatchSize = 500 # can be up to 1000 requests per batch
+Concurrency = 4 # batches in flight at start
+MaxConcurrency = 16 # upper limit for batches in flight
+Resume = False # True to skip the rows completed by the previous run (output/imported.journal.db)
+UseCreateMultiple = False # send each batch as one CreateMultiple request, if the table supports it
+AlternateKey = None # e.g. ["emailaddress1"]: upsert on this alternate key instead of creating,
+                    # so a rerun after a partial failure does not create duplicates
+ChunkSize = 10000 # rows read from the CSV at a time
 
 # The Pandas data types of the columns imported to avoid import issues
 dtypes = {
@@ -27,92 +32,13 @@ dtypes = {
     "firstname": "object"
 }
 
-# Getting access token.
-authentication = authenticate_with_msal.getAuthenticatedSession(PathToEnvironmentJSON)
-session = authentication[0]
-environmentURI = authentication[1]
-# choose how you would like to act on errors
-session.headers.update({"Prefer" : "odata.continue-on-error"})
+context = BulkContext.from_environment(PathToEnvironmentJSON, batch_size=BatchSize,
+                                       concurrency=Concurrency, max_concurrency=MaxConcurrency)
+context.open_journal("output/imported.journal.db", f"create {EntityBeingAddedTo}", PathToCSVOfRecords, resume=Resume)
 
-# the post uri
-batch_uri = f'{environmentURI}api/data/v9.2/$batch'
-request_uri = f'/api/data/v9.2/{EntityBeingAddedTo}'
-
-base_preamble = """
-Content-Type: application/http
-Content-Transfer-Encoding: binary
-
-POST """ + request_uri + """ HTTP/1.1
-Content-Type: application/json; type=entry
-
-"""
-
-# read the CSV and convert to dataframe
-df = pd.read_csv(PathToCSVOfRecords, dtype = dtypes)
-
-first = 0
-last = BatchSize - 1
-
-resultdf = df.copy()
-resultdf['codes'] = ""
-resultdf['messages'] = ""
-resultdf['batch'] = ""
-
-timeStart = time.perf_counter()
-
-while first < len(df.index):
-
-    boundary = f"batch_{str(uuid.uuid4())}"
-    session.headers.update({"Content-Type" : f'multipart/mixed; boundary="{boundary}"'})
-    boundary = ("--"+boundary).encode()
-    preamble = boundary + base_preamble.encode()
-
-    requestdf = df.loc[first:last]
-    body = "".encode()
-    records = json.loads(requestdf.to_json(orient = "records"))
-
-    for record in records:
-        body = body + preamble + json.dumps(record).encode()
-
-    body = body + "\n".encode() + boundary + "--".encode()
-
-    req = Request(
-        'POST', 
-        batch_uri, 
-        data = body, 
-        headers = session.headers
-        ).prepare()
-
-    r = session.send(req)
-
-    response = r.content.decode('utf-8')
-    delimiter = response[0:52]
-
-    responses = response.split(delimiter)
-
-    codes = []
-    messages = []
-
-    for i in range(1,len(responses)-1):
-        responses[i] = responses[i].removeprefix("\r\nContent-Type: application/http\r\nContent-Transfer-Encoding: binary\r\n\r\nHTTP/1.1 ")
-        responses[i] = responses[i].split('\r\n',1)
-        codes.append(responses[i][0])
-        messages.append(responses[i][1])
-        i += 1
-    
-    resultdf.loc[first:last,'codes'] = codes
-    resultdf.loc[first:last,'messages'] = messages
-    resultdf.loc[first:last,'batch'] = boundary.decode()
-
-    resultdf.loc[first:last].to_csv(f"output\{boundary.decode()}.csv")
-
-    successes =  sum(1 for i in codes if i == "204 No Content")
-    sent = len(requestdf.index)
-
-    print(f"Records {first} : {last} sent for import. {sent - successes} failures.")
-
-    first = last + 1
-    last = min(last + BatchSize,len(df.index))
-
-print(f'IMPORTING TOOK: {round(time.perf_counter() - timeStart,0)} SECONDS ')
-resultdf.to_csv("output\imported.csv")
+records = bulk_operations.read_records_csv(PathToCSVOfRecords, dtypes, chunksize=ChunkSize)
+if AlternateKey:
+    bulk_operations.upsert_records(context, EntityBeingAddedTo, records, alternate_keys=AlternateKey,
+                                   upsert_multiple=UseCreateMultiple, output_name="imported.csv")
+else:
+    bulk_operations.create_records(context, EntityBeingAddedTo, records, create_multiple=UseCreateMultiple)
@@ -1,29 +1,14 @@
-import authenticate_with_msal
-import json
+import bulk_operations
+from bulk_operations import BulkContext
+
+# Same as: python pcd.py download systemusers --top 10 --select firstname,lastname,internalemailaddress
+# To extract a whole table page by page (CSV or Parquet), use download.py at the root of the repo.
 
 # Parameters
 PathToEnvironmentJSON = "example-env.json"
 EntityToDownload = "systemusers"
 
-# Getting access token.
-authentication = authenticate_with_msal.getAuthenticatedSession(PathToEnvironmentJSON)
-session = authentication[0]
-environmentURI = authentication[1]
-
-# an example download request to the URI
-request_uri = f'{environmentURI}api/data/v9.2/{EntityToDownload}?$top=10&$select=firstname,lastname,internalemailaddress'
-
-r = session.get(request_uri)
-
-if r.status_code != 200:
-    print("Request failed. Error code:")
-
-else:
-    print("Request successful")
-
-raw = json.dumps(json.loads(r.content.decode('utf-8')), indent = True)
+context = BulkContext.from_environment(PathToEnvironmentJSON)
 
-print(r.content)
-'''# Writing to output.json
-with open("output/output.json", "w") as outfile:
-    outfile.write(raw)'''
\ No newline at end of file
+# an example download request to the URI, written to output/systemusers.json
+bulk_operations.download_table(context, EntityToDownload, select="firstname,lastname,internalemailaddress", top=10)
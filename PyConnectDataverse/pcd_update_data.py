@@ -1,46 +1,26 @@
 # pip install pandas # if needed
 
-import pandas as pd
-import authenticate_with_msal
-import json
+import bulk_operations
+from bulk_operations import BulkContext
+
+# Updates the records listed in the GUID column with the values of the other columns.
+# The PATCH requests are sent in batches, several batches at the same time, see batch_engine.py.
+# Same as: python pcd.py update contacts data/pcd_update_records.csv
 
 # Parameters
 PathToEnvironmentJSON = "example-env.json"
 EntityBeingAddedTo = "contacts"
 PathToCSVOfRecords = "data\pcd_update_records.csv"
-# Column names in CSV must match EntityM and EntityN above
-
-# Getting access token.
-authentication = authenticate_with_msal.getAuthenticatedSession(PathToEnvironmentJSON)
-session = authentication[0]
-environmentURI = authentication[1]
-session.headers.update({'If-Match': '*'})
-
-# reading the CSV
-df = pd.read_csv(PathToCSVOfRecords)
-records = json.loads(df.drop(columns='GUID').to_json(orient = "records"))
-
-successful_updates = 0
-failures = 0
-expected_updates = len(df)
+BatchSize = 500 # can be up to 1000 requests per batch
+Concurrency = 4 # batches in flight at start
+MaxConcurrency = 16 # upper limit for batches in flight
+Resume = False # True to skip the rows completed by the previous run (output/updated.journal.db)
+UseUpdateMultiple = False # send each batch as one UpdateMultiple request, if the table supports it
+ChunkSize = 10000 # rows read from the CSV at a time
 
-for index, row in df.iterrows():
-    
-    guid = row['GUID']
-    request_uri = f'{environmentURI}api/data/v9.2/{EntityBeingAddedTo}({guid})'
-    post_json = records[index]
+context = BulkContext.from_environment(PathToEnvironmentJSON, batch_size=BatchSize,
+                                       concurrency=Concurrency, max_concurrency=MaxConcurrency)
+context.open_journal("output/updated.journal.db", f"update {EntityBeingAddedTo}", PathToCSVOfRecords, resume=Resume)
 
-    r = session.patch(request_uri, json = post_json)
-    
-    if r.status_code != 204:
-        failures += 1
-        raw = r.content.decode('utf-8')
-        print(f'Error updating {guid}. Error {r.status_code}: \n{raw}\n')
-    
-    else:
-        successful_updates += 1
-        
-    if index % 10 == 0:
-        print(f"Processed: {index + 1}")
-        
-print(f'{successful_updates} UPDATES MADE OF {expected_updates} EXPECTED UPDATES.\n{failures} FAILURES.') 
\ No newline at end of file
+records = bulk_operations.read_records_csv(PathToCSVOfRecords, chunksize=ChunkSize)
+bulk_operations.update_records(context, EntityBeingAddedTo, records, update_multiple=UseUpdateMultiple)
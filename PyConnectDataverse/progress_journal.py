@@ -0,0 +1,83 @@
+import os
+import sqlite3
+import time
+
+# Persistent progress journal of a bulk operation.
+#
+# Every record of the input CSV is identified by its position (row number). The
+# journal stores when the record was submitted and the outcome of its request,
+# and is committed after each batch, so a run that dies halfway can be resumed:
+# rows that are done or skipped are not sent again, rows that failed or were sent
+# without an answer are.
+#
+# Rows that were sent without an answer may have been applied by Dataverse. Use
+# an upsert (alternate key) import if the operation must never be applied twice.
+
+SENT = 'sent'
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+COMPLETED_STATES = (DONE, SKIPPED)
+
+
+class ProgressJournal:
+    """SQLite journal of the records of one bulk operation."""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS records ('
+                                'position INTEGER PRIMARY KEY, state TEXT, code TEXT, message TEXT, '
+                                'batch TEXT, updated REAL)')
+        self.connection.commit()
+
+    def start(self, operation, input_path, resume=False):
+        """Starts a run. Without resume, the records of a previous run are forgotten."""
+        meta = dict(self.connection.execute('SELECT key, value FROM meta'))
+
+        if resume and meta:
+            if meta.get('operation') != operation or meta.get('input') != str(input_path):
+                raise ValueError(f"The journal {self.path} belongs to '{meta.get('operation')}' of "
+                                 f"{meta.get('input')}, it cannot resume '{operation}' of {input_path}")
+        else:
+            self.connection.execute('DELETE FROM records')
+
+        self.connection.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                                    [('operation', operation), ('input', str(input_path))])
+        self.connection.commit()
+
+    def completed(self, first, last):
+        """Rows between the positions first and last (included) that do not need to be sent
+        again, as {position: (state, code, message, batch)}."""
+        query = ('SELECT position, state, code, message, batch FROM records '
+                 'WHERE position BETWEEN ? AND ? AND state IN (?, ?) ORDER BY position')
+        return {row[0]: row[1:] for row in self.connection.execute(query, (first, last, *COMPLETED_STATES))}
+
+    def sent(self, positions):
+        now = time.time()
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO records (position, state, code, message, batch, updated) VALUES (?, ?, '', '', '', ?)",
+            ((position, SENT, now) for position in positions))
+        self.connection.commit()
+
+    def record(self, positions, states, codes, messages, batch):
+        now = time.time()
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO records (position, state, code, message, batch, updated) VALUES (?, ?, ?, ?, ?, ?)',
+            ((position, state, code, message, batch, now)
+             for position, state, code, message in zip(positions, states, codes, messages)))
+        self.connection.commit()
+
+    def counts(self):
+        return dict(self.connection.execute('SELECT state, COUNT(*) FROM records GROUP BY state'))
+
+    def close(self):
+        self.connection.close()
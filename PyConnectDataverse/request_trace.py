@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+# Per-call trace of the requests sent to Dataverse.
+#
+# A RequestTracer is installed as the first response hook of the session
+# (trace_requests), so it sees every round trip: single requests, pages,
+# $batch calls and the retries of throttled requests. Each call is kept in a ring
+# buffer (the oldest ones are dropped past `capacity`) with its URL, status,
+# latency, sizes and the server request id (x-ms-service-request-id, the id to
+# give to Microsoft support).
+#
+# The latency is response.elapsed: from sending the request to receiving the
+# response headers. The response size is the Content-Length header, i.e. the
+# size on the wire (compressed), when the server sends it.
+#
+# The trace id is kept per thread (new_trace): threads sharing the session, such
+# as concurrent exports, each get their own trace.
+#
+# The calls can be written as plain JSON or as OTLP/JSON spans, which the
+# OpenTelemetry collector and most tracing backends (Jaeger, Tempo...) import.
+
+
+def _hex_id(size):
+    return os.urandom(size).hex()
+
+
+def resource_of(url):
+    """Entity set (or message) targeted by a Web API URL, e.g. contacts, $batch, EntityDefinitions"""
+    path = urlsplit(url).path
+    if '/api/data/' not in path:
+        return path
+    segments = path.split('/api/data/', 1)[1].split('/')
+    return segments[1].split('(', 1)[0] if len(segments) > 1 else ''
+
+
+class RequestTracer:
+    """Thread-safe ring buffer of the calls made by a session.
+
+    Args:
+        capacity: number of calls kept
+        service_name: service.name of the exported OpenTelemetry resource
+    """
+
+    def __init__(self, capacity=10000, service_name="pyconnectdataverse"):
+        self.calls = deque(maxlen=capacity)
+        self.service_name = service_name
+        self.total = 0
+        self._default_trace_id = _hex_id(16)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def trace_id(self):
+        """Trace id of the calls made by the current thread"""
+        return getattr(self._local, 'trace_id', self._default_trace_id)
+
+    def new_trace(self):
+        """Starts a new trace id for the current thread, e.g. for each export; its following calls belong to it"""
+        self._local.trace_id = _hex_id(16)
+        return self._local.trace_id
+
+    def hook(self, response, *args, **kwargs):
+        end = time.time()
+        request = response.request
+        body = request.body or b''
+        elapsed = response.elapsed.total_seconds()
+        length = response.headers.get('Content-Length')
+        call = {
+            'trace_id': self.trace_id,
+            'span_id': _hex_id(8),
+            'start': end - elapsed,
+            'duration': elapsed,
+            'method': request.method,
+            'url': request.url,
+            'resource': resource_of(request.url),
+            'status': response.status_code,
+            'request_bytes': len(body),
+            'response_bytes': int(length) if length is not None else None,
+            'service_request_id': response.headers.get('x-ms-service-request-id'),
+        }
+        with self._lock:
+            self.calls.append(call)
+            self.total += 1
+        return response
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.calls)
+
+    def summary(self):
+        calls = self.snapshot()
+        if not calls:
+            return "0 round trips."
+        durations = sorted(call['duration'] for call in calls)
+        throttled = sum(1 for call in calls if call['status'] in (429, 503))
+        dropped = f" (only the last {len(calls)} kept)" if self.total > len(calls) else ""
+        return (f"{self.total} round trips{dropped}, {sum(durations):.1f} s in total, "
+                f"median {durations[len(durations) // 2] * 1000:.0f} ms, max {durations[-1] * 1000:.0f} ms, "
+                f"{throttled} throttled.")
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=1)
+
+    def to_otlp(self):
+        """The calls as an OTLP/JSON ExportTraceServiceRequest (one CLIENT span per call)"""
+        spans = []
+        for call in self.snapshot():
+            attributes = {
+                'http.request.method': call['method'],
+                'url.full': call['url'],
+                'server.address': urlsplit(call['url']).hostname,
+                'http.response.status_code': call['status'],
+                'http.request.body.size': call['request_bytes'],
+                'http.response.body.size': call['response_bytes'],
+                'dataverse.resource': call['resource'],
+                'dataverse.service_request_id': call['service_request_id'],
+            }
+            start = int(call['start'] * 1e9)
+            spans.append({
+                'traceId': call['trace_id'],
+                'spanId': call['span_id'],
+                'name': f"{call['method']} {call['resource']}",
+                'kind': 3,  # SPAN_KIND_CLIENT
+                'startTimeUnixNano': str(start),
+                'endTimeUnixNano': str(start + int(call['duration'] * 1e9)),
+                'attributes': [_attribute(key, value) for key, value in attributes.items() if value is not None],
+                'status': {'code': 2 if call['status'] >= 400 else 1},  # ERROR / OK
+            })
+        return {'resourceSpans': [{
+            'resource': {'attributes': [_attribute('service.name', self.service_name)]},
+            'scopeSpans': [{'scope': {'name': 'request_trace'}, 'spans': spans}],
+        }]}
+
+    def write(self, path, format="otlp"):
+        """Writes the calls to `path` as OTLP/JSON spans (format="otlp") or plain JSON (format="json")"""
+        with open(path, 'w') as f:
+            if format == "json":
+                f.write(self.to_json())
+            else:
+                json.dump(self.to_otlp(), f)
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+def trace_requests(session, capacity=10000):
+    """Installs a RequestTracer on the session (once) and returns it."""
+    tracer = getattr(session, 'request_tracer', None)
+    if tracer is None:
+        tracer = RequestTracer(capacity)
+        session.request_tracer = tracer
+        # First hook: runs as soon as the headers are received, before another hook reads the body
+        session.hooks['response'].insert(0, tracer.hook)
+    return tracer
@@ -0,0 +1,65 @@
+import json
+import pandas as pd
+
+try:
+    import orjson  # optional, pip install orjson
+except ImportError:
+    orjson = None
+
+# Turns DataFrame rows into the JSON bodies of the requests, encoding each record once.
+#
+# Empty cells (NaN, None, pd.NA, NaT) become null, except in lookup columns ('...@odata.bind')
+# where the column is left out: binding a lookup to null is rejected by Dataverse,
+# an empty cell means "do not set the lookup".
+#
+# orjson is used when it is installed, otherwise the standard json module.
+
+
+def _default(value):
+    if hasattr(value, 'isoformat'):  # pandas Timestamp, datetime
+        return value.isoformat()
+    if hasattr(value, 'item'):  # numpy scalar
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """JSON bytes of obj."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default).encode()
+
+
+def row_dicts(df):
+    """Yields one dict per row of df, with Python values and empty cells handled."""
+    columns = list(df.columns)
+    lookups = [column.endswith('@odata.bind') for column in columns]
+    # Only the columns with empty cells are checked cell by cell. Empty cells are NaN,
+    # None, pd.NA (nullable Int64, boolean, string columns) or NaT (datetime columns).
+    nullable = [bool(df[column].isna().any()) for column in columns]
+    flags = list(zip(columns, lookups, nullable))
+
+    for values in df.itertuples(index=False, name=None):
+        record = {}
+        for (column, lookup, may_be_empty), value in zip(flags, values):
+            if may_be_empty and pd.api.types.is_scalar(value) and pd.isna(value):
+                if lookup:
+                    continue
+                value = None
+            record[column] = value
+        yield record
+
+
+def record_bytes(df):
+    """JSON bytes of each row of df."""
+    return [dumps(record) for record in row_dicts(df)]
+
+
+def with_fields(fields, body):
+    """Adds fields (e.g. '@odata.type' and the key) in front of an already encoded JSON object."""
+    head = dumps(fields)
+    if body == b'{}':
+        return head
+    if head == b'{}':
+        return body
+    return head[:-1] + b',' + body[1:]
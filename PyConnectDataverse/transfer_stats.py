@@ -0,0 +1,94 @@
+import threading
+
+# Bytes exchanged with Dataverse, as sent on the wire and once decoded.
+#
+# Responses are compressed by Dataverse when the request accepts it (requests
+# sends 'Accept-Encoding: gzip, deflate' by default) and urllib3 decompresses them while the
+# body is read, including when it is streamed. Request bodies are only compressed
+# when the batch engine is asked to (compress_requests), as not every endpoint
+# accepts 'Content-Encoding: gzip'.
+#
+# The counters are filled by a response hook installed on the session. Streamed
+# responses are not read yet when the hook runs: the code reading them calls
+# record_response() once the body has been consumed.
+#
+# Besides the session totals, each thread has its own counters (thread_counters):
+# a session shared by several threads (the export service) can still attribute
+# the traffic to the export running in the current thread.
+
+
+def _readable(size):
+    if size < 1024 * 1024:
+        return f"{size / 1024:.1f} kB"
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+class TransferStats:
+    """Thread-safe counters of the bytes sent and received by a session."""
+
+    def __init__(self):
+        self.requests = 0
+        self.sent = 0
+        self.sent_wire = 0
+        self.received = 0
+        self.received_wire = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _thread(self):
+        counters = getattr(self._local, 'counters', None)
+        if counters is None:
+            counters = self._local.counters = [0, 0]  # requests, received_wire
+        return counters
+
+    def thread_counters(self):
+        """(requests, bytes received on the wire) of the calling thread."""
+        return tuple(self._thread())
+
+    def record_request(self, request):
+        body = request.body or b''
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        size = len(body)
+        if request.headers.get('Content-Encoding') == 'gzip' and size >= 4:
+            size_decoded = int.from_bytes(body[-4:], 'little')  # ISIZE field of the gzip trailer
+        else:
+            size_decoded = size
+
+        self._thread()[0] += 1
+        with self._lock:
+            self.requests += 1
+            self.sent += size_decoded
+            self.sent_wire += size
+
+    def record_response(self, response, size_decoded=None):
+        """Counts a response whose body has been read. size_decoded defaults to len(response.content)."""
+        if size_decoded is None:
+            size_decoded = len(response.content)
+        tell = getattr(response.raw, 'tell', None)
+        size = tell() if tell is not None else size_decoded
+
+        self._thread()[1] += size
+        with self._lock:
+            self.received += size_decoded
+            self.received_wire += size
+
+    def hook(self, response, *args, **kwargs):
+        self.record_request(response.request)
+        if not kwargs.get('stream'):
+            self.record_response(response)
+        return response
+
+    def summary(self):
+        return (f"{self.requests} requests. Sent {_readable(self.sent_wire)} ({_readable(self.sent)} uncompressed), "
+                f"received {_readable(self.received_wire)} ({_readable(self.received)} uncompressed).")
+
+
+def measure_transfers(session):
+    """Installs the counters on the session (once) and returns them."""
+    stats = getattr(session, 'transfer_stats', None)
+    if stats is None:
+        stats = TransferStats()
+        session.transfer_stats = stats
+        session.hooks['response'].append(stats.hook)
+    return stats
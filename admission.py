@@ -0,0 +1,114 @@
+import threading
+from contextlib import contextmanager
+
+# Contrôle des exports lancés par app.py.
+#
+# - SingleFlight regroupe les demandes simultanées portant sur la même clé (l'ID
+#   de la tournée) : la première lance l'export, les suivantes attendent sa fin
+#   et reçoivent le même résultat, au lieu de refaire les mêmes lectures Dataverse
+#   et le même classeur.
+# - AdmissionControl limite le nombre d'exports exécutés en même temps (chacun fait
+#   plusieurs requêtes Dataverse, trop d'exports parallèles déclenchent la limitation
+#   de débit). Une demande attend au plus `wait` secondes qu'une place se libère,
+#   sinon ExportsSaturated est levée et app.py répond 503 avec Retry-After.
+
+
+class ExportsSaturated(Exception):
+    """Toutes les places d'export sont occupées"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Trop d'exports en cours, réessayer dans {retry_after} s")
+        self.retry_after = retry_after
+
+
+class CallInterrupted(Exception):
+    """L'appel regroupé a été interrompu (arrêt du worker) avant de donner un résultat"""
+
+    def __init__(self):
+        super().__init__("Export interrompu avant la fin, réessayer")
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Exécute une seule fois à la fois la fonction associée à une clé"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        """
+        Appelle function(), ou attend l'appel déjà en cours pour la même clé.
+
+        Returns:
+            tuple: (résultat, True si le résultat vient d'un appel lancé par une autre demande)
+
+        Raises:
+            L'exception levée par function(), pour toutes les demandes regroupées ;
+            CallInterrupted pour les demandes en attente si function() a été
+            interrompue (KeyboardInterrupt, SystemExit)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = function()
+        except Exception as e:
+            call.error = e
+            raise
+        except BaseException:
+            # L'interruption reste propre au thread qui la reçoit
+            call.error = CallInterrupted()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result, False
+
+
+class AdmissionControl:
+    """
+    Limite le nombre d'exécutions simultanées.
+
+    Args:
+        limit (int): Nombre maximum d'exécutions en même temps
+        wait (float): Attente maximale d'une place, en secondes
+        retry_after (int): Délai conseillé au client (en-tête Retry-After), en secondes
+    """
+
+    def __init__(self, limit, wait=5.0, retry_after=10):
+        self.limit = limit
+        self.wait = wait
+        self.retry_after = retry_after
+        self._semaphore = threading.BoundedSemaphore(limit)
+
+    @contextmanager
+    def slot(self, blocking=False):
+        """
+        Occupe une place le temps du bloc ; lève ExportsSaturated si aucune ne se libère
+        à temps. Avec blocking (travaux en arrière-plan), attend sans limite.
+        """
+        if not self._semaphore.acquire(timeout=None if blocking else self.wait):
+            raise ExportsSaturated(self.retry_after)
+        try:
+            yield
+        finally:
+            self._semaphore.release()
@@ -1,7 +1,18 @@
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, Response, request, send_file, jsonify
+import hmac
 import os
 import tempfile
-from export import export_tournee_vers_excel
+import threading
+import time
+import metrics
+from admission import AdmissionControl, ExportsSaturated, SingleFlight
+from dataverse_connector import NewDataverseConnector
+from entity_cache import EntityCache
+from export import (DATAVERSE_CONFIG, FORMATS_FLUX, ecrire_flux, export_tournee_vers_excel, lire_tournee,
+                    precharger_modeles, verifier_format)
+from models import Adresse, Agent, AgentTournee, Bac, Tournee, Vidage
+from prerender import ArtifactStore, PreRenderer
+from timings import ExportTimings
 import logging
 from werkzeug.middleware.proxy_fix import ProxyFix
 
@@ -18,6 +29,143 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
 # Répertoire pour stocker temporairement les fichiers Excel générés
 TEMP_DIR = tempfile.gettempdir()
 
+# Exports exécutés en même temps au plus, par processus, pré-générations comprises
+# (qui attendent leur tour sans limite) ; au-delà, une demande attend
+# une place EXPORT_QUEUE_TIMEOUT secondes puis reçoit un 503 avec Retry-After. Sous
+# gunicorn, la limite doit rester inférieure au nombre de threads (voir gunicorn.conf.py).
+MAX_CONCURRENT_EXPORTS = int(os.environ.get('MAX_CONCURRENT_EXPORTS', 4))
+EXPORT_QUEUE_TIMEOUT = float(os.environ.get('EXPORT_QUEUE_TIMEOUT', 5))
+EXPORT_RETRY_AFTER = int(os.environ.get('EXPORT_RETRY_AFTER', 10))
+
+admission = AdmissionControl(MAX_CONCURRENT_EXPORTS, EXPORT_QUEUE_TIMEOUT, EXPORT_RETRY_AFTER)
+# Les demandes simultanées pour la même tournée partagent un seul export
+exports_en_cours = SingleFlight()
+
+# Connecteur partagé par les exports du processus (session authentifiée et cache des
+# noms d'entités), renouvelé avant l'expiration du jeton (1 h). Le renouvellement se
+# fait hors de _connector_lock : pendant ce temps, les exports continuent avec
+# l'ancien connecteur, et seuls ceux qui n'en ont pas encore attendent le nouveau.
+CONNECTOR_MAX_AGE = int(os.environ.get('CONNECTOR_MAX_AGE', 45 * 60))
+_connector = None
+_connector_created = 0.0
+_connector_lock = threading.Lock()
+_renew_lock = threading.Lock()
+_warm = False
+
+# Agents et adresses déjà lus, partagés par les connecteurs successifs (voir entity_cache.py).
+# ENTITY_CACHE_REFRESH à 0 désactive l'interrogation des modifications (modifiedon).
+ENTITY_CACHE_SIZE = int(os.environ.get('ENTITY_CACHE_SIZE', 50000))
+ENTITY_CACHE_TTL = float(os.environ.get('ENTITY_CACHE_TTL', 3600))
+ENTITY_CACHE_REFRESH = float(os.environ.get('ENTITY_CACHE_REFRESH', 300))
+entity_cache = EntityCache(ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL, ENTITY_CACHE_REFRESH or None)
+
+def get_connector():
+    """
+    Renvoie le connecteur partagé, en le créant (ou le recréant s'il est trop ancien).
+    
+    Raises:
+        RuntimeError: Si la connexion à Dataverse échoue
+    """
+    global _connector, _connector_created
+    with _connector_lock:
+        current = _connector
+        if current is not None and time.monotonic() - _connector_created <= CONNECTOR_MAX_AGE:
+            return current
+    # Un seul renouvellement à la fois ; les autres gardent l'ancien connecteur s'il existe
+    if not _renew_lock.acquire(blocking=current is None):
+        return current
+    try:
+        with _connector_lock:
+            if _connector is not current:
+                # Renouvelé par un autre thread pendant l'attente
+                return _connector
+        connector = NewDataverseConnector(**DATAVERSE_CONFIG)
+        start = time.perf_counter()
+        if not connector.connect():
+            raise RuntimeError("Échec de la connexion à Dataverse")
+        metrics.TOKEN_DURATION.observe(time.perf_counter() - start)
+        if current is not None:
+            # Les noms d'entités ne changent pas avec le jeton
+            connector.entity_set_names.update(current.entity_set_names)
+        connector.entity_cache = entity_cache
+        with _connector_lock:
+            _connector, _connector_created = connector, time.monotonic()
+        return connector
+    finally:
+        _renew_lock.release()
+
+# Pré-génération des classeurs des tournées terminées (voir prerender.py), activée
+# en indiquant le dossier des artefacts dans PRERENDER_DIR. Les classeurs plus anciens
+# que PRERENDER_MAX_AGE heures ne sont plus servis et sont supprimés. POST
+# /tournees/<id>/terminee n'est accepté qu'avec l'en-tête Authorization: Bearer
+# <PRERENDER_TOKEN>, et refusé si PRERENDER_TOKEN n'est pas défini.
+PRERENDER_DIR = os.environ.get('PRERENDER_DIR')
+PRERENDER_INTERVAL = float(os.environ.get('PRERENDER_INTERVAL', 60))
+PRERENDER_LOOKBACK = float(os.environ.get('PRERENDER_LOOKBACK', 24))
+PRERENDER_MAX_AGE = float(os.environ.get('PRERENDER_MAX_AGE', 24))
+PRERENDER_TOKEN = os.environ.get('PRERENDER_TOKEN')
+artifacts = ArtifactStore(PRERENDER_DIR) if PRERENDER_DIR else None
+prerenderer = None
+
+def render_tournee(tournee_id, output_file):
+    """Génère le classeur d'une tournée pour la pré-génération, avec une place d'export"""
+    with admission.slot(blocking=True):
+        timings = ExportTimings(tournee_id)
+        success = export_tournee_vers_excel(tournee_id=tournee_id, output_file=output_file,
+                                            connector=get_connector(), timings=timings)
+        timings.finish()
+    metrics.PRERENDERS.inc(status="success" if success else "failure")
+    logger.info(f"Durées de la pré-génération de la tournée {tournee_id}: {timings.summary()}")
+    return success
+
+def start_prerender():
+    """Lance la pré-génération si PRERENDER_DIR est défini (une seule fois par processus)"""
+    global prerenderer
+    if artifacts is None or prerenderer is not None:
+        return
+    prerenderer = PreRenderer(artifacts, get_connector, render_tournee, interval=PRERENDER_INTERVAL,
+                              lookback=PRERENDER_LOOKBACK, max_age=PRERENDER_MAX_AGE)
+    watching = prerenderer.start()
+    logger.info(f"Pré-génération dans {PRERENDER_DIR}" + (", surveillance des tournées terminées" if watching else ""))
+
+def warm_up():
+    """
+    Prépare le processus avant qu'il ne reçoive des demandes : authentification,
+    lecture des modèles Excel et des noms d'entités des tables de l'export.
+    L'authentification n'est faite ici que si elle ne demande pas de connexion interactive.
+    Appelée par gunicorn (gunicorn.conf.py) dans chaque worker.
+    """
+    global _warm
+    start = time.perf_counter()
+    precharger_modeles()
+    if _connector is None and NewDataverseConnector(**DATAVERSE_CONFIG).requires_sign_in():
+        # Sans secret client, la connexion ouvrirait une fenêtre dans chaque worker :
+        # elle est laissée à la première demande
+        logger.warning("Connexion à Dataverse différée à la première demande (connexion interactive requise ; "
+                       "définir DATAVERSE_CLIENT_SECRET pour un serveur)")
+        return False
+    try:
+        connector = get_connector()
+        for model in (Tournee, AgentTournee, Agent, Bac, Adresse, Vidage):
+            connector.get_entity_set_name(model.table)
+    except Exception as e:
+        # Le service démarre quand même, la connexion sera retentée à la première demande
+        logger.error(f"Préchauffage incomplet: {e}")
+        return False
+    _warm = True
+    start_prerender()
+    logger.info(f"Préchauffage terminé en {time.perf_counter() - start:.2f} s")
+    return True
+
+# Fichiers d'export présents dans TEMP_DIR, calculés à chaque lecture de /metrics
+# (dossier commun à tous les workers : valeurs non additionnées)
+metrics.Gauge('export_temp_files', "Fichiers d'export présents dans le dossier temporaire",
+              function=lambda: metrics.directory_usage(TEMP_DIR, "tournee_")[0], aggregate="local")
+metrics.Gauge('export_temp_bytes', "Taille des fichiers d'export présents dans le dossier temporaire (octets)",
+              function=lambda: metrics.directory_usage(TEMP_DIR, "tournee_")[1], aggregate="local")
+
+metrics.Gauge('entity_cache_entries', "Agents et adresses gardés en cache", function=lambda: len(entity_cache))
+
 @app.route('/')
 def index():
     """Page d'accueil simple avec des informations sur l'API"""
@@ -38,6 +186,7 @@ def index():
             <ul>
                 <li><strong>GET /export-tournee?id=123</strong> - Exporte la tournée avec l'ID spécifié</li>
                 <li><strong>POST /export-tournee</strong> - Exporte la tournée en envoyant l'ID dans le corps de la requête (JSON)</li>
+                <li><strong>GET /export-tournee?id=123&amp;format=csv</strong> - En-tête et bacs de la tournée en CSV, NDJSON (ndjson) ou Parquet (parquet), sans classeur Excel</li>
             </ul>
         </body>
     </html>
@@ -50,6 +199,9 @@ def export_tournee():
     Accepte l'ID de la tournée soit par paramètre GET soit par POST JSON.
     """
     tournee_id = None
+    format = request.args.get('format')
+    # fresh=1 : export depuis Dataverse même si un classeur pré-généré est à jour
+    fresh = request.args.get('fresh')
     
     if request.method == 'GET':
         tournee_id = request.args.get('id')
@@ -57,22 +209,34 @@ def export_tournee():
         if request.is_json:
             data = request.get_json()
             tournee_id = data.get('id')
+            format = data.get('format', format)
+            fresh = data.get('fresh', fresh)
         else:
             # Tenter de récupérer les données de formulaire
             tournee_id = request.form.get('id')
+            format = request.form.get('format', format)
+            fresh = request.form.get('fresh', fresh)
     
     # Vérifier que l'ID de tournée est fourni
     if not tournee_id:
         return jsonify({"error": "Veuillez fournir un ID de tournée"}), 400
     
+    tournee_id = str(tournee_id).strip()
     logger.info(f"Demande d'exportation pour la tournée ID: {tournee_id}")
     
+    format = (format or 'xlsx').strip().lower()
+    if format != 'xlsx':
+        return export_tournee_flux(tournee_id, format)
+    
+    fresh = str(fresh).strip().lower() in ('1', 'true', 'yes', 'oui')
+    
     try:
-        # Générer un nom de fichier unique pour cette exportation
-        output_file = os.path.join(TEMP_DIR, f"tournee_{tournee_id}_{os.urandom(4).hex()}.xlsx")
-        
-        # Appeler la fonction d'exportation
-        success = export_tournee_vers_excel(tournee_id=tournee_id, output_file=output_file)
+        # Les demandes fresh ne reçoivent pas le classeur pré-généré d'une demande simultanée
+        key = (tournee_id, "fresh") if fresh else tournee_id
+        (success, output_file), shared = exports_en_cours.do(key, lambda: run_export(tournee_id, fresh))
+        if shared:
+            metrics.EXPORTS_COALESCED.inc()
+            logger.info(f"Export de la tournée {tournee_id} partagé avec une demande simultanée")
         
         if success and os.path.exists(output_file):
             logger.info(f"Exportation réussie. Fichier généré: {output_file}")
@@ -88,17 +252,146 @@ def export_tournee():
             logger.error(f"Échec de l'exportation pour la tournée ID: {tournee_id}")
             return jsonify({"error": "Échec de l'exportation. Vérifiez les logs du serveur."}), 500
     
+    except ExportsSaturated as e:
+        metrics.EXPORTS_REJECTED.inc()
+        logger.warning(f"Exportation de la tournée {tournee_id} refusée: {e}")
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(e.retry_after)}
+    
     except Exception as e:
         logger.exception(f"Erreur lors de l'exportation: {str(e)}")
         return jsonify({"error": f"Erreur lors de l'exportation: {str(e)}"}), 500
 
+def export_tournee_flux(tournee_id, format):
+    """
+    Renvoie l'en-tête et les bacs d'une tournée en CSV, NDJSON ou Parquet, envoyés
+    au fur et à mesure, sans générer de classeur (voir export.ecrire_flux).
+    """
+    try:
+        verifier_format(format)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        # Format connu, mais pyarrow n'est pas installé sur ce serveur
+        return jsonify({"error": str(e)}), 501
+    
+    try:
+        donnees, shared = exports_en_cours.do(("donnees", tournee_id), lambda: run_lecture(tournee_id, format))
+        if shared:
+            metrics.EXPORTS_COALESCED.inc()
+        if donnees is None:
+            logger.error(f"Échec de l'exportation pour la tournée ID: {tournee_id}")
+            return jsonify({"error": "Échec de l'exportation. Vérifiez les logs du serveur."}), 500
+        lignes = ecrire_flux(donnees, format)
+    
+    except ExportsSaturated as e:
+        metrics.EXPORTS_REJECTED.inc()
+        logger.warning(f"Exportation de la tournée {tournee_id} refusée: {e}")
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(e.retry_after)}
+    
+    except Exception as e:
+        logger.exception(f"Erreur lors de l'exportation: {str(e)}")
+        return jsonify({"error": f"Erreur lors de l'exportation: {str(e)}"}), 500
+    
+    return Response(lignes, content_type=FORMATS_FLUX[format][1],
+                    headers={"Content-Disposition": f"attachment; filename=Tournee_{tournee_id}.{format}"})
+
+def run_lecture(tournee_id, format):
+    """
+    Lit les données de la tournée dans Dataverse, dès qu'une place d'export est libre.
+    La lecture est comptée dans les métriques sous le format demandé.
+    
+    Returns:
+        dict: Données renvoyées par export.lire_tournee, ou None en cas d'échec
+    
+    Raises:
+        ExportsSaturated: Si aucune place ne s'est libérée à temps
+    """
+    with admission.slot():
+        timings = ExportTimings(tournee_id)
+        status = "error"
+        metrics.EXPORTS_IN_FLIGHT.inc()
+        try:
+            donnees = lire_tournee(tournee_id, connector=get_connector(), timings=timings)
+            status = "success" if donnees is not None else "failure"
+        finally:
+            metrics.EXPORTS_IN_FLIGHT.dec()
+            timings.finish()
+            metrics.observe_export(timings, status, format=format)
+            logger.info(f"Durées de la lecture de la tournée {tournee_id}: {timings.summary()}")
+        return donnees
+
+def run_export(tournee_id, fresh=False):
+    """
+    Exporte la tournée dans un fichier temporaire, dès qu'une place d'export est libre.
+    Le classeur pré-généré de la tournée est renvoyé à la place s'il est à jour (sauf
+    avec fresh) ; s'il est dépassé, il est remplacé par le résultat de l'export.
+    
+    Returns:
+        tuple: (succès, chemin du fichier généré ou du classeur pré-généré)
+    
+    Raises:
+        ExportsSaturated: Si aucune place ne s'est libérée à temps
+    """
+    with admission.slot():
+        stored = prerenderer is not None and prerenderer.store.info(tournee_id) is not None
+        if stored and not fresh:
+            artifact = prerenderer.current(tournee_id)
+            if artifact:
+                metrics.EXPORTS_FROM_STORE.inc()
+                logger.info(f"Classeur pré-généré servi: {artifact}")
+                return True, artifact
+        started = time.time()
+        
+        # Générer un nom de fichier unique pour cette exportation
+        output_file = os.path.join(TEMP_DIR, f"tournee_{tournee_id}_{os.urandom(4).hex()}.xlsx")
+        
+        # Appeler la fonction d'exportation, en mesurant la durée de chaque étape
+        timings = ExportTimings(tournee_id)
+        status = "error"
+        metrics.EXPORTS_IN_FLIGHT.inc()
+        try:
+            success = export_tournee_vers_excel(tournee_id=tournee_id, output_file=output_file,
+                                                connector=get_connector(), timings=timings)
+            status = "success" if success else "failure"
+        finally:
+            metrics.EXPORTS_IN_FLIGHT.dec()
+            timings.finish()
+            metrics.observe_export(timings, status)
+            logger.info(f"Durées de l'exportation de la tournée {tournee_id}: {timings.summary()}")
+        if success and stored:
+            prerenderer.keep(tournee_id, output_file, started)
+        return success, output_file
+
+@app.route('/tournees/<tournee_id>/terminee', methods=['POST'])
+def tournee_terminee(tournee_id):
+    """
+    Signale qu'une tournée est terminée (à appeler depuis un flux Power Automate ou un
+    webhook) : son classeur est généré en arrière-plan. Demande l'en-tête
+    Authorization: Bearer <PRERENDER_TOKEN>.
+    """
+    if not PRERENDER_TOKEN:
+        return jsonify({"error": "Point d'accès désactivé (PRERENDER_TOKEN non défini)"}), 403
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {PRERENDER_TOKEN}"):
+        return jsonify({"error": "Jeton invalide"}), 401
+    if prerenderer is None:
+        return jsonify({"error": "La pré-génération n'est pas activée (PRERENDER_DIR)"}), 404
+    prerenderer.submit(tournee_id)
+    return jsonify({"status": "queued", "id": tournee_id}), 202
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Métriques du service au format Prometheus (voir metrics.py)"""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/health')
 def health_check():
     """Endpoint pour vérifier que l'API est en ligne"""
-    return jsonify({"status": "ok"}), 200
+    return jsonify({"status": "ok", "warm": _warm}), 200
 
 if __name__ == '__main__':
+    # Serveur de développement. En production : gunicorn -c gunicorn.conf.py app:app
     # Pour le développement local, utilisez debug=True
     # Pour la production, définissez debug=False
     port = int(os.environ.get('PORT', 5000))
+    start_prerender()
     app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
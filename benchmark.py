@@ -0,0 +1,243 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'PyConnectDataverse'))
+
+import bulk_operations
+from bulk_operations import BulkContext
+from dataverse_connector import NewDataverseConnector
+from export import export_tournee_vers_excel
+from mock_dataverse import MockDataverse, MockDataverseServer, TourneeGenerator
+
+# Mesures de performance de l'export Excel et des opérations en masse, contre le
+# serveur local de mock_dataverse.py (aucun accès à Dataverse nécessaire).
+#
+# Chaque scénario est répété --repeat fois ; on garde la médiane et le minimum.
+# Les résultats sont ajoutés à benchmarks/results.jsonl (une ligne par scénario,
+# avec le commit git et la date) et comparés au dernier passage du même scénario,
+# ce qui permet de repérer une régression d'une version à l'autre. Ce fichier
+# est propre à chaque machine et n'est pas suivi par git.
+#
+#   python benchmark.py                         # tout, avec les tailles par défaut
+#   python benchmark.py --only export --bacs 10 100
+#   python benchmark.py --latency 0.02 --label "réseau lent"
+
+RESULTS_FILE = os.path.join("benchmarks", "results.jsonl")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _measure(run, repeat, setup=None):
+    """Durées (en secondes) de `repeat` appels à run(), setup() étant appelé avant chacun sans être mesuré"""
+    durations = []
+    for _ in range(repeat):
+        argument = setup() if setup is not None else None
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = run(argument) if setup is not None else run()
+            durations.append(time.perf_counter() - start)
+        if result is False:
+            raise RuntimeError("Le scénario a échoué")
+    return durations
+
+
+def _result(scenario, params, durations, items):
+    median = statistics.median(durations)
+    return {
+        'scenario': scenario,
+        'params': params,
+        'seconds': round(median, 4),
+        'min_seconds': round(min(durations), 4),
+        'rate': round(items / median, 1) if median else None,
+        'repeat': len(durations),
+    }
+
+
+def bench_export(server, mock, env_file, work_dir, bacs_sizes, types, repeat):
+    """Export complet d'une tournée (lecture Dataverse + classeur Excel), par nombre de bacs et modèle"""
+    generator = TourneeGenerator(mock, seed=0)
+    connector = NewDataverseConnector(None, None, server.url, path_to_env=env_file)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if not connector.connect():
+            raise RuntimeError("Connexion au serveur local impossible")
+
+    results = []
+    for bacs in bacs_sizes:
+        for type_collecte in types:
+            id_tournee = generator.add_tournee(type_collecte, bacs)
+            output_file = os.path.join(work_dir, f"export_{type_collecte}_{bacs}.xlsx")
+            durations = _measure(lambda: export_tournee_vers_excel(id_tournee, output_file, connector=connector),
+                                 repeat)
+            results.append(_result('export', {'type': type_collecte, 'bacs': bacs}, durations, bacs))
+            _print(results[-1], 'bacs/s')
+    return results
+
+
+def _records(count, offset=0):
+    return pd.DataFrame({
+        'firstname': [f"Prénom {index}" for index in range(offset, offset + count)],
+        'lastname': [f"Nom {index}" for index in range(offset, offset + count)],
+        'emailaddress1': [f"contact{index}@example.com" for index in range(offset, offset + count)],
+    })
+
+
+def bench_bulk(mock, env_file, work_dir, records, batch_sizes, concurrencies, repeat):
+    """Enregistrements par seconde des créations, mises à jour et suppressions en $batch"""
+    entity = 'benchmark_contacts'
+    results = []
+
+    for batch_size in batch_sizes:
+        for concurrency in concurrencies:
+            with contextlib.redirect_stdout(io.StringIO()):
+                context = BulkContext.from_environment(env_file, batch_size=batch_size, concurrency=concurrency,
+                                                       max_concurrency=concurrency, output_dir=work_dir)
+            params = {'records': records, 'batch_size': batch_size, 'concurrency': concurrency}
+
+            def clear():
+                mock.table(entity).records.clear()
+
+            def populate():
+                # Données de départ insérées directement dans le serveur, hors mesure
+                clear()
+                return [mock.insert(entity, record) for record in _records(records).to_dict('records')]
+
+            def create(_):
+                bulk_operations.create_records(context, entity, _records(records))
+
+            def update(ids):
+                bulk_operations.update_records(context, entity, pd.DataFrame({'GUID': ids, 'lastname': "Modifié"}))
+
+            def delete(ids):
+                bulk_operations.delete_records(context, entity, pd.DataFrame({'GUID': ids}))
+
+            for operation, run, setup in (('create', create, clear), ('update', update, populate),
+                                          ('delete', delete, populate)):
+                durations = _measure(run, repeat, setup)
+                results.append(_result(f'bulk_{operation}', params, durations, records))
+                _print(results[-1], 'enr/s')
+            context.session.close()
+    return results
+
+
+def _key(result):
+    return result['scenario'], json.dumps(result['params'], sort_keys=True)
+
+
+def _print(result, unit):
+    params = ", ".join(f"{name}={value}" for name, value in result['params'].items())
+    print(f"  {result['scenario']:<12} {params:<45} {result['seconds']:>9.3f} s  {result['rate']:>10.1f} {unit}")
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_results(path, results, run_info):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        for result in results:
+            f.write(json.dumps({**run_info, **result}, ensure_ascii=False) + "\n")
+
+
+def compare(previous, results, threshold):
+    """Affiche l'écart avec le dernier passage de chaque scénario ; renvoie le nombre de régressions"""
+    last = {}
+    for result in previous:
+        last[_key(result)] = result
+
+    regressions = 0
+    print("\nComparaison avec le passage précédent:")
+    for result in results:
+        before = last.get(_key(result))
+        params = ", ".join(f"{name}={value}" for name, value in result['params'].items())
+        if before is None:
+            print(f"  {result['scenario']:<12} {params:<45} (nouveau)")
+            continue
+        change = (result['seconds'] - before['seconds']) / before['seconds'] * 100 if before['seconds'] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  <-- RÉGRESSION"
+            regressions += 1
+        print(f"  {result['scenario']:<12} {params:<45} {before['seconds']:>9.3f} s -> {result['seconds']:>9.3f} s "
+              f"({change:+.1f} %, {before.get('commit') or '?'}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mesure l'export Excel et les opérations en masse sur un "
+                                                 "serveur Dataverse local.")
+    parser.add_argument("--only", choices=["export", "bulk"], help="ne lancer qu'une famille de scénarios")
+    parser.add_argument("--bacs", type=int, nargs="+", default=[10, 100, 1000, 10000],
+                        help="nombres de bacs des tournées exportées")
+    parser.add_argument("--types", nargs="+", default=["EP", "OM"], help="modèles Excel mesurés")
+    parser.add_argument("--records", type=int, default=2000, help="enregistrements par opération en masse")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[100, 500, 1000])
+    parser.add_argument("--concurrencies", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--repeat", type=int, default=3, help="répétitions de chaque scénario")
+    parser.add_argument("--latency", type=float, default=0.0, help="délai par requête HTTP du serveur, en secondes")
+    parser.add_argument("--batch-part-latency", type=float, default=0.0, help="délai par requête d'un $batch")
+    parser.add_argument("--label", default="", help="libellé enregistré avec les résultats")
+    parser.add_argument("--output", default=RESULTS_FILE, help="fichier des résultats (JSON Lines)")
+    parser.add_argument("--no-save", action="store_true", help="ne pas enregistrer les résultats")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="hausse de durée (en %%) signalée comme régression")
+    args = parser.parse_args()
+
+    mock = MockDataverse(latency=args.latency, batch_part_latency=args.batch_part_latency)
+    server = MockDataverseServer(mock)
+    server.start()
+    run_info = {
+        'label': args.label,
+        'commit': _git_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'latency': args.latency,
+        'batch_part_latency': args.batch_part_latency,
+    }
+    print(f"Benchmark sur {server.url} (commit {run_info['commit'] or '?'}, latence {args.latency} s)")
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            env_file = os.path.join(work_dir, "env.json")
+            server.write_env(env_file)
+            if args.only in (None, "export"):
+                results += bench_export(server, mock, env_file, work_dir, args.bacs, args.types, args.repeat)
+            if args.only in (None, "bulk"):
+                results += bench_bulk(mock, env_file, work_dir, args.records, args.batch_sizes, args.concurrencies,
+                                      args.repeat)
+    finally:
+        server.stop()
+
+    # Les mesures ne sont comparables qu'à latence égale
+    previous = [result for result in load_results(args.output)
+                if result.get('latency') == args.latency
+                and result.get('batch_part_latency') == args.batch_part_latency]
+    regressions = compare(previous, results, args.threshold)
+    if not args.no_save:
+        save_results(args.output, results, run_info)
+        print(f"\nRésultats ajoutés à {args.output}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,23 @@
 from PyConnectDataverse import authenticate_with_msal
+from PyConnectDataverse.batch_engine import THROTTLED_STATUS_CODES, retry_after
+from PyConnectDataverse.json_stream import CollectionReader, ColumnBuffer
+from PyConnectDataverse.request_trace import trace_requests
+from PyConnectDataverse.transfer_stats import measure_transfers
+from entity_cache import EntityCache
+import metrics
 import sys
 import json
+import time
 import pandas as pd
 import os
 
+# Nombre d'enregistrements par page demandé à Dataverse (Prefer: odata.maxpagesize)
+PAGE_SIZE = 5000
+
+# Nombre d'identifiants par filtre "id eq ... or id eq ...", pour que l'URL reste
+# bien en dessous de la limite de Dataverse (32 Ko)
+IDS_PER_REQUEST = 100
+
 class NewDataverseConnector:
     """Gère la connexion et les requêtes à Dataverse pour la nouvelle application"""
     def __init__(self, client_id, tenant_id, env_url, path_to_env=None):
@@ -51,6 +65,16 @@ class NewDataverseConnector:
         
         self.session_token = None
         self.env_token = None
+        self.transfer_stats = None
+        self.request_tracer = None
+        # Noms des ensembles d'entités déjà résolus (nom logique -> EntitySetName)
+        self.entity_set_names = {}
+        # Enregistrements des tables de référence (modèles marqués `cached`, voir entity_cache.py)
+        self.entity_cache = EntityCache()
+
+    def requires_sign_in(self):
+        """Indique si connect() ouvrirait une fenêtre de connexion (ni secret client, ni compte déjà connecté)"""
+        return authenticate_with_msal.requires_sign_in(self.path_to_env)
 
     def get_access_token(self, path):
         """Obtient le token d'accès"""
@@ -65,6 +89,9 @@ class NewDataverseConnector:
         """Établit la connexion avec Dataverse"""
         try:
             self.session_token, self.env_token = self.get_access_token(self.path_to_env)
+            self.transfer_stats = measure_transfers(self.session_token)
+            metrics.observe_session(self.session_token)
+            self.request_tracer = trace_requests(self.session_token)
             print("Connexion à Dataverse réussie")
             return True
         except Exception as e:
@@ -82,10 +109,14 @@ class NewDataverseConnector:
         Returns:
             str: Nom de l'ensemble d'entités, ou None si non trouvé
         """
+        metrics.cache_lookup("entity_set_names", logical_name in self.entity_set_names)
+        if logical_name in self.entity_set_names:
+            return self.entity_set_names[logical_name]
+
         request_uri = f'{self.env_token}api/data/v9.2/EntityDefinitions(LogicalName=\'{logical_name}\')?$select=EntitySetName'
         
         try:
-            r = self.session_token.get(request_uri)
+            r = self.get(request_uri)
             
             if r.status_code != 200:
                 print(f"Requête échouée pour EntitySetName de {logical_name}: Code {r.status_code}")
@@ -95,6 +126,7 @@ class NewDataverseConnector:
             if 'EntitySetName' in data:
                 entity_set_name = data['EntitySetName']
                 print(f"Nom d'entité pour l'API: {entity_set_name}")
+                self.entity_set_names[logical_name] = entity_set_name
                 return entity_set_name
             else:
                 print(f"Pas de EntitySetName trouvé pour {logical_name}")
@@ -104,6 +136,96 @@ class NewDataverseConnector:
             print(f"Erreur lors de la récupération du nom d'entité: {str(e)}")
             return None
 
+    def get(self, request_uri, headers=None, max_retries=5, stream=False):
+        """
+        Exécute une requête GET, en attendant puis en réessayant si Dataverse
+        limite le débit (429/503, en-tête Retry-After).
+        """
+        for attempt in range(max_retries + 1):
+            r = self.session_token.get(request_uri, headers=headers, stream=stream)
+            if r.status_code not in THROTTLED_STATUS_CODES or attempt == max_retries:
+                return r
+            r.close()
+            delay = retry_after(r, attempt)
+            print(f"Limitation de débit ({r.status_code}), nouvel essai dans {delay:.0f} s")
+            time.sleep(delay)
+
+    def read_collection(self, request_uri, headers=None):
+        """
+        Lance une requête renvoyant une collection ({"value": [...]}) dont les
+        enregistrements sont lus au fur et à mesure du téléchargement.
+
+        Returns:
+            CollectionReader: Itérable sur les enregistrements de la réponse
+
+        Raises:
+            RuntimeError: Si la requête échoue
+        """
+        r = self.get(request_uri, headers=headers, stream=True)
+        if r.status_code != 200:
+            raise RuntimeError(f"Requête échouée: Code {r.status_code} {r.text[:200]}")
+        return CollectionReader(r, self.transfer_stats)
+
+    def iter_records(self, entity_set_name, select=None, filter=None, orderby=None, page_size=PAGE_SIZE, top=None):
+        """
+        Parcourt les enregistrements d'une table un par un, page après page, en
+        suivant @odata.nextLink. Les arguments sont ceux de iter_pages.
+
+        Yields:
+            dict: Chaque enregistrement, dès qu'il a été lu
+
+        Raises:
+            RuntimeError: Si une requête échoue
+        """
+        query_options = []
+        if select:
+            query_options.append(f'$select={select}')
+        if filter:
+            query_options.append(f'$filter={filter}')
+        if orderby:
+            query_options.append(f'$orderby={orderby}')
+        if top:
+            query_options.append(f'$top={top}')
+
+        request_uri = f'{self.env_token}api/data/v9.2/{entity_set_name}'
+        if query_options:
+            request_uri += '?' + '&'.join(query_options)
+        headers = {'Prefer': f'odata.maxpagesize={page_size}'}
+
+        while request_uri:
+            reader = self.read_collection(request_uri, headers=headers)
+            yield from reader
+            if not reader.found_value:
+                raise RuntimeError(f"La clé 'value' n'est pas dans la réponse pour {entity_set_name}")
+            request_uri = reader.next_link
+
+    def iter_pages(self, entity_set_name, select=None, filter=None, orderby=None, page_size=PAGE_SIZE, top=None):
+        """
+        Parcourt les enregistrements d'une table page par page en suivant @odata.nextLink.
+
+        Args:
+            entity_set_name (str): Nom de l'ensemble d'entités (ex: crcfe_tournees)
+            select (str, optional): Colonnes à sélectionner, séparées par des virgules
+            filter (str, optional): Filtre OData à appliquer
+            orderby (str, optional): Tri OData
+            page_size (int, optional): Nombre maximum d'enregistrements par page
+            top (int, optional): Nombre maximum d'enregistrements en tout
+
+        Yields:
+            list: Les enregistrements (dict) de chaque page
+
+        Raises:
+            RuntimeError: Si une requête échoue
+        """
+        page = []
+        for record in self.iter_records(entity_set_name, select, filter, orderby, page_size, top):
+            page.append(record)
+            if len(page) >= page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
     def get_table_data(self, table_name, select=None, filter=None, only_custom=True):
         """
         Récupère les données d'une table Dataverse avec options de filtrage.
@@ -123,36 +245,25 @@ class NewDataverseConnector:
             # Si on ne peut pas obtenir le nom correct, essayer avec le nom original
             entity_set_name = table_name
         
-        # Construire l'URL de requête
-        request_uri = f'{self.env_token}api/data/v9.2/{entity_set_name}'
-        
+        print(f"Requête sur {entity_set_name} avec le filtre: {filter}")
+            
+        # Exécuter la requête, en suivant les pages (@odata.nextLink)
         # D'abord récupérer toutes les données sans sélection de colonnes spécifiques
         # pour éviter les problèmes avec les colonnes Lookup
-        query_options = []
-        if filter:
-            query_options.append(f'$filter={filter}')
-            
-        if query_options:
-            request_uri += '?' + '&'.join(query_options)
-        
-        print(f"URL de requête: {request_uri}")
-            
-        # Exécuter la requête
+        # Les enregistrements sont rangés directement par colonne au fil de la lecture
+        def is_custom(col):
+            return col.startswith('crcfe_') or col.startswith('new_')
+
+        buffer = ColumnBuffer(keep=is_custom if only_custom else None)
         try:
-            r = self.session_token.get(request_uri)
-            
-            if r.status_code != 200:
-                print(f"Requête échouée pour la table {table_name}: Code {r.status_code}")
-                if r.text:
-                    print(f"Détails de l'erreur: {r.text[:200]}...")
-                return None
-                
-            raw = json.loads(r.content.decode('utf-8'))
-            if 'value' not in raw:
-                print(f"La clé 'value' n'est pas dans la réponse pour la table {table_name}")
-                return None
-                
-            df = pd.DataFrame(raw['value'])
+            buffer.extend(self.iter_records(entity_set_name, filter=filter))
+        except Exception as e:
+            # Requête refusée, connexion coupée ou réponse illisible au milieu d'une page
+            print(f"Erreur lors de la récupération des données: {str(e)}")
+            return None
+
+        try:
+            df = buffer.to_frame()
             
             if df.empty:
                 print(f"Aucune donnée trouvée dans la table {table_name}")
@@ -161,7 +272,7 @@ class NewDataverseConnector:
             # Filtrer pour ne conserver que les colonnes personnalisées si demandé
             if only_custom and not df.empty:
                 # Trouver toutes les colonnes qui commencent par crcfe_ ou new_
-                custom_cols = [col for col in df.columns if col.startswith('crcfe_') or col.startswith('new_')]
+                custom_cols = [col for col in df.columns if is_custom(col)]
                 
                 # S'assurer qu'on a des colonnes à afficher
                 if custom_cols:
@@ -177,6 +288,91 @@ class NewDataverseConnector:
             print(f"Erreur lors de la récupération des données: {str(e)}")
             return None
             
+    def get_records(self, model, filter=None):
+        """
+        Récupère les enregistrements d'une table sous forme d'objets typés,
+        construits directement à partir du JSON (sans DataFrame).
+
+        Args:
+            model: Classe du module models (Tournee, Agent, Bac, Adresse, Vidage...)
+            filter (str, optional): Filtre OData à appliquer
+
+        Returns:
+            list: Les objets, ou None si la requête a échoué
+        """
+        entity_set_name = self.get_entity_set_name(model.table) or model.table
+        print(f"Requête sur {entity_set_name} avec le filtre: {filter}")
+
+        try:
+            return [model.from_record(record) for record in self.iter_records(entity_set_name, filter=filter)]
+        except Exception as e:
+            # Requête refusée, connexion coupée ou réponse illisible au milieu d'une page
+            print(f"Erreur lors de la récupération des données: {str(e)}")
+            return None
+
+    def get_records_by_ids(self, model, column, ids, ids_per_request=IDS_PER_REQUEST):
+        """
+        Récupère les enregistrements dont la colonne vaut l'un des identifiants,
+        en plusieurs requêtes si la liste est longue.
+
+        Pour les modèles marqués `cached` (tables de référence), column doit être la
+        clé primaire : les enregistrements déjà en cache (entity_cache) ne sont pas
+        redemandés à Dataverse. Avec refresh_interval, les enregistrements modifiés
+        (modifiedon) ne remplacent que ceux encore en cache ; un enregistrement
+        supprimé dans Dataverse reste servi jusqu'à son expiration (ttl).
+
+        Args:
+            model: Classe du module models
+            column (str): Colonne comparée aux identifiants (ex: new_agentsid)
+            ids (list): Identifiants recherchés
+            ids_per_request (int, optional): Nombre d'identifiants par requête
+
+        Returns:
+            list: Les objets, dans l'ordre des identifiants si le modèle est en cache,
+                ou None si une requête a échoué
+        """
+        ids = list(dict.fromkeys(ids))
+        cache = self.entity_cache if getattr(model, 'cached', False) else None
+        if cache is not None:
+            self.refresh_cache(model)
+            found, missing = cache.get_many(model.table, ids)
+            metrics.cache_lookup(model.table, True, len(found))
+            metrics.cache_lookup(model.table, False, len(missing))
+            if not missing:
+                return [found[record_id] for record_id in ids if record_id in found]
+        else:
+            missing = ids
+
+        records = []
+        for start in range(0, len(missing), ids_per_request):
+            filter = " or ".join([f"{column} eq '{record_id}'" for record_id in missing[start:start + ids_per_request]])
+            chunk = self.get_records(model, filter=filter)
+            if chunk is None:
+                return None
+            records.extend(chunk)
+
+        if cache is None:
+            return records
+        cache.put_many(model.table, records)
+        found.update((record.id, record) for record in records)
+        return [found[record_id] for record_id in ids if record_id in found]
+
+    def refresh_cache(self, model):
+        """
+        Remplace dans le cache les enregistrements du modèle modifiés dans Dataverse
+        depuis la dernière interrogation, si l'intervalle de rafraîchissement est écoulé.
+        """
+        since = self.entity_cache.refresh_since(model.table)
+        if since is None:
+            return
+        started = time.time()
+        changed = self.get_records(model, filter=f"modifiedon ge {since}")
+        if changed is None:
+            # Nouvel essai à l'intervalle suivant, les enregistrements expirent entre-temps
+            return
+        self.entity_cache.update(model.table, changed)
+        self.entity_cache.refreshed(model.table, started)
+
     def list_tables(self):
         """
         Liste les tables disponibles dans l'environnement Dataverse 
@@ -188,18 +384,19 @@ class NewDataverseConnector:
         request_uri = f'{self.env_token}api/data/v9.2/EntityDefinitions?$select=LogicalName'
         
         try:
-            r = self.session_token.get(request_uri)
-            
-            if r.status_code != 200:
-                print(f"Requête échouée pour la liste des tables: Code {r.status_code}")
+            try:
+                reader = self.read_collection(request_uri)
+            except RuntimeError as e:
+                print(f"Requête échouée pour la liste des tables: {str(e)}")
                 return None
-                
-            raw = json.loads(r.content.decode('utf-8'))
-            if 'value' not in raw:
+
+            buffer = ColumnBuffer()
+            buffer.extend(reader)
+            if not reader.found_value:
                 print(f"La clé 'value' n'est pas dans la réponse")
                 return None
                 
-            df = pd.DataFrame(raw['value'])
+            df = buffer.to_frame()
             print(f"Nombre total de tables trouvées: {len(df)}")
             
             # Filtrer pour ne garder que les tables commençant par "new_" ou "crcfe_"
@@ -232,18 +429,19 @@ class NewDataverseConnector:
                     f'/Attributes?$select=LogicalName,AttributeType')
         
         try:
-            r = self.session_token.get(request_uri)
-            
-            if r.status_code != 200:
-                print(f"Requête échouée pour les colonnes de {table_name}: Code {r.status_code}")
+            try:
+                reader = self.read_collection(request_uri)
+            except RuntimeError as e:
+                print(f"Requête échouée pour les colonnes de {table_name}: {str(e)}")
                 return None
-                    
-            raw = json.loads(r.content.decode('utf-8'))
-            if 'value' not in raw:
+
+            buffer = ColumnBuffer()
+            buffer.extend(reader)
+            if not reader.found_value:
                 print(f"La clé 'value' n'est pas dans la réponse")
                 return None
                     
-            df = pd.DataFrame(raw['value'])
+            df = buffer.to_frame()
             print(f"Nombre total de colonnes trouvées: {len(df)}")
             
             # Filtrer pour ne garder que les colonnes personnalisées
@@ -0,0 +1,326 @@
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import pandas as pd
+from dataverse_connector import NewDataverseConnector, PAGE_SIZE
+from export import DATAVERSE_CONFIG
+
+try:
+    import pyarrow as pa  # optionnel, pip install pyarrow (format Parquet)
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Téléchargement complet d'une table Dataverse vers un fichier CSV ou Parquet.
+#
+#   python download.py new_bacs bacs.parquet
+#   python download.py new_bacs bacs.csv --partition-by createdon --partitions 8
+#   python download.py crcfe_tournees tournees.csv --filter "crcfe_type_collecte eq 'EP'" --partition-by guid
+#
+# Les pages (Prefer: odata.maxpagesize) sont suivies avec @odata.nextLink et écrites
+# dans le fichier dès leur arrivée : la mémoire utilisée ne dépend pas de la taille
+# de la table.
+#
+# Avec --partition-by, la table est découpée en plages lues en parallèle :
+#   - createdon : plages de dates de création de même durée entre le premier et le
+#     dernier enregistrement ;
+#   - guid : plages de la clé primaire. SQL Server compare les GUID en commençant par
+#     le dernier groupe, les bornes portent donc sur son premier octet.
+# La première et la dernière plage sont ouvertes, aucun enregistrement n'est oublié.
+# L'ordre des lignes dans le fichier n'est alors pas garanti.
+
+
+def table_metadata(connector, table_name):
+    """
+    Récupère le nom de l'ensemble d'entités et la clé primaire d'une table.
+
+    Returns:
+        dict: EntitySetName et PrimaryIdAttribute
+    """
+    request_uri = (f"{connector.env_token}api/data/v9.2/EntityDefinitions(LogicalName='{table_name}')"
+                   f"?$select=EntitySetName,PrimaryIdAttribute")
+    r = connector.get(request_uri)
+    if r.status_code != 200:
+        raise RuntimeError(f"Requête échouée pour les métadonnées de {table_name}: Code {r.status_code}")
+    return json.loads(r.content.decode('utf-8'))
+
+
+def createdon_range(connector, entity_set_name, filter=None):
+    """Dates de création du premier et du dernier enregistrement, ou None si la table est vide."""
+    bounds = []
+    for direction in ('asc', 'desc'):
+        request_uri = (f"{connector.env_token}api/data/v9.2/{entity_set_name}"
+                       f"?$select=createdon&$orderby=createdon {direction}&$top=1")
+        if filter:
+            request_uri += f"&$filter={filter}"
+        r = connector.get(request_uri)
+        if r.status_code != 200:
+            raise RuntimeError(f"Requête échouée pour les dates de création de {entity_set_name}: Code {r.status_code}")
+        value = json.loads(r.content.decode('utf-8')).get('value', [])
+        if not value:
+            return None
+        bounds.append(datetime.fromisoformat(value[0]['createdon'].replace('Z', '+00:00')))
+    return bounds[0], bounds[1]
+
+
+def _ranges(column, boundaries):
+    """Filtres OData des plages délimitées par les bornes, la première et la dernière étant ouvertes."""
+    if not boundaries:
+        return [None]
+    filters = [f"{column} lt {boundaries[0]}"]
+    filters.extend(f"{column} ge {low} and {column} lt {high}" for low, high in zip(boundaries, boundaries[1:]))
+    filters.append(f"{column} ge {boundaries[-1]}")
+    return filters
+
+
+def createdon_partitions(first, last, partitions):
+    step = (last - first) / partitions
+    boundaries = sorted({(first + step * i).astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+                         for i in range(1, partitions)})
+    return _ranges('createdon', boundaries)
+
+
+def guid_partitions(primary_key, partitions):
+    partitions = min(partitions, 256)
+    boundaries = [f"00000000-0000-0000-0000-{(256 * i) // partitions:02x}0000000000" for i in range(1, partitions)]
+    return _ranges(primary_key, boundaries)
+
+
+def _combine(filter, partition_filter):
+    if not filter:
+        return partition_filter
+    if not partition_filter:
+        return filter
+    return f"({filter}) and ({partition_filter})"
+
+
+class CsvPageWriter:
+    """
+    Ajoute les pages à un fichier CSV.
+
+    Dataverse omet les colonnes vides d'un enregistrement : une colonne peut n'apparaître
+    qu'après la première page. Elle est alors ajoutée à la fin des colonnes, et le
+    fichier est réécrit à la fermeture avec l'en-tête complet, les lignes déjà écrites
+    étant complétées par des cellules vides.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.columns = None
+        self.header_columns = 0
+        self.lock = threading.Lock()
+
+    def write(self, records):
+        df = pd.DataFrame.from_records(records)
+        with self.lock:
+            header = self.columns is None
+            if header:
+                self.columns = list(df.columns)
+                self.header_columns = len(self.columns)
+            else:
+                added = [column for column in df.columns if column not in self.columns]
+                if added:
+                    print(f"Colonnes apparues après la première page: {', '.join(added)}")
+                    self.columns.extend(added)
+                df = df.reindex(columns=self.columns)
+            df.to_csv(self.file, header=header, index=False)
+
+    def close(self):
+        self.file.close()
+        if self.columns is None or len(self.columns) == self.header_columns:
+            return
+        print(f"Réécriture de {self.path} avec les {len(self.columns)} colonnes")
+        with open(self.path, newline='', encoding='utf-8') as source, \
+                open(self.path + ".tmp", 'w', newline='', encoding='utf-8') as target:
+            reader = csv.reader(source)
+            writer = csv.writer(target)
+            next(reader)
+            writer.writerow(self.columns)
+            padding = len(self.columns)
+            for row in reader:
+                writer.writerow(row + [''] * (padding - len(row)))
+        os.replace(self.path + ".tmp", self.path)
+
+
+class ParquetPageWriter:
+    """
+    Ajoute les pages à un fichier Parquet, un groupe de lignes par page.
+
+    Le schéma est celui de la première page. Les colonnes vides y sont typées en
+    texte et les colonnes entières en flottants, car une colonne numérique peut ne
+    contenir que des entiers sur une page et des décimaux sur la suivante.
+
+    Une colonne qui n'apparaît qu'après la première page (Dataverse omet les colonnes
+    vides) est ajoutée au schéma : les pages suivantes sont écrites dans un nouveau
+    fichier partiel, et les fichiers partiels sont réunis à la fermeture, les colonnes
+    absentes d'un fichier y étant vides.
+    """
+
+    def __init__(self, path):
+        if pa is None:
+            raise RuntimeError("Le format Parquet nécessite pyarrow (pip install pyarrow)")
+        self.path = path
+        self.writer = None
+        self.schema = None
+        self.parts = []
+        self.lock = threading.Lock()
+
+    def _first_schema(self, df):
+        fields = []
+        for field in pa.Schema.from_pandas(df, preserve_index=False):
+            if pa.types.is_null(field.type):
+                field = field.with_type(pa.string())
+            elif pa.types.is_integer(field.type):
+                field = field.with_type(pa.float64())
+            fields.append(field)
+        return pa.schema(fields)
+
+    def _open_part(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.parts.append(f"{self.path}.part{len(self.parts)}")
+        self.writer = pq.ParquetWriter(self.parts[-1], self.schema)
+
+    def write(self, records):
+        df = pd.DataFrame.from_records(records)
+        with self.lock:
+            if self.schema is None:
+                self.schema = self._first_schema(df)
+                self._open_part()
+            else:
+                added = [column for column in df.columns if column not in self.schema.names]
+                if added:
+                    print(f"Colonnes apparues après la première page: {', '.join(added)}")
+                    for field in self._first_schema(df[added]):
+                        self.schema = self.schema.append(field)
+                    self._open_part()
+            df = df.reindex(columns=self.schema.names)
+            for field in self.schema:
+                if pa.types.is_string(field.type):
+                    column = df[field.name]
+                    df[field.name] = column.where(column.isna(), column.astype(str))
+            self.writer.write_table(pa.Table.from_pandas(df, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        if len(self.parts) == 1:
+            os.replace(self.parts[0], self.path)
+            return
+        # Réunion des fichiers partiels, groupe de lignes par groupe de lignes
+        with pq.ParquetWriter(self.path, self.schema) as writer:
+            for part in self.parts:
+                source = pq.ParquetFile(part)
+                for index in range(source.num_row_groups):
+                    table = source.read_row_group(index)
+                    for field in self.schema:
+                        if field.name not in table.column_names:
+                            table = table.append_column(field, pa.nulls(table.num_rows, field.type))
+                    writer.write_table(table.select(self.schema.names))
+                os.remove(part)
+
+
+def open_writer(output_file, file_format=None):
+    file_format = file_format or os.path.splitext(output_file)[1].lstrip('.').lower()
+    if file_format == 'parquet':
+        return ParquetPageWriter(output_file)
+    if file_format == 'csv':
+        return CsvPageWriter(output_file)
+    raise ValueError(f"Format de fichier non pris en charge: {file_format} (csv ou parquet)")
+
+
+def download_table(connector, table_name, output_file, select=None, filter=None, partition_by=None,
+                   partitions=4, page_size=PAGE_SIZE, file_format=None):
+    """
+    Télécharge tous les enregistrements d'une table dans un fichier CSV ou Parquet.
+
+    Args:
+        connector (NewDataverseConnector): Connecteur déjà connecté
+        table_name (str): Nom logique de la table
+        output_file (str): Fichier de sortie
+        select (str, optional): Colonnes à sélectionner, séparées par des virgules
+        filter (str, optional): Filtre OData à appliquer
+        partition_by (str, optional): 'createdon' ou 'guid' pour lire des plages en parallèle
+        partitions (int, optional): Nombre de plages lues en parallèle
+        page_size (int, optional): Nombre maximum d'enregistrements par page
+        file_format (str, optional): 'csv' ou 'parquet', déduit de l'extension par défaut
+
+    Returns:
+        int: Nombre d'enregistrements téléchargés
+    """
+    metadata = table_metadata(connector, table_name)
+    entity_set_name = metadata['EntitySetName']
+
+    partition_filters = [None]
+    if partition_by == 'createdon':
+        bounds = createdon_range(connector, entity_set_name, filter)
+        if bounds:
+            partition_filters = createdon_partitions(bounds[0], bounds[1], partitions)
+    elif partition_by == 'guid':
+        partition_filters = guid_partitions(metadata['PrimaryIdAttribute'], partitions)
+    elif partition_by:
+        raise ValueError(f"Partitionnement inconnu: {partition_by} (createdon ou guid)")
+
+    filters = [_combine(filter, partition_filter) for partition_filter in partition_filters]
+    print(f"Téléchargement de {entity_set_name} en {len(filters)} plage(s) vers {output_file}")
+
+    writer = open_writer(output_file, file_format)
+    total = [0]
+    lock = threading.Lock()
+
+    def read(partition_filter):
+        count = 0
+        for page in connector.iter_pages(entity_set_name, select=select, filter=partition_filter,
+                                         page_size=page_size):
+            if page:
+                writer.write(page)
+                count += len(page)
+                with lock:
+                    total[0] += len(page)
+                    print(f"{total[0]} enregistrements téléchargés")
+        return count
+
+    start = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=len(filters)) as executor:
+            counts = list(executor.map(read, filters))
+    finally:
+        writer.close()
+
+    print(f"{sum(counts)} enregistrements écrits dans {output_file} en {time.time() - start:.1f} secondes")
+    if connector.transfer_stats is not None:
+        print(f"Transferts: {connector.transfer_stats.summary()}")
+    return sum(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Télécharge une table Dataverse vers un fichier CSV ou Parquet.")
+    parser.add_argument("table", help="nom logique de la table, ex: new_bacs")
+    parser.add_argument("output", help="fichier de sortie (.csv ou .parquet)")
+    parser.add_argument("--select", help="colonnes à sélectionner, séparées par des virgules")
+    parser.add_argument("--filter", help="filtre OData")
+    parser.add_argument("--partition-by", choices=("createdon", "guid"), help="lit des plages en parallèle")
+    parser.add_argument("--partitions", type=int, default=4, help="nombre de plages lues en parallèle")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE, help="enregistrements par page")
+    parser.add_argument("--format", choices=("csv", "parquet"), help="déduit de l'extension par défaut")
+    args = parser.parse_args()
+
+    connector = NewDataverseConnector(**DATAVERSE_CONFIG)
+    if not connector.connect():
+        print("Échec de la connexion à Dataverse")
+        return
+
+    download_table(connector, args.table, args.output, select=args.select, filter=args.filter,
+                   partition_by=args.partition_by, partitions=args.partitions, page_size=args.page_size,
+                   file_format=args.format)
+
+
+if __name__ == "__main__":
+    main()
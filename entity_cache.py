@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+# Cache des enregistrements des tables de référence (agents, adresses), utilisé par
+# NewDataverseConnector.get_records_by_ids pour les modèles marqués `cached`.
+#
+# Les enregistrements sont rangés par (table, identifiant) et expirent après `ttl`
+# secondes. Au-delà de `max_entries`, les moins récemment utilisés sont retirés.
+# Seuls les identifiants absents du cache sont demandés à Dataverse : un nouvel
+# export d'une tournée déjà vue ne relit ni ses agents ni ses adresses.
+#
+# Avec `refresh_interval`, le connecteur demande en plus à Dataverse, au plus une fois
+# par intervalle et par table, les enregistrements modifiés depuis le passage
+# précédent (modifiedon) et remplace ceux du cache : une modification est vue sans
+# attendre l'expiration. Les suppressions ne sont vues qu'à l'expiration.
+
+# Recouvrement entre deux interrogations, pour ne pas manquer une modification si
+# l'horloge locale est en avance sur celle de Dataverse
+REFRESH_OVERLAP = 60
+
+
+def _utc(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class EntityCache:
+    """
+    Cache borné, avec expiration, d'objets du module models (attribut id).
+
+    Args:
+        max_entries (int): Nombre maximum d'enregistrements gardés, toutes tables confondues
+        ttl (float): Durée de validité d'un enregistrement, en secondes
+        refresh_interval (float, optional): Délai entre deux interrogations de modifiedon
+            par table, en secondes ; None pour s'en tenir à l'expiration
+    """
+
+    def __init__(self, max_entries=50000, ttl=3600, refresh_interval=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self._entries = OrderedDict()  # (table, id) -> (expiration, objet)
+        self._watermarks = {}  # table -> (date du dernier passage, prochain passage)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_many(self, table, ids):
+        """
+        Returns:
+            tuple: (dict identifiant -> objet trouvé, liste des identifiants absents ou expirés)
+        """
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self._lock:
+            for record_id in ids:
+                entry = self._entries.get((table, record_id))
+                if entry is None or entry[0] < now:
+                    missing.append(record_id)
+                else:
+                    self._entries.move_to_end((table, record_id))
+                    found[record_id] = entry[1]
+        return found, missing
+
+    def put_many(self, table, items):
+        """Ajoute (ou remplace) des objets, en retirant les plus anciens au-delà de max_entries"""
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            if table not in self._watermarks:
+                self._watermarks[table] = (time.time(), time.monotonic() + (self.refresh_interval or 0))
+            for item in items:
+                self._entries[(table, item.id)] = (expires, item)
+                self._entries.move_to_end((table, item.id))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def update(self, table, items):
+        """Remplace les objets déjà présents (les autres ne sont pas ajoutés)"""
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for item in items:
+                if (table, item.id) in self._entries:
+                    self._entries[(table, item.id)] = (expires, item)
+
+    def refresh_since(self, table):
+        """
+        Date (ISO, UTC) à partir de laquelle chercher les modifications de la table si
+        une interrogation est due, sinon None. La suivante est prévue un intervalle
+        plus tard, que celle-ci réussisse ou non.
+        """
+        if not self.refresh_interval:
+            return None
+        with self._lock:
+            watermark = self._watermarks.get(table)
+            if watermark is None or watermark[1] > time.monotonic():
+                return None
+            # Pas d'autre interrogation de cette table pendant celle-ci
+            self._watermarks[table] = (watermark[0], time.monotonic() + self.refresh_interval)
+        return _utc(watermark[0] - REFRESH_OVERLAP)
+
+    def refreshed(self, table, started):
+        """Enregistre une interrogation réussie, commencée à `started` (time.time())"""
+        with self._lock:
+            self._watermarks[table] = (started, time.monotonic() + self.refresh_interval)
+
+    def invalidate(self, table=None):
+        """Vide le cache d'une table, ou tout le cache"""
+        with self._lock:
+            if table is None:
+                self._entries.clear()
+                self._watermarks.clear()
+                return
+            for key in [key for key in self._entries if key[0] == table]:
+                del self._entries[key]
+            self._watermarks.pop(table, None)
@@ -1,37 +1,159 @@
+import csv
+import json
 import os
 import pandas as pd
-import shutil
+from io import BytesIO, StringIO
 from datetime import datetime, timedelta
 from openpyxl import load_workbook
 from openpyxl.utils.dataframe import dataframe_to_rows
 from dataverse_connector import NewDataverseConnector
+from models import Adresse, Agent, AgentTournee, Bac, Tournee, Vidage
+from timings import ExportTimings
 from openpyxl.styles import Border, Side
 
-def export_tournee_vers_excel(tournee_id=None, output_file=None):
+try:
+    import pyarrow as pa  # optionnel, pip install pyarrow (format Parquet)
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Configuration du connecteur
+DATAVERSE_CONFIG = {
+    'client_id': '8993b267-820e-4aef-851a-62158ddef76b',
+    'tenant_id': 'df152455-73df-41a9-b48e-7fb075739495',
+    'env_url': 'https://org51f7f291.crm4.dynamics.com/' 
+}
+
+# Modèles Excel, lus une seule fois par processus (voir charger_modele)
+MODELES = ("Suivi EP.xlsx", "Suivi OM.xlsx")
+_contenu_modeles = {}
+
+def charger_modele(template_file):
     """
-    Exporte les données d'une tournée spécifique vers un fichier Excel basé sur un modèle
+    Renvoie le contenu du fichier modèle, gardé en mémoire après la première lecture.
     
     Args:
-        tournee_id (str, optional): ID de la tournée à exporter (crcfe_idtournees)
         template_file (str): Chemin du fichier Excel modèle
-        output_file (str, optional): Chemin du fichier Excel de sortie
     
     Returns:
-        bool: True si l'exportation a réussi, False sinon
+        bytes: Contenu du fichier
+    """
+    contenu = _contenu_modeles.get(template_file)
+    if contenu is None:
+        with open(template_file, 'rb') as f:
+            contenu = _contenu_modeles[template_file] = f.read()
+    return contenu
+
+def precharger_modeles():
+    """Lit les modèles présents à l'avance, pour que le premier export n'ait pas à le faire"""
+    for template_file in MODELES:
+        if os.path.exists(template_file):
+            charger_modele(template_file)
+
+# Colonnes des bacs dans la feuille (numéro de colonne) selon le type de tournée
+COLONNES_EP = {
+    'COMMUNE': 1,          
+    'N°': 2,               
+    'BIS_TER': 3,          
+    'NOM_RUE': 4,          
+    'TYPE_HABITAT': 5,     
+    'ACTIONS': 6,          
+    'SACS_OM': 7,          
+    'DEEE': 8,             
+    'DECHETS_TOXIQUES': 9, 
+    'GRAVATS': 10,         
+    'DECHETS_VEGETAUX': 11,
+    'VERRE': 12,           
+    'CARTON_MOUILLE': 13,  
+    'VETEMENT': 14,        
+    'AUTRES_DECHETS': 15,  
+    'OBSERVATION_ENSEIGNE': 16,   
+    'Commentaires': 17
+}
+COLONNES_OM = {
+    'COMMUNE': 1,
+    'N°': 2,
+    'BIS_TER': 3,
+    'NOM_RUE': 4,
+    'TYPE_HABITAT': 5,
+    'Volume du Bac': 6,
+    'TAUX': 7,
+    'Commentaires': 8
+}
+
+# Champs d'en-tête de la tournée (cellules C2 à C7 de la feuille)
+EN_TETE = ('tournee_id', 'type_collecte', 'date_suivi', 'equipe_agents', 'immatriculation',
+           'heure_debut', 'heure_fin', 'heures_vidage')
+
+# Lignes écrites entre deux envois pour les formats CSV et NDJSON
+LIGNES_PAR_BLOC = 500
+
+def _heure_locale(valeur, format, libelle):
     """
+    Convertit une date ISO de Dataverse (UTC) en heure locale (+2 h) au format donné.
+    Les autres valeurs sont renvoyées telles quelles.
+    """
+    try:
+        if isinstance(valeur, str) and 'T' in valeur:
+            dt = datetime.fromisoformat(valeur.replace('Z', '+00:00'))
+            dt = dt + timedelta(hours=2)
+            valeur = dt.strftime(format)
+        return valeur
+    except Exception as e:
+        print(f"Erreur lors de la conversion {libelle}: {e}")
+        return str(valeur)
+
+def ecrire_lignes(sheet, start_row, column_mapping, df):
+    """
+    Écrit les lignes d'un DataFrame dans la feuille à partir de start_row, une colonne
+    de la feuille par entrée de column_mapping (les colonnes absentes restent vides).
     
-    # Configuration du connecteur
-    config = {
-        'client_id': '8993b267-820e-4aef-851a-62158ddef76b',
-        'tenant_id': 'df152455-73df-41a9-b48e-7fb075739495',
-        'env_url': 'https://org51f7f291.crm4.dynamics.com/' 
-    }
+    Les colonnes sont converties en liste de listes en une fois : la boucle d'écriture
+    ne fait plus qu'un appel par cellule, sans iterrows ni recherche dans une Series.
+    Les cellules existantes du modèle gardent leur mise en forme.
     
-    # Créer et connecter le connecteur
-    connector = NewDataverseConnector(**config)
-    if not connector.connect():
-        print("Échec de la connexion à Dataverse")
-        return False
+    Args:
+        sheet (Worksheet): Feuille à remplir
+        start_row (int): Première ligne écrite
+        column_mapping (dict): Nom de colonne du DataFrame -> numéro de colonne de la feuille
+        df (DataFrame): Lignes à écrire
+    """
+    lignes = df.reindex(columns=list(column_mapping), fill_value='').values.tolist()
+    col_indexes = list(column_mapping.values())
+    cell = sheet.cell
+    for row_index, ligne in enumerate(lignes, start_row):
+        for col_index, value in zip(col_indexes, ligne):
+            cell(row=row_index, column=col_index, value=value)
+
+def lire_tournee(tournee_id=None, connector=None, timings=None):
+    """
+    Récupère dans Dataverse les données d'une tournée : en-tête, heures de vidage et bacs
+    avec leur adresse.
+    
+    Args:
+        tournee_id (str): ID de la tournée (crcfe_idtournees)
+        connector (NewDataverseConnector, optional): Connecteur déjà connecté à réutiliser
+        timings (ExportTimings, optional): Reçoit la durée de chaque étape
+    
+    Returns:
+        dict: tournee_id, is_ep, en_tete (champs de EN_TETE), heures_list et bacs (une
+            entrée par bac, clés des colonnes de la feuille), ou None en cas d'échec
+    """
+    if timings is None:
+        timings = ExportTimings(tournee_id or "")
+    
+    # Créer et connecter le connecteur si aucun n'est fourni
+    if connector is None:
+        with timings.span("connexion"):
+            connector = NewDataverseConnector(**DATAVERSE_CONFIG)
+            connected = connector.connect()
+        if not connected:
+            print("Échec de la connexion à Dataverse")
+            return None
+    timings.transfer_stats = connector.transfer_stats
+    if connector.request_tracer is not None:
+        # Les appels de cet export forment une trace distincte
+        connector.request_tracer.new_trace()
     
     # Construire le filtre pour récupérer la tournée spécifique
     filter_query = None
@@ -39,225 +161,206 @@ def export_tournee_vers_excel(tournee_id=None, output_file=None):
         filter_query = f"crcfe_idtournees eq '{tournee_id}'"
     else:
         print("Veuillez spécifier l'ID de la tournée")
-        return False
+        return None
     
     # Récupérer les données de la tournée
     print(f"Récupération des données de la tournée avec filtre: {filter_query}")
     
+    # Noms des ensembles d'entités des tables lues (mis en cache par le connecteur)
+    with timings.span("metadonnees"):
+        for model in (Tournee, AgentTournee, Agent, Bac, Adresse, Vidage):
+            connector.get_entity_set_name(model.table)
+
     # 1. Récupérer les données de base de la tournée
-    tournees_data = connector.get_table_data("crcfe_tournees", filter=filter_query, only_custom=True)
-    if tournees_data is None or tournees_data.empty:
+    with timings.span("tournee") as span:
+        tournees = connector.get_records(Tournee, filter=filter_query)
+        span.rows = len(tournees or [])
+    if not tournees:
         print("Aucune tournée trouvée avec les critères spécifiés")
-        return False
+        return None
     
-    print(f"Tournée trouvée: {len(tournees_data)} entrée(s)")
+    print(f"Tournée trouvée: {len(tournees)} entrée(s)")
+    tournee = tournees[0]
     
-    if 'crcfe_tourneesid' not in tournees_data.columns:
+    if tournee.id is None:
         print("La colonne 'crcfe_tourneesid' n'est pas présente dans les données de tournée")
-        return False
+        return None
     
-    tournee_unique_id = tournees_data['crcfe_tourneesid'].iloc[0]
-
-    type_collecte = tournees_data['crcfe_type_collecte'].iloc[0] if 'crcfe_type_collecte' in tournees_data.columns else "OM"
-    is_ep = type_collecte.upper() == "EP" if type_collecte else False
+    tournee_unique_id = tournee.id
+    is_ep = tournee.is_ep
+    timings.type_collecte = "EP" if is_ep else "OM"
 
     print(f"Type de tournée détecté: {'EP' if is_ep else 'OM'}")
-    template_file = "Suivi EP.xlsx" if is_ep else "Suivi OM.xlsx"
-    
-    if not os.path.exists(template_file):
-        print(f"Le fichier modèle '{template_file}' n'existe pas")
-        return False
-    
-    date_suivi = tournees_data['crcfe_date_suivi'].iloc[0] if 'crcfe_date_suivi' in tournees_data.columns else None
-    heure_debut = tournees_data['crcfe_heure_debut'].iloc[0] if 'crcfe_heure_debut' in tournees_data.columns else None
-    heure_fin = tournees_data['crcfe_heure_fin'].iloc[0] if 'crcfe_heure_fin' in tournees_data.columns else None
-    nom_equipe = tournees_data['crcfe_nom_equipe'].iloc[0] if 'crcfe_nom_equipe' in tournees_data.columns else None
-    immatriculation = tournees_data['crcfe_immatriculation_benne'].iloc[0] if 'crcfe_immatriculation_benne' in tournees_data.columns else None
     
     agents_filter = f"_crcfe_idtournees_value eq '{tournee_unique_id}'"
-    agents_data = connector.get_table_data("crcfe_agentstournees", filter=agents_filter, only_custom=False)
-    if agents_data is None:
+    with timings.span("agents_tournee") as span:
+        agents_tournee = connector.get_records(AgentTournee, filter=agents_filter)
+        span.rows = len(agents_tournee or [])
+    if agents_tournee is None:
         print("Erreur lors de la récupération des agents de la tournée")
-        agents_data = pd.DataFrame()
+        agents_tournee = []
     else:
-        print(f"Agents trouvés: {len(agents_data)} entrée(s)")
+        print(f"Agents trouvés: {len(agents_tournee)} entrée(s)")
     
     agents_noms = []
-    if not agents_data.empty:
-        agent_ids = []
-        if '_crcfe_id_agent_value' in agents_data.columns:
-            agent_ids = agents_data['_crcfe_id_agent_value'].dropna().tolist()
-        elif 'crcfe_id_agent' in agents_data.columns:
-            agent_ids = agents_data['crcfe_id_agent'].dropna().tolist()
+    agent_ids = [lien.agent_id for lien in agents_tournee if lien.agent_id]
+    if agent_ids:
+        # Récupérer les agents par leurs identifiants
+        with timings.span("agents") as span:
+            agents = connector.get_records_by_ids(Agent, "new_agentsid", agent_ids) or []
+            span.rows = len(agents)
         
-        if agent_ids:
-            # Construire un filtre pour récupérer les agents
-            agent_filter = " or ".join([f"new_agentsid eq '{a_id}'" for a_id in agent_ids])
-            agents_info = connector.get_table_data("new_agents", filter=agent_filter, only_custom=False)
-            
-            if agents_info is not None and not agents_info.empty:
-                
-                # Extraire les noms et prénoms
-                for _, agent in agents_info.iterrows():
-                    nom = ""
-                    prenom = ""
-                    
-                    # Rechercher les colonnes de nom et prénom
-                    for col in agent.index:
-                        if 'nom' in col.lower() and not 'prenom' in col.lower():
-                            nom = agent[col] if pd.notna(agent[col]) else ""
-                        elif 'prenom' in col.lower() or 'prénom' in col.lower():
-                            prenom = agent[col] if pd.notna(agent[col]) else ""
-                    
-                    # Ajouter le nom complet
-                    if prenom and nom:
-                        agents_noms.append(f"{prenom} {nom}")
-                    elif prenom:
-                        agents_noms.append(prenom)
-                    elif nom:
-                        agents_noms.append(nom)
+        # Ajouter le nom complet de chaque agent
+        agents_noms = [agent.nom_complet for agent in agents if agent.nom_complet]
 
     agents_str = ", ".join(agents_noms) if agents_noms else ""
     print(f"Noms des agents: {agents_str}")
     
     # 3. Récupérer les bacs associés à cette tournée
     bacs_filter = f"_crcfe_id_tournee_value eq '{tournee_unique_id}'"
-    bacs_data = connector.get_table_data("new_bacs", filter=bacs_filter, only_custom=False)
+    with timings.span("bacs") as span:
+        bacs = connector.get_records(Bac, filter=bacs_filter)
+        span.rows = len(bacs or [])
     
-    if bacs_data is None:
+    if bacs is None:
         print("Erreur lors de la récupération des bacs de la tournée")
-        bacs_data = pd.DataFrame()
+        bacs = []
     else:
-        print(f"Bacs trouvés: {len(bacs_data)} entrée(s)")
+        print(f"Bacs trouvés: {len(bacs)} entrée(s)")
     
     # 4. Récupérer les adresses associées aux bacs
-    adresses_data = None
     bacs_adresses = []
+    adresses_par_id = {}
     
     # Si des bacs ont été trouvés, récupérer leurs adresses
-    if not bacs_data.empty:
-        # Récupérer les IDs des bacs
-        bac_ids = []
-        bac_ids.extend(bacs_data['new_bacsid'].dropna().tolist())
-        
-        print(f"IDs des bacs trouvés: {bac_ids}")
+    if bacs:
+        print(f"IDs des bacs trouvés: {[bac.id for bac in bacs if bac.id]}")
         # Récupérer les adresses directement à partir des bacs
-        adresse_ids = []
-        
-        # Chercher le champ de lookup pour les adresses
-        adresse_ids.extend(bacs_data["_crcfe_adressebac_value"].dropna().tolist())
+        adresse_ids = [bac.adresse_id for bac in bacs if bac.adresse_id]
         
         if adresse_ids:
-            # Construire un filtre pour récupérer les adresses
-            adresse_filter = " or ".join([f"crcfe_listeadressesbacsid eq '{a_id}'" for a_id in adresse_ids])
-            adresses_data = connector.get_table_data("crcfe_listeadressesbacs", filter=adresse_filter, only_custom=False)
+            # Récupérer les adresses par leurs identifiants
+            with timings.span("adresses") as span:
+                adresses = connector.get_records_by_ids(Adresse, "crcfe_listeadressesbacsid", adresse_ids) or []
+                span.rows = len(adresses)
             
-            if adresses_data is not None and not adresses_data.empty:
-                print(f"Adresses trouvées directement à partir des bacs: {len(adresses_data)} entrée(s)")
-                
-            # Pour chaque bac, trouver son adresse associée et générer l'entrée pour Excel
-            for i, bac_row in bacs_data.iterrows():
-                adresse_id = bac_row.get('_crcfe_adressebac_value')
-                if adresse_id:
-                    # Trouver l'adresse correspondante
-                    adresse = adresses_data[adresses_data['crcfe_listeadressesbacsid'] == adresse_id]
+            if adresses:
+                print(f"Adresses trouvées directement à partir des bacs: {len(adresses)} entrée(s)")
+            for adresse in adresses:
+                adresses_par_id.setdefault(adresse.id, adresse)
+
+    # 5. Associer chaque bac à son adresse
+    with timings.span("jointure") as span:
+        # Pour chaque bac, trouver son adresse associée et générer l'entrée pour Excel
+        for bac in bacs:
+            adresse = adresses_par_id.get(bac.adresse_id) if bac.adresse_id else None
+            if adresse is not None:
+                bac_info = {
+                    'COMMUNE': adresse.commune,
+                    'N°': adresse.numero,
+                    'BIS_TER': adresse.bis_ter,
+                    'NOM_RUE': adresse.nom_rue,
+                    'TYPE_HABITAT': adresse.type_habitat,
+                }
                     
-                    if not adresse.empty:
-                        commune = adresse['crcfe_commune'].iloc[0] if 'crcfe_commune' in adresse.columns else ""
-                        numero = adresse['crcfe_numerorue'].iloc[0] if 'crcfe_numerorue' in adresse.columns else ""
-                        bis_ter = adresse['crcfe_bister'].iloc[0] if 'crcfe_bister' in adresse.columns else ""
-                        nom_rue = adresse['crcfe_nomrue'].iloc[0] if 'crcfe_nomrue' in adresse.columns else ""
-                        type_habitat = adresse['crcfe_typehabitat'].iloc[0] if 'crcfe_typehabitat' in adresse.columns else ""
-                        
-                        # Récupérer le volume du bac et le taux de remplissage
-                        bac_info = {
-                            'COMMUNE': commune,
-                            'N°': numero,
-                            'BIS_TER': bis_ter,
-                            'NOM_RUE': nom_rue,
-                            'TYPE_HABITAT': type_habitat,
-                        }
-                        
-                        # Ajouter les champs spécifiques selon le type de tournée
-                        if is_ep:
-                            # Récupérer l'action EP si disponible
-                            action_ep = ""
-                            for col in bac_row.index:
-                                if 'action_ep' in col.lower():
-                                    action_ep = bac_row[col] if pd.notna(bac_row[col]) else ""
-                            
-                            # Étendre avec les champs EP
-                            bac_info.update({
-                                'ACTIONS': action_ep,
-                                'SACS_OM': "",
-                                'DEEE': "",
-                                'DECHETS_TOXIQUES': "",
-                                'GRAVATS': "",
-                                'DECHETS_VEGETAUX': "",
-                                'VERRE': "",
-                                'CARTON_MOUILLE': "",
-                                'VETEMENT': "",
-                                'AUTRES': "",
-                                '*DECHETS': "",
-                                'OBSERVATION': "",
-                                '*ENSEIGNE': "",
-                                'Commentaires': ""
-                            })
-                        else:
-                            # Pour OM, ajouter les informations de volume et taux
-                            volume_bac = ""
-                            taux_remplissage = ""
-                            commentaire = ""
-                            
-                            for col in bac_row.index:
-                                if 'volume' in col.lower():
-                                    volume_bac = bac_row[col] if pd.notna(bac_row[col]) else ""
-                                elif 'taux' in col.lower() or 'remplissage' in col.lower():
-                                    taux_remplissage = bac_row[col] if pd.notna(bac_row[col]) else ""
-                                elif 'commentaire' in col.lower():
-                                    commentaire = bac_row[col] if pd.notna(bac_row[col]) else ""
-                            
-                            bac_info.update({
-                                'Volume du Bac': volume_bac,
-                                'TAUX': taux_remplissage,
-                                'Commentaires': commentaire
-                            })
-                        
-                        # Ajouter cette ligne à notre liste d'adresses de bacs
-                        bacs_adresses.append(bac_info)
-    
-    # Créer un DataFrame pour les bacs avec leurs adresses
-    bacs_df = pd.DataFrame(bacs_adresses)
+                # Ajouter les champs spécifiques selon le type de tournée
+                if is_ep:
+                    # Étendre avec les champs EP
+                    bac_info.update({
+                        'ACTIONS': bac.action_ep,
+                        'SACS_OM': "",
+                        'DEEE': "",
+                        'DECHETS_TOXIQUES': "",
+                        'GRAVATS': "",
+                        'DECHETS_VEGETAUX': "",
+                        'VERRE': "",
+                        'CARTON_MOUILLE': "",
+                        'VETEMENT': "",
+                        'AUTRES': "",
+                        '*DECHETS': "",
+                        'OBSERVATION': "",
+                        '*ENSEIGNE': "",
+                        'Commentaires': ""
+                    })
+                else:
+                    # Pour OM, ajouter les informations de volume et taux
+                    bac_info.update({
+                        'Volume du Bac': bac.volume,
+                        'TAUX': bac.taux,
+                        'Commentaires': bac.commentaire
+                    })
+                    
+                # Ajouter cette ligne à notre liste d'adresses de bacs
+                bacs_adresses.append(bac_info)
+        span.rows = len(bacs_adresses)
 
     vidage_filter = f"_crcfe_idtournees_value eq '{tournee_unique_id}'"
-    vidage_data = connector.get_table_data("new_vidages", filter=vidage_filter, only_custom=False)
+    with timings.span("vidages") as span:
+        vidages = connector.get_records(Vidage, filter=vidage_filter)
+        span.rows = len(vidages or [])
 
-    if vidage_data is None:
+    # Récupérer les heures de vidage
+    heures_list = []
+    if vidages is None:
         print("Erreur lors de la récupération des vidages de la tournée")
-        heures_vidage = ""
-    elif vidage_data.empty:
+    elif not vidages:
         print("Aucun vidage trouvé pour cette tournée")
-        heures_vidage = ""
     else:
-        print(f"Vidages trouvés: {len(vidage_data)} entrée(s)")
-
-        # Récupérer les heures de vidage
-        heures_list = []
-        for _, vidage in vidage_data.iterrows():
-            heure_vidage = vidage['new_heure_vidage']
-            if heure_vidage:
-                try:
-                    if isinstance(heure_vidage, str) and 'T' in heure_vidage:
-                        dt_heure_vidage = datetime.fromisoformat(heure_vidage.replace('Z', '+00:00'))
-                        dt_heure_vidage = dt_heure_vidage + timedelta(hours=2)
-                        heure_vidage = dt_heure_vidage.strftime('%H:%M')
-                    heures_list.append(heure_vidage)
-                except Exception as e:
-                    print(f"Erreur lors de la conversion de l'heure de vidage: {e}")
-                    heures_list.append(str(heure_vidage))
+        print(f"Vidages trouvés: {len(vidages)} entrée(s)")
+
+        for vidage in vidages:
+            if vidage.heure_vidage:
+                heures_list.append(_heure_locale(vidage.heure_vidage, '%H:%M', "de l'heure de vidage"))
+
+    equipe_agents = f"{tournee.nom_equipe or ''}"
+    if agents_str:
+        equipe_agents += f" / {agents_str}"
+
+    en_tete = {
+        'tournee_id': tournee_id,
+        'type_collecte': "EP" if is_ep else "OM",
+        'date_suivi': _heure_locale(tournee.date_suivi, '%d/%m/%Y', "de la date") if tournee.date_suivi else None,
+        'equipe_agents': equipe_agents,
+        'immatriculation': tournee.immatriculation,
+        'heure_debut': _heure_locale(tournee.heure_debut, '%H:%M', "de l'heure de début") if tournee.heure_debut else None,
+        'heure_fin': _heure_locale(tournee.heure_fin, '%H:%M', "de l'heure de fin") if tournee.heure_fin else None,
+        'heures_vidage': ", ".join(heures_list) if heures_list else "",
+    }
+    return {'tournee_id': tournee_id, 'is_ep': is_ep, 'en_tete': en_tete, 'heures_list': heures_list,
+            'bacs': bacs_adresses}
+
+def export_tournee_vers_excel(tournee_id=None, output_file=None, connector=None, timings=None):
+    """
+    Exporte les données d'une tournée spécifique vers un fichier Excel basé sur un modèle
     
-        heures_vidage = ", ".join(heures_list) if heures_list else ""
+    Args:
+        tournee_id (str, optional): ID de la tournée à exporter (crcfe_idtournees)
+        output_file (str, optional): Chemin du fichier Excel de sortie
+        connector (NewDataverseConnector, optional): Connecteur déjà connecté à réutiliser
+        timings (ExportTimings, optional): Reçoit la durée, le nombre de lignes et les octets
+            reçus de chaque étape (voir timings.py)
     
+    Returns:
+        bool: True si l'exportation a réussi, False sinon
+    """
+    if timings is None:
+        timings = ExportTimings(tournee_id or "")
+
+    donnees = lire_tournee(tournee_id, connector, timings)
+    if donnees is None:
+        return False
+
+    is_ep = donnees['is_ep']
+    en_tete = donnees['en_tete']
+    heures_list = donnees['heures_list']
+    template_file = MODELES[0] if is_ep else MODELES[1]
+    
+    if template_file not in _contenu_modeles and not os.path.exists(template_file):
+        print(f"Le fichier modèle '{template_file}' n'existe pas")
+        return False
+
+    # Créer un DataFrame pour les bacs avec leurs adresses
+    bacs_df = pd.DataFrame(donnees['bacs'])
     print(bacs_df)
 
     # Définir le nom du fichier de sortie s'il n'est pas spécifié
@@ -267,125 +370,161 @@ def export_tournee_vers_excel(tournee_id=None, output_file=None):
         tournee_identifier = tournee_id if tournee_id else "inconnue"
         output_file = f"Suivi_{type_str}_Tournee_{tournee_identifier}_{timestamp}.xlsx"
 
-    # Copier le fichier template
-    shutil.copy2(template_file, output_file)
-    print(f"Création du fichier de sortie: {output_file}")
-
-    # Ouvrir le fichier copié avec openpyxl
-    wb = load_workbook(output_file)
-    sheet_name = "Suivi de collecte EP" if is_ep else "Suivi de collecte OM"
-    sheet = wb[sheet_name]
-
-    if date_suivi:
-        try:
-            if isinstance(date_suivi, str) and 'T' in date_suivi:
-                dt_date_suivi = datetime.fromisoformat(date_suivi.replace('Z', '+00:00'))
-                dt_date_suivi = dt_date_suivi + timedelta(hours=2)
-                date_suivi = dt_date_suivi.strftime('%d/%m/%Y')
-            sheet['C2'] = date_suivi
-        except Exception as e:
-            print(f"Erreur lors de la conversion de la date: {e}")
-            sheet['C2'] = str(date_suivi)
-
-    equipe_agents = f"{nom_equipe or ''}"
-    if agents_str:
-        equipe_agents += f" / {agents_str}"
-    sheet['C3'] = equipe_agents
-
-    if immatriculation:
-        sheet['C4'] = immatriculation
-
-    if heure_debut:
-        try:
-            if isinstance(heure_debut, str) and 'T' in heure_debut:
-                dt_heure_debut = datetime.fromisoformat(heure_debut.replace('Z', '+00:00'))
-                dt_heure_debut = dt_heure_debut + timedelta(hours=2)
-                heure_debut = dt_heure_debut.strftime('%H:%M')
-            sheet['C5'] = heure_debut
-        except Exception as e:
-            print(f"Erreur lors de la conversion de l'heure de début: {e}")
-            sheet['C5'] = str(heure_debut)
-
-    if heure_fin:
-        try:
-            if isinstance(heure_fin, str) and 'T' in heure_fin:
-                dt_heure_fin = datetime.fromisoformat(heure_fin.replace('Z', '+00:00'))
-                dt_heure_fin = dt_heure_fin + timedelta(hours=2)
-                heure_fin = dt_heure_fin.strftime('%H:%M')
-            sheet['C6'] = heure_fin
-        except Exception as e:
-            print(f"Erreur lors de la conversion de l'heure de fin: {e}")
-            sheet['C6'] = str(heure_fin)
+    # Ouvrir le modèle avec openpyxl ; le fichier de sortie est écrit par wb.save
+    with timings.span("modele"):
+        wb = load_workbook(BytesIO(charger_modele(template_file)))
+        print(f"Création du fichier de sortie: {output_file}")
+
+    # Remplir la feuille
+    with timings.span("ecriture") as span:
+        sheet_name = "Suivi de collecte EP" if is_ep else "Suivi de collecte OM"
+        sheet = wb[sheet_name]
+
+        if en_tete['date_suivi']:
+            sheet['C2'] = en_tete['date_suivi']
+
+        sheet['C3'] = en_tete['equipe_agents']
+
+        if en_tete['immatriculation']:
+            sheet['C4'] = en_tete['immatriculation']
+
+        if en_tete['heure_debut']:
+            sheet['C5'] = en_tete['heure_debut']
+
+        if en_tete['heure_fin']:
+            sheet['C6'] = en_tete['heure_fin']
     
-    thick_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-
-    # Dans la partie où vous ajoutez les heures de vidage
-    if heures_list:
-        # Mettre chaque heure de vidage dans une cellule séparée
-        for idx, heure in enumerate(heures_list):
-            # Commencer à la colonne C (index 3) et continuer vers la droite
-            col_idx = 3 + idx  # C=3, D=4, E=5, etc.
-            col_letter = chr(65 + col_idx - 1)  # Convertir l'index en lettre (A=65 en ASCII)
-            cell = sheet[f'{col_letter}7']
-            cell.value = heure
+        thick_border = Border(
+            left=Side(style='thin'),
+            right=Side(style='thin'),
+            top=Side(style='thin'),
+            bottom=Side(style='thin')
+        )
+
+        # Dans la partie où vous ajoutez les heures de vidage
+        if heures_list:
+            # Mettre chaque heure de vidage dans une cellule séparée
+            for idx, heure in enumerate(heures_list):
+                # Commencer à la colonne C (index 3) et continuer vers la droite
+                col_idx = 3 + idx  # C=3, D=4, E=5, etc.
+                col_letter = chr(65 + col_idx - 1)  # Convertir l'index en lettre (A=65 en ASCII)
+                cell = sheet[f'{col_letter}7']
+                cell.value = heure
             
-            # Appliquer les bordures en gras à la cellule
-            cell.border = thick_border
+                # Appliquer les bordures en gras à la cellule
+                cell.border = thick_border
 
-    # Remplir les données des bacs
-    if not bacs_df.empty:
-        # Commencer à remplir à partir de la ligne 11
-        start_row = 11
-        
-        print(f"Remplissage des données de {len(bacs_df)} bacs dans le fichier Excel...")
+        # Remplir les données des bacs
+        if not bacs_df.empty:
+            # Commencer à remplir à partir de la ligne 11
+            start_row = 11
         
-        # Définir le mapping des colonnes selon le type de tournée
-        if is_ep:
-            column_mapping = {
-                'COMMUNE': 1,          
-                'N°': 2,               
-                'BIS_TER': 3,          
-                'NOM_RUE': 4,          
-                'TYPE_HABITAT': 5,     
-                'ACTIONS': 6,          
-                'SACS_OM': 7,          
-                'DEEE': 8,             
-                'DECHETS_TOXIQUES': 9, 
-                'GRAVATS': 10,         
-                'DECHETS_VEGETAUX': 11,
-                'VERRE': 12,           
-                'CARTON_MOUILLE': 13,  
-                'VETEMENT': 14,        
-                'AUTRES_DECHETS': 15,  
-                'OBSERVATION_ENSEIGNE': 16,   
-                'Commentaires': 17
-            }
-        else:
-            column_mapping = {
-                'COMMUNE': 1,
-                'N°': 2,
-                'BIS_TER': 3,
-                'NOM_RUE': 4,
-                'TYPE_HABITAT': 5,
-                'Volume du Bac': 6,
-                'TAUX': 7,
-                'Commentaires': 8
-            }
+            print(f"Remplissage des données de {len(bacs_df)} bacs dans le fichier Excel...")
         
-        for i, row in bacs_df.iterrows():
-            for col_name, col_index in column_mapping.items():
-                sheet.cell(row=start_row + i, column=col_index, value=row.get(col_name, ''))
+            # Définir le mapping des colonnes selon le type de tournée
+            column_mapping = COLONNES_EP if is_ep else COLONNES_OM
+            ecrire_lignes(sheet, start_row, column_mapping, bacs_df)
+        span.rows = len(bacs_df)
 
-    wb.save(output_file)
+    with timings.span("sauvegarde"):
+        wb.save(output_file)
     print(f"Le fichier Excel '{output_file}' a été créé avec succès.")
 
+    timings.finish()
     return True
 
+def lignes_tournee(donnees):
+    """
+    Lignes à plat d'une tournée pour les formats sans classeur : une par bac, avec
+    les champs d'en-tête (EN_TETE) suivis des colonnes de la feuille.
+    
+    Returns:
+        tuple: (noms des colonnes, générateur de listes de valeurs)
+    """
+    column_mapping = COLONNES_EP if donnees['is_ep'] else COLONNES_OM
+    en_tete = [donnees['en_tete'][champ] for champ in EN_TETE]
+    colonnes = list(EN_TETE) + list(column_mapping)
+    lignes = (en_tete + [bac.get(col_name, '') for col_name in column_mapping] for bac in donnees['bacs'])
+    return colonnes, lignes
+
+def _csv(donnees):
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    colonnes, lignes = lignes_tournee(donnees)
+    writer.writerow(colonnes)
+    for i, ligne in enumerate(lignes, 1):
+        writer.writerow(ligne)
+        if i % LIGNES_PAR_BLOC == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+def _ndjson(donnees):
+    colonnes, lignes = lignes_tournee(donnees)
+    bloc = []
+    for ligne in lignes:
+        bloc.append(json.dumps(dict(zip(colonnes, ligne)), ensure_ascii=False, default=str))
+        if len(bloc) == LIGNES_PAR_BLOC:
+            yield ("\n".join(bloc) + "\n").encode('utf-8')
+            bloc = []
+    if bloc:
+        yield ("\n".join(bloc) + "\n").encode('utf-8')
+
+def _parquet(donnees):
+    # Un fichier Parquet n'est lisible qu'une fois son pied de page écrit : il est
+    # produit en mémoire et envoyé d'un bloc
+    colonnes, lignes = lignes_tournee(donnees)
+    valeurs = list(zip(*lignes)) or [()] * len(colonnes)
+    arrays = []
+    for colonne in valeurs:
+        # Une colonne qui mélange texte et nombres est écrite en texte
+        if any(isinstance(v, str) for v in colonne) and not all(v is None or isinstance(v, str) for v in colonne):
+            colonne = [v if v is None else str(v) for v in colonne]
+        array = pa.array(colonne)
+        arrays.append(array.cast(pa.string()) if pa.types.is_null(array.type) else array)
+    buffer = BytesIO()
+    pq.write_table(pa.Table.from_arrays(arrays, names=colonnes), buffer)
+    yield buffer.getvalue()
+
+# Formats sans classeur : (fonction d'écriture, type MIME)
+FORMATS_FLUX = {
+    'csv': (_csv, 'text/csv; charset=utf-8'),
+    'ndjson': (_ndjson, 'application/x-ndjson'),
+    'parquet': (_parquet, 'application/vnd.apache.parquet'),
+}
+
+def verifier_format(format):
+    """
+    Vérifie qu'un format sans classeur peut être produit.
+    
+    Raises:
+        ValueError: Si le format n'est pas pris en charge
+        RuntimeError: Si le format Parquet est demandé sans pyarrow
+    """
+    if format not in FORMATS_FLUX:
+        raise ValueError(f"Format non pris en charge: {format} ({', '.join(FORMATS_FLUX)} ou xlsx)")
+    if format == 'parquet' and pa is None:
+        raise RuntimeError("Le format Parquet nécessite pyarrow (pip install pyarrow)")
+
+def ecrire_flux(donnees, format):
+    """
+    Écrit les lignes d'une tournée (voir lignes_tournee) en CSV, NDJSON ou Parquet,
+    sans passer par le modèle Excel.
+    
+    Args:
+        donnees (dict): Données renvoyées par lire_tournee
+        format (str): 'csv', 'ndjson' ou 'parquet'
+    
+    Returns:
+        generator: Blocs d'octets à envoyer au fur et à mesure
+    
+    Raises:
+        ValueError, RuntimeError: Voir verifier_format
+    """
+    verifier_format(format)
+    return FORMATS_FLUX[format][0](donnees)
+
 def main():
     """Fonction principale pour interagir avec l'utilisateur"""
     print("=== Exportation des données d'une tournée spécifique vers Excel ===")
@@ -0,0 +1,75 @@
+import multiprocessing
+import os
+import tempfile
+
+# Configuration de production : gunicorn -c gunicorn.conf.py app:app
+#
+# Chaque worker est un processus avec plusieurs threads (les exports passent
+# l'essentiel de leur temps à attendre Dataverse). Avant de recevoir des demandes,
+# chaque worker se préchauffe (app.warm_up) : authentification, modèles Excel en
+# mémoire et noms d'entités en cache, pour que la première demande soit aussi
+# rapide que les suivantes.
+#
+# Sans secret client (DATAVERSE_CLIENT_SECRET), l'authentification demanderait une
+# connexion interactive : elle est alors laissée à la première demande.
+#
+# L'admission et le regroupement des demandes d'une même tournée sont propres à chaque
+# worker : au plus workers × MAX_CONCURRENT_EXPORTS exports à la fois, et deux demandes
+# de la même tournée reçues par deux workers font deux exports. Les classeurs
+# pré-générés (PRERENDER_DIR) sont partagés. MAX_CONCURRENT_EXPORTS vaut par défaut la
+# moitié des threads, pour que les demandes en trop attendent une place puis reçoivent
+# un 503 au lieu d'occuper tous les threads du worker.
+# Les métriques des workers sont mises en commun dans METRICS_DIR (voir metrics.py),
+# défini ici avant le chargement de l'application pour que les workers en héritent.
+
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f"metrics_gunicorn_{os.getpid()}"))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 4)))
+worker_class = "gthread"
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Lu par app.py au chargement, dans chaque worker
+os.environ.setdefault('MAX_CONCURRENT_EXPORTS', str(max(threads // 2, 1)))
+
+# Un export de plusieurs milliers de bacs peut prendre plus d'une minute
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 180))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycler les workers de temps en temps limite l'effet d'une fuite mémoire (openpyxl)
+max_requests = 500
+max_requests_jitter = 50
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.environ.get('LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    # Dans le maître : les métriques d'une exécution précédente sont effacées
+    import metrics
+    metrics.clear_multiprocess_dir()
+    if int(os.environ['MAX_CONCURRENT_EXPORTS']) >= threads:
+        server.log.warning(f"MAX_CONCURRENT_EXPORTS ({os.environ['MAX_CONCURRENT_EXPORTS']}) >= threads ({threads}) : "
+                           "les demandes en trop occuperont les threads au lieu de recevoir un 503")
+
+
+def post_worker_init(worker):
+    # Appelé dans le worker, une fois l'application chargée et avant la première demande
+    import metrics
+    from app import warm_up
+    metrics.start_multiprocess()
+    warm_up()
+
+
+def worker_exit(server, worker):
+    # Dans le worker qui s'arrête : dernières valeurs de ses métriques
+    import metrics
+    metrics.write_snapshot()
+
+
+def child_exit(server, worker):
+    # Dans le maître : les compteurs du worker arrêté sont gardés, ses jauges retirées
+    import metrics
+    metrics.mark_process_dead(worker.pid)
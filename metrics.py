@@ -0,0 +1,393 @@
+import glob
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+from PyConnectDataverse.batch_engine import THROTTLED_STATUS_CODES
+
+# Métriques du service au format texte de Prometheus, exposées par /metrics (app.py).
+#
+# Les séries sont tenues en mémoire par le processus. Avec plusieurs workers
+# gunicorn, qui partagent le même port, chaque lecture de /metrics arrive à un
+# worker quelconque : pour que les compteurs ne varient pas d'une lecture à l'autre,
+# les workers mettent en commun leurs valeurs dans le dossier METRICS_DIR (défini
+# par gunicorn.conf.py). Chaque worker y écrit les siennes toutes les
+# METRICS_FLUSH_INTERVAL secondes, et /metrics additionne celles de tous les
+# workers :
+#   - compteurs et histogrammes : ceux des workers arrêtés sont gardés (archive),
+#     les totaux ne diminuent pas quand gunicorn remplace un worker ;
+#   - jauges : somme des workers en activité, sauf les jauges `aggregate="local"`
+#     (fichiers temporaires, communs à tous) calculées par le worker qui répond.
+# Les valeurs des autres workers ont au plus METRICS_FLUSH_INTERVAL secondes de retard.
+#
+# Les appels à Dataverse sont comptés par un hook de réponse installé sur la
+# session du connecteur (observe_session). La durée retenue est response.elapsed,
+# c'est-à-dire jusqu'à la réception des en-têtes, y compris pour les réponses lues
+# en flux.
+
+# Bornes des histogrammes, en secondes
+REQUEST_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+EXPORT_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+    aggregate = "sum"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} attend les labels {self.labelnames}, reçu {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def values(self):
+        """Copie des valeurs, {tuple de labels: valeur}"""
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self, values=None):
+        values = self.values() if values is None else values
+        return [(self.name, key, None, value) for key, value in values.items()]
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, key, extra, value in self.samples(values):
+            lines.append(f"{name}{_labels(self.labelnames, key, extra)} {_number(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Valeur instantanée. Avec `function`, la valeur est calculée à chaque lecture
+    (function renvoie un nombre, ou un dict {tuple de labels: nombre}).
+    Avec aggregate="local", la valeur n'est pas additionnée entre les workers.
+    """
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None, aggregate="sum"):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+        self.aggregate = aggregate
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def values(self):
+        if self.function is None:
+            return super().values()
+        value = self.function()
+        return value if isinstance(value, dict) else {(): value}
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=REQUEST_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def values(self):
+        with self._lock:
+            return {key: [list(counts), total, count] for key, (counts, total, count) in self._values.items()}
+
+    def samples(self, values=None):
+        values = self.values() if values is None else values
+        samples = []
+        for key, (counts, total, count) in values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                samples.append((f"{self.name}_bucket", key, f'le="{_number(float(bound))}"', bucket_count))
+            samples.append((f"{self.name}_sum", key, None, total))
+            samples.append((f"{self.name}_count", key, None, count))
+        return samples
+
+
+REGISTRY = []
+
+
+def render():
+    """Toutes les métriques, au format d'exposition texte de Prometheus"""
+    combined = _combined() if MULTIPROCESS_DIR else None
+    lines = []
+    for metric in REGISTRY:
+        if combined is None or metric.aggregate == "local":
+            lines.extend(metric.render())
+        else:
+            lines.extend(metric.render(combined.get(metric.name, {})))
+    return '\n'.join(lines) + '\n'
+
+
+# --- Plusieurs processus (workers gunicorn) ----------------------------------
+
+MULTIPROCESS_DIR = os.environ.get('METRICS_DIR')
+FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+_flush_thread = None
+
+
+def _snapshot_path(pid):
+    return os.path.join(MULTIPROCESS_DIR, f"metrics_{pid}.json")
+
+
+def _archive_path():
+    return os.path.join(MULTIPROCESS_DIR, "archive.json")
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def _state():
+    """Valeurs du processus à mettre en commun, {nom: {"type", "values": [[labels, valeur]]}}"""
+    return {metric.name: {"type": metric.type, "values": [[list(key), value] for key, value in metric.values().items()]}
+            for metric in REGISTRY if metric.aggregate != "local"}
+
+
+def _add(total, value):
+    if isinstance(value, list):  # histogramme : [compteurs des seaux, somme, nombre]
+        return [[a + b for a, b in zip(total[0], value[0])], total[1] + value[1], total[2] + value[2]]
+    return total + value
+
+
+def _merge(target, state, gauges=True):
+    for name, metric in state.items():
+        if not gauges and metric["type"] == "gauge":
+            continue
+        values = target.setdefault(name, {})
+        for key, value in metric["values"]:
+            key = tuple(key)
+            values[key] = _add(values[key], value) if key in values else value
+    return target
+
+
+def _combined():
+    """Valeurs additionnées de tous les workers (le processus courant avec ses valeurs à jour)"""
+    archive = _read_json(_archive_path()) or {"pids": [], "metrics": {}}
+    combined = _merge({}, archive["metrics"])
+    merged_pids = set(archive["pids"])
+    _merge(combined, _state())
+    for path in glob.glob(os.path.join(MULTIPROCESS_DIR, "metrics_*.json")):
+        snapshot = _read_json(path)
+        if snapshot is None or snapshot["pid"] == os.getpid() or snapshot["pid"] in merged_pids:
+            continue
+        _merge(combined, snapshot["metrics"])
+    return combined
+
+
+def write_snapshot():
+    """Écrit les valeurs du processus dans METRICS_DIR"""
+    if MULTIPROCESS_DIR:
+        _write_json(_snapshot_path(os.getpid()), {"pid": os.getpid(), "metrics": _state()})
+
+
+def start_multiprocess():
+    """Écrit les valeurs du processus dans METRICS_DIR toutes les FLUSH_INTERVAL secondes (dans chaque worker)"""
+    global _flush_thread
+    if not MULTIPROCESS_DIR or _flush_thread is not None:
+        return
+
+    def flush():
+        while True:
+            try:
+                write_snapshot()
+            except OSError:
+                pass
+            time.sleep(FLUSH_INTERVAL)
+
+    _flush_thread = threading.Thread(target=flush, name="metrics-flush", daemon=True)
+    _flush_thread.start()
+
+
+def mark_process_dead(pid):
+    """
+    Appelée par le maître gunicorn quand un worker s'arrête : ses compteurs et
+    histogrammes passent dans l'archive, ses jauges disparaissent.
+    """
+    if not MULTIPROCESS_DIR:
+        return
+    snapshot = _read_json(_snapshot_path(pid))
+    if snapshot is not None:
+        archive = _read_json(_archive_path()) or {"pids": [], "metrics": {}}
+        types = {name: metric["type"] for state in (archive["metrics"], snapshot["metrics"])
+                 for name, metric in state.items()}
+        metrics = _merge(_merge({}, archive["metrics"]), snapshot["metrics"], gauges=False)
+        archive = {
+            # Le fichier du worker est ignoré dès que l'archive le contient
+            "pids": (archive["pids"] + [pid])[-1000:],
+            "metrics": {name: {"type": types[name], "values": [[list(key), value] for key, value in values.items()]}
+                        for name, values in metrics.items()},
+        }
+        _write_json(_archive_path(), archive)
+    try:
+        os.remove(_snapshot_path(pid))
+    except OSError:
+        pass
+
+
+def clear_multiprocess_dir():
+    """Efface les valeurs d'une exécution précédente (au démarrage du maître gunicorn)"""
+    if not MULTIPROCESS_DIR:
+        return
+    os.makedirs(MULTIPROCESS_DIR, exist_ok=True)
+    for path in glob.glob(os.path.join(MULTIPROCESS_DIR, "*.json")):
+        os.remove(path)
+
+
+# --- Exports -----------------------------------------------------------------
+
+EXPORT_DURATION = Histogram('export_duration_seconds',
+                            "Durée des exports, par format (xlsx, csv, ndjson, parquet) et type de tournée",
+                            ['format', 'type'], buckets=EXPORT_BUCKETS)
+EXPORTS = Counter('exports_total', "Exports terminés, par format, type et résultat (success, failure, error)",
+                  ['format', 'type', 'status'])
+EXPORT_STAGE_DURATION = Histogram('export_stage_duration_seconds',
+                                  "Durée de chaque étape des exports (timings.py), par format", ['format', 'stage'])
+EXPORTS_IN_FLIGHT = Gauge('exports_in_flight', "Exports en cours")
+EXPORTS_COALESCED = Counter('exports_coalesced_total',
+                            "Demandes d'export servies par l'export déjà en cours pour la même tournée")
+EXPORTS_REJECTED = Counter('exports_rejected_total', "Demandes d'export refusées (503), faute de place")
+EXPORTS_FROM_STORE = Counter('exports_from_store_total', "Demandes d'export servies par un classeur pré-généré")
+PRERENDERS = Counter('prerenders_total', "Classeurs pré-générés en arrière-plan, par résultat", ['status'])
+
+
+def observe_export(timings, status, format="xlsx"):
+    """Enregistre un export terminé à partir de ses ExportTimings (format xlsx, ou celui de la lecture en flux)"""
+    type_collecte = timings.type_collecte or "inconnu"
+    EXPORT_DURATION.observe(timings.total, format=format, type=type_collecte)
+    EXPORTS.inc(format=format, type=type_collecte, status=status)
+    for span in timings.spans:
+        EXPORT_STAGE_DURATION.observe(span.seconds, format=format, stage=span.name)
+        if span.name == "connexion":
+            TOKEN_DURATION.observe(span.seconds)
+
+
+# --- Dataverse ---------------------------------------------------------------
+
+DATAVERSE_REQUESTS = Counter('dataverse_requests_total', "Requêtes à l'API Web de Dataverse",
+                             ['table', 'method', 'status'])
+DATAVERSE_REQUEST_DURATION = Histogram('dataverse_request_duration_seconds',
+                                       "Durée des requêtes à Dataverse (jusqu'aux en-têtes de la réponse)",
+                                       ['table', 'method'])
+DATAVERSE_THROTTLED = Counter('dataverse_throttled_total',
+                              "Réponses 429/503 de Dataverse (chacune est suivie d'un nouvel essai)",
+                              ['table', 'status'])
+TOKEN_DURATION = Histogram('dataverse_token_duration_seconds', "Durée d'obtention du jeton et de la session")
+CACHE_REQUESTS = Counter('cache_requests_total', "Consultations des caches, par cache et résultat (hit, miss)",
+                         ['cache', 'result'])
+
+
+def table_of(url):
+    """Table visée par une URL de l'API Web (ex: new_bacs, EntityDefinitions, $batch)"""
+    path = urlsplit(url).path
+    marker = '/api/data/'
+    if marker not in path:
+        return "autre"
+    segments = path.split(marker, 1)[1].split('/')
+    if len(segments) < 2 or not segments[1]:
+        return "autre"
+    return segments[1].split('(', 1)[0]
+
+
+def _dataverse_hook(response, *args, **kwargs):
+    table = table_of(response.request.url)
+    method = response.request.method
+    DATAVERSE_REQUESTS.inc(table=table, method=method, status=response.status_code)
+    DATAVERSE_REQUEST_DURATION.observe(response.elapsed.total_seconds(), table=table, method=method)
+    if response.status_code in THROTTLED_STATUS_CODES:
+        DATAVERSE_THROTTLED.inc(table=table, status=response.status_code)
+    return response
+
+
+def observe_session(session):
+    """Compte les requêtes de la session (une seule fois par session)"""
+    if _dataverse_hook not in session.hooks['response']:
+        session.hooks['response'].append(_dataverse_hook)
+
+
+def cache_lookup(cache, hit, count=1):
+    if count:
+        CACHE_REQUESTS.inc(count, cache=cache, result="hit" if hit else "miss")
+
+
+# --- Fichiers temporaires -----------------------------------------------------
+
+def directory_usage(directory, prefix=""):
+    """Nombre et taille totale (octets) des fichiers du dossier commençant par prefix"""
+    files = 0
+    size = 0
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(prefix) and entry.is_file(follow_symlinks=False):
+                    files += 1
+                    size += entry.stat(follow_symlinks=False).st_size
+    except OSError:
+        pass
+    return files, size
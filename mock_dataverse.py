@@ -0,0 +1,899 @@
+import argparse
+import gzip
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+# Serveur local imitant l'API Web de Dataverse, pour tester et mesurer l'export et
+# les scripts pcd_* sans tenant ni connexion interactive.
+#
+#   python mock_dataverse.py --port 8080 --tournees 20 --bacs 100 --env-file PyConnectDataverse/mock-env.json
+#
+# Le fichier d'environnement écrit (--env-file) contient "mock": true :
+# getAuthenticatedSession crée alors une session sans jeton. Il s'utilise avec
+# NewDataverseConnector(path_to_env=...) ou les scripts pcd (--env).
+#
+# Points d'accès pris en charge :
+#   - EntityDefinitions (liste, $filter, $select, (LogicalName='...'), /Attributes)
+#   - GET sur un ensemble d'entités avec $filter (eq, ne, lt, le, gt, ge, and, or,
+#     not, parenthèses), $select, $expand des recherches, $orderby, $top et la
+#     pagination (Prefer: odata.maxpagesize, @odata.nextLink)
+#   - POST, PATCH (upsert, If-Match), DELETE, clés alternatives
+#   - $batch (avec changesets, odata.continue-on-error)
+#   - $ref (associations N:N) et lecture des enregistrements associés
+#   - CreateMultiple, UpdateMultiple, UpsertMultiple, sdkmessagefilters
+#   - GlobalOptionSetDefinitions(Name='...') et InsertOptionValue
+#
+# La latence, la taille des pages et l'injection de réponses 429 sont réglables.
+# Les données synthétiques (tournées, agents, bacs, adresses, vidages) sont
+# générées à partir d'une graine : deux serveurs lancés avec les mêmes paramètres
+# contiennent les mêmes enregistrements.
+
+API_PATH = '/api/data/v9.2/'
+
+_GUID_RE = re.compile(r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$')
+_TOKEN_RE = re.compile(r"\s*('(?:[^']|'')*'|\(|\)|,|[^\s(),]+)")
+_NUMBER_RE = re.compile(r'^-?\d+(\.\d+)?$')
+_BOUNDARY_RE = re.compile(r'boundary=("?)([^";\r\n]+)\1')
+
+
+class ODataError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _sort_key(value):
+    """Clé de comparaison d'une valeur. Les GUID sont comparés comme dans SQL Server
+    (le dernier groupe d'abord)."""
+    if isinstance(value, str) and _GUID_RE.match(value):
+        parts = value.lower().split('-')
+        return parts[4] + parts[3] + parts[2] + parts[1] + parts[0]
+    return value
+
+
+# --- $filter ---------------------------------------------------------------
+
+def _tokens(text):
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = _TOKEN_RE.match(text, position)
+        if not match:
+            raise ODataError(400, f"Invalid $filter: {text}")
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+
+def _literal(token):
+    if token.startswith("'"):
+        return token[1:-1].replace("''", "'")
+    if token == 'null':
+        return None
+    if token in ('true', 'false'):
+        return token == 'true'
+    if _NUMBER_RE.match(token):
+        return float(token) if '.' in token else int(token)
+    return token  # GUID, date
+
+
+_OPERATORS = {
+    'eq': lambda a, b: a == b,
+    'ne': lambda a, b: a != b,
+    'lt': lambda a, b: a is not None and b is not None and a < b,
+    'le': lambda a, b: a is not None and b is not None and a <= b,
+    'gt': lambda a, b: a is not None and b is not None and a > b,
+    'ge': lambda a, b: a is not None and b is not None and a >= b,
+}
+
+
+def parse_filter(text):
+    """Transforme un $filter en fonction record -> bool."""
+    tokens = _tokens(text)
+    position = [0]
+
+    def peek():
+        return tokens[position[0]] if position[0] < len(tokens) else None
+
+    def take():
+        token = peek()
+        position[0] += 1
+        return token
+
+    def expression():
+        left = conjunction()
+        while peek() == 'or':
+            take()
+            right = conjunction()
+            left = (lambda l, r: lambda record: l(record) or r(record))(left, right)
+        return left
+
+    def conjunction():
+        left = unary()
+        while peek() == 'and':
+            take()
+            right = unary()
+            left = (lambda l, r: lambda record: l(record) and r(record))(left, right)
+        return left
+
+    def unary():
+        token = take()
+        if token == 'not':
+            operand = unary()
+            return lambda record: not operand(record)
+        if token == '(':
+            inner = expression()
+            if take() != ')':
+                raise ODataError(400, f"Invalid $filter: {text}")
+            return inner
+
+        field, operator, value = token, take(), take()
+        if operator not in _OPERATORS or value is None:
+            raise ODataError(400, f"The mock does not support this $filter: {text}")
+        compare = _OPERATORS[operator]
+        value = _sort_key(_literal(value))
+        return lambda record: compare(_sort_key(record.get(field)), value)
+
+    predicate = expression()
+    if peek() is not None:
+        raise ODataError(400, f"Invalid $filter: {text}")
+    return predicate
+
+
+def _key_lookup(text, primary_key):
+    """Identifiants d'un filtre "pk eq 'a' or pk eq 'b'...", ou None pour un autre filtre."""
+    tokens = _tokens(text)
+    if len(tokens) % 4 != 3:
+        return None
+    keys = []
+    for index in range(0, len(tokens), 4):
+        if tokens[index] != primary_key or tokens[index + 1] != 'eq' or (index and tokens[index - 1] != 'or'):
+            return None
+        keys.append(str(_literal(tokens[index + 2])).lower())
+    return list(dict.fromkeys(keys))
+
+
+def _split_top_level(text, separator=','):
+    """Découpe sur le séparateur en dehors des parenthèses."""
+    parts = []
+    depth = 0
+    current = ''
+    for char in text:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if char == separator and depth == 0:
+            parts.append(current)
+            current = ''
+        else:
+            current += char
+    if current:
+        parts.append(current)
+    return [part.strip() for part in parts]
+
+
+def _parse_key(text):
+    """'guid' -> guid, "a='x',b=2" -> {'a': 'x', 'b': 2}"""
+    text = unquote(text)
+    parts = _split_top_level(text)
+    if len(parts) == 1 and '=' not in re.sub(r"'(?:[^']|'')*'", '', parts[0]):
+        return _literal(parts[0])
+    key = {}
+    for part in parts:
+        name, _, value = part.partition('=')
+        key[name.strip()] = _literal(value.strip())
+    return key
+
+
+# --- Données -----------------------------------------------------------------
+
+class Table:
+    """Une table : métadonnées et enregistrements indexés par clé primaire."""
+
+    def __init__(self, logical_name, entity_set_name=None, primary_key=None, lookups=None):
+        self.logical_name = logical_name
+        self.entity_set_name = entity_set_name or logical_name
+        self.primary_key = primary_key or f'{logical_name}id'
+        self.lookups = dict(lookups or {})  # propriété de navigation -> ensemble d'entités cible
+        self.records = {}
+
+    def definition(self):
+        return {
+            'LogicalName': self.logical_name,
+            'EntitySetName': self.entity_set_name,
+            'PrimaryIdAttribute': self.primary_key,
+            'MetadataId': str(uuid.uuid5(uuid.NAMESPACE_URL, self.logical_name)),
+        }
+
+    def attributes(self):
+        types = {bool: 'Boolean', int: 'Integer', float: 'Double', str: 'String'}
+        attributes = {self.primary_key: 'Uniqueidentifier'}
+        for record in self.records.values():
+            for name, value in record.items():
+                if name.startswith('@') or name in attributes or value is None:
+                    continue
+                if name.startswith('_') and name.endswith('_value'):
+                    attributes[name[1:-6]] = 'Lookup'
+                else:
+                    attributes[name] = types.get(type(value), 'String')
+            if len(attributes) > 1:
+                break
+        return [{'LogicalName': name, 'AttributeType': attribute_type}
+                for name, attribute_type in attributes.items()]
+
+
+class MockDataverse:
+    """
+    Données et traitement des requêtes du serveur.
+
+    Args:
+        page_size (int): Taille maximale des pages si la requête n'en demande pas
+        latency (float): Délai ajouté à chaque requête HTTP, en secondes
+        batch_part_latency (float): Délai ajouté par requête d'un $batch
+        throttle_rate (float): Proportion des requêtes refusées avec un 429
+        retry_after (int): Valeur de l'en-tête Retry-After des 429
+        seed (int): Graine des données et de l'injection des 429
+    """
+
+    def __init__(self, page_size=5000, latency=0.0, batch_part_latency=0.0, throttle_rate=0.0, retry_after=1,
+                 seed=0):
+        self.page_size = page_size
+        self.latency = latency
+        self.batch_part_latency = batch_part_latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.tables = {}
+        self.relationships = {}  # nom -> (ensemble A, ensemble B, set de paires)
+        self.option_sets = {}
+        self.lock = threading.RLock()
+        self.requests = 0
+        self.throttled = 0
+        self._throttle_random = random.Random(seed)
+        self._version = 0
+
+    # -- Tables
+
+    def add_table(self, logical_name, entity_set_name=None, primary_key=None, lookups=None):
+        table = Table(logical_name, entity_set_name, primary_key, lookups)
+        self.tables[table.entity_set_name] = table
+        return table
+
+    def table(self, entity_set_name):
+        table = self.tables.get(entity_set_name)
+        if table is None:
+            # Tables standard (contacts, accounts...) créées à la demande
+            logical_name = entity_set_name[:-1] if entity_set_name.endswith('s') else entity_set_name
+            table = self.add_table(logical_name, entity_set_name)
+        return table
+
+    def _table_by_logical_name(self, logical_name):
+        for table in self.tables.values():
+            if table.logical_name == logical_name:
+                return table
+        raise ODataError(404, f"Could not find a table with the logical name {logical_name}")
+
+    def insert(self, entity_set_name, record, record_id=None, created_on=None):
+        """Ajoute un enregistrement (données de départ ou POST) et renvoie son id."""
+        table = self.table(entity_set_name)
+        record = self._bind(table, dict(record))
+        record_id = str(record_id or record.get(table.primary_key) or uuid.uuid4())
+        now = created_on or datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        record[table.primary_key] = record_id
+        record.setdefault('createdon', now)
+        record['modifiedon'] = now
+        self._version += 1
+        record['@odata.etag'] = f'W/"{self._version}"'
+        table.records[record_id] = record
+        return record_id
+
+    def _bind(self, table, record):
+        """Transforme les 'nav@odata.bind' en colonnes _nav_value"""
+        for name in [name for name in record if name.endswith('@odata.bind')]:
+            value = record.pop(name)
+            navigation = name[:-len('@odata.bind')]
+            match = re.search(r'([\w]+)\(([^)]+)\)\s*$', value or '')
+            if match:
+                table.lookups.setdefault(navigation, match.group(1))
+                record[f'_{navigation}_value'] = str(_parse_key(match.group(2)))
+            else:
+                record[f'_{navigation}_value'] = None
+        return record
+
+    def _find(self, table, key):
+        if isinstance(key, dict):
+            for record in table.records.values():
+                if all(record.get(name) == value for name, value in key.items()):
+                    return record
+            return None
+        return table.records.get(str(key).lower()) or table.records.get(str(key))
+
+    # -- Requêtes
+
+    def throttle(self):
+        """True si la requête doit être refusée avec un 429."""
+        with self.lock:
+            self.requests += 1
+            if self.throttle_rate and self._throttle_random.random() < self.throttle_rate:
+                self.throttled += 1
+                return True
+        return False
+
+    def handle(self, method, target, headers, body, base_url):
+        """Traite une requête (HTTP ou partie de $batch) et renvoie (status, en-têtes, corps)."""
+        try:
+            with self.lock:
+                return self._dispatch(method, target, headers, body, base_url)
+        except ODataError as e:
+            return self._error(e.status, str(e))
+        except (ValueError, KeyError, json.JSONDecodeError) as e:
+            return self._error(400, f"{type(e).__name__}: {e}")
+
+    def _error(self, status, message):
+        return status, {'Content-Type': 'application/json'}, {'error': {'code': '0x80040000', 'message': message}}
+
+    def _dispatch(self, method, target, headers, body, base_url):
+        split = urlsplit(target)
+        path = split.path
+        if path.startswith(API_PATH):
+            path = path[len(API_PATH):]
+        query = dict(parse_qsl(split.query, keep_blank_values=True))
+        payload = json.loads(body) if body else None
+
+        segments = [segment for segment in re.split(r'/(?![^(]*\))', path) if segment]
+        if not segments:
+            raise ODataError(404, f"Resource not found: {target}")
+        match = re.match(r'^([\w.$]+)(?:\((.*)\))?$', segments[0])
+        if not match:
+            raise ODataError(404, f"Resource not found: {target}")
+        name, key = match.group(1), match.group(2)
+        key = _parse_key(key) if key is not None else None
+        rest = segments[1:]
+
+        if name == 'EntityDefinitions':
+            return self._entity_definitions(key, rest, query, base_url)
+        if name == 'GlobalOptionSetDefinitions':
+            return self._option_set(key)
+        if name == 'InsertOptionValue' and method == 'POST':
+            return self._insert_option_value(payload)
+        if name == 'sdkmessagefilters':
+            return 200, {}, {'value': [{'sdkmessagefilterid': str(uuid.uuid4())}]}
+
+        table = self.table(name)
+        if rest and rest[0].startswith('Microsoft.Dynamics.CRM.'):
+            return self._bulk_message(table, rest[0][len('Microsoft.Dynamics.CRM.'):], payload)
+        if key is None:
+            if method == 'GET':
+                return self._query(table, list(table.records.values()), query, headers, base_url, target)
+            if method == 'POST':
+                record_id = self.insert(table.entity_set_name, payload)
+                return 204, {'OData-EntityId': f"{base_url}{API_PATH}{table.entity_set_name}({record_id})"}, None
+            raise ODataError(405, f"{method} is not supported on {name}")
+
+        if rest:
+            return self._relationship(method, table, key, rest, query, headers, payload, base_url, target)
+
+        record = self._find(table, key)
+        if method == 'GET':
+            if record is None:
+                raise ODataError(404, f"{table.logical_name} With Id = {key} Does Not Exist")
+            return 200, {}, self._project(table, record, query)
+        if method == 'PATCH':
+            return self._patch(table, key, record, headers, payload, base_url)
+        if method == 'DELETE':
+            if record is None:
+                raise ODataError(404, f"{table.logical_name} With Id = {key} Does Not Exist")
+            del table.records[record[table.primary_key]]
+            return 204, {}, None
+        raise ODataError(405, f"{method} is not supported on {name}({key})")
+
+    def _patch(self, table, key, record, headers, payload, base_url):
+        if record is None:
+            if headers.get('If-Match') == '*':
+                raise ODataError(404, f"{table.logical_name} With Id = {key} Does Not Exist")
+            values = dict(payload)
+            if isinstance(key, dict):
+                values.update(key)
+                record_id = self.insert(table.entity_set_name, values)
+            else:
+                record_id = self.insert(table.entity_set_name, values, record_id=key)
+        else:
+            if headers.get('If-None-Match') == '*':
+                raise ODataError(412, "A record with matching key values already exists.")
+            updated = dict(record)
+            updated.update(self._bind(table, dict(payload)))
+            self._version += 1
+            updated['modifiedon'] = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+            updated['@odata.etag'] = f'W/"{self._version}"'
+            record_id = updated[table.primary_key]
+            table.records[record_id] = updated
+        return 204, {'OData-EntityId': f"{base_url}{API_PATH}{table.entity_set_name}({record_id})"}, None
+
+    def _relationship(self, method, table, key, rest, query, headers, payload, base_url, target):
+        relationship = rest[0]
+        record = self._find(table, key)
+        if record is None:
+            raise ODataError(404, f"{table.logical_name} With Id = {key} Does Not Exist")
+        record_id = record[table.primary_key]
+
+        if len(rest) == 2 and rest[1] == '$ref' and method == 'POST':
+            match = re.search(r'/([\w]+)\(([^)]+)\)\s*$', payload.get('@odata.id', ''))
+            if not match:
+                raise ODataError(400, "Invalid @odata.id")
+            other_table = self.table(match.group(1))
+            other = self._find(other_table, _parse_key(match.group(2)))
+            if other is None:
+                raise ODataError(404, f"{other_table.logical_name} With Id = {match.group(2)} Does Not Exist")
+            first, second, pairs = self.relationships.setdefault(
+                relationship, (table.entity_set_name, other_table.entity_set_name, set()))
+            pair = (record_id, other[other_table.primary_key])
+            if table.entity_set_name != first:
+                pair = pair[::-1]
+            if pair in pairs:
+                raise ODataError(400, "Cannot insert duplicate key.")
+            pairs.add(pair)
+            return 204, {}, None
+
+        if len(rest) == 1 and method == 'GET':
+            if relationship not in self.relationships:
+                return 200, {}, {'value': []}
+            first, second, pairs = self.relationships[relationship]
+            if table.entity_set_name == first:
+                other_table, ids = self.tables[second], [b for a, b in pairs if a == record_id]
+            else:
+                other_table, ids = self.tables[first], [a for a, b in pairs if b == record_id]
+            records = [other_table.records[other_id] for other_id in ids if other_id in other_table.records]
+            return self._query(other_table, records, query, headers, base_url, target)
+
+        raise ODataError(404, f"Resource not found: {target}")
+
+    def _bulk_message(self, table, message, payload):
+        targets = payload.get('Targets', [])
+        ids = []
+        for target in targets:
+            values = {name: value for name, value in target.items() if name not in ('@odata.type', '@odata.id')}
+            record_id = values.get(table.primary_key)
+            if message == 'CreateMultiple':
+                ids.append(self.insert(table.entity_set_name, values))
+            elif message in ('UpdateMultiple', 'UpsertMultiple'):
+                key = record_id
+                if key is None and '@odata.id' in target:
+                    key = _parse_key(re.search(r'\((.*)\)\s*$', target['@odata.id']).group(1))
+                record = self._find(table, key) if key is not None else None
+                if record is None and message == 'UpdateMultiple':
+                    raise ODataError(404, f"{table.logical_name} With Id = {key} Does Not Exist")
+                self._patch(table, key, record, {}, values, '')
+            else:
+                raise ODataError(404, f"Unknown message {message}")
+        if message == 'CreateMultiple':
+            return 200, {}, {'Ids': ids}
+        return 204, {}, None
+
+    def _entity_definitions(self, key, rest, query, base_url):
+        if key is not None:
+            logical_name = key.get('LogicalName') if isinstance(key, dict) else None
+            table = self._table_by_logical_name(logical_name)
+            if rest == ['Attributes']:
+                return 200, {}, {'value': self._select(table.attributes(), query)}
+            return 200, {}, self._select([table.definition()], query)[0]
+
+        if '$filter' in query:
+            # Les tables standard interrogées par leur nom d'ensemble sont créées à la demande
+            for entity_set_name in re.findall(r"EntitySetName eq '(\w+)'", query['$filter']):
+                self.table(entity_set_name)
+        definitions = [table.definition() for table in self.tables.values()]
+        if '$filter' in query:
+            predicate = parse_filter(query['$filter'])
+            definitions = [definition for definition in definitions if predicate(definition)]
+        return 200, {}, {'value': self._select(definitions, query)}
+
+    def _select(self, items, query):
+        if '$select' not in query:
+            return items
+        names = [name.strip() for name in query['$select'].split(',')]
+        return [{name: item.get(name) for name in names} for item in items]
+
+    def _project(self, table, record, query):
+        if '$select' in query:
+            names = ['@odata.etag'] + [name.strip() for name in query['$select'].split(',')] + [table.primary_key]
+            projected = {name: record.get(name) for name in names}
+        else:
+            projected = dict(record)
+
+        for expand in _split_top_level(query.get('$expand', '')):
+            match = re.match(r'^(\w+)(?:\((.*)\))?$', expand)
+            if not match:
+                raise ODataError(400, f"Invalid $expand: {expand}")
+            navigation, options = match.group(1), match.group(2)
+            target_set = table.lookups.get(navigation)
+            if target_set is None:
+                raise ODataError(400, f"Could not find a property named '{navigation}' on {table.logical_name}")
+            target_table = self.table(target_set)
+            target = target_table.records.get(record.get(f'_{navigation}_value'))
+            nested_query = dict(part.split('=', 1) for part in _split_top_level(options or '', ';') if '=' in part)
+            projected[navigation] = self._project(target_table, target, nested_query) if target else None
+        return projected
+
+    def _query(self, table, records, query, headers, base_url, target):
+        if '$filter' in query:
+            by_key = _key_lookup(query['$filter'], table.primary_key)
+            if by_key is not None and records is not None and len(records) == len(table.records):
+                # "id eq ... or id eq ..." sur la clé primaire : lecture directe
+                records = [table.records[key] for key in by_key if key in table.records]
+            else:
+                predicate = parse_filter(query['$filter'])
+                records = [record for record in records if predicate(record)]
+        if '$orderby' in query:
+            for clause in reversed(_split_top_level(query['$orderby'])):
+                name, _, direction = clause.partition(' ')
+                present = [record for record in records if record.get(name) is not None]
+                missing = [record for record in records if record.get(name) is None]
+                present.sort(key=lambda record: _sort_key(record[name]), reverse=direction.strip() == 'desc')
+                records = missing + present if direction.strip() != 'desc' else present + missing
+        if '$top' in query:
+            records = records[:int(query['$top'])]
+
+        page_size = self.page_size
+        preference = re.search(r'odata\.maxpagesize=(\d+)', headers.get('Prefer', ''))
+        if preference:
+            page_size = min(int(preference.group(1)), page_size)
+        offset = int(query.get('$skiptoken', 0))
+        page = records[offset:offset + page_size]
+
+        response = {
+            '@odata.context': f"{base_url}{API_PATH}$metadata#{table.entity_set_name}",
+            'value': [self._project(table, record, query) for record in page],
+        }
+        response_headers = {}
+        if preference:
+            response_headers['Preference-Applied'] = f'odata.maxpagesize={page_size}'
+        if offset + page_size < len(records):
+            split = urlsplit(target)
+            options = [f"{name}={value}" for name, value in parse_qsl(split.query, keep_blank_values=True)
+                       if name != '$skiptoken']
+            options.append(f"$skiptoken={offset + page_size}")
+            response['@odata.nextLink'] = f"{base_url}{split.path}?" + '&'.join(options)
+        return 200, response_headers, response
+
+    def _option_set(self, key):
+        name = key.get('Name') if isinstance(key, dict) else key
+        options = self.option_sets.get(name)
+        if options is None:
+            raise ODataError(404, f"Could not find optionset {name}")
+        return 200, {}, {
+            'Name': name,
+            'Options': [{'Value': value, 'Color': color,
+                         'Label': {'LocalizedLabels': [{'Label': label, 'LanguageCode': language}]}}
+                        for value, (label, color, language) in sorted(options.items())]
+        }
+
+    def _insert_option_value(self, payload):
+        name = payload['OptionSetName']
+        options = self.option_sets.setdefault(name, {})
+        value = payload.get('Value')
+        if value in options:
+            raise ODataError(400, f"An option with the value {value} already exists in {name}")
+        label = payload['Label']['LocalizedLabels'][0]
+        options[value] = (label['Label'], payload.get('Color'), label['LanguageCode'])
+        return 200, {}, {'NewOptionValue': value}
+
+    # -- $batch
+
+    def batch(self, headers, body, base_url):
+        match = _BOUNDARY_RE.search(headers.get('Content-Type', ''))
+        if not match:
+            return self._error(400, "Missing multipart boundary")
+        continue_on_error = 'odata.continue-on-error' in headers.get('Prefer', '')
+        response_boundary = f"batchresponse_{uuid.uuid4()}"
+        output = []
+        stopped = False
+
+        for part_headers, content in _multipart(body, match.group(2)):
+            nested = _BOUNDARY_RE.search(part_headers.get('Content-Type', ''))
+            if nested and 'multipart/mixed' in part_headers.get('Content-Type', ''):
+                if stopped:
+                    continue
+                responses, failed = self._changeset(content, nested.group(2), base_url)
+                changeset_boundary = f"changesetresponse_{uuid.uuid4()}"
+                output.append(f"--{response_boundary}\r\n"
+                              f"Content-Type: multipart/mixed; boundary={changeset_boundary}\r\n\r\n".encode())
+                for response in responses:
+                    output.append(f"--{changeset_boundary}\r\n".encode() + response)
+                output.append(f"--{changeset_boundary}--\r\n".encode())
+                stopped = failed and not continue_on_error
+                continue
+
+            if stopped:
+                continue
+            status, response = self._batch_part(content, base_url)
+            output.append(f"--{response_boundary}\r\n".encode() + response)
+            if status >= 400 and not continue_on_error:
+                stopped = True
+
+        output.append(f"--{response_boundary}--\r\n".encode())
+        return 200, {'Content-Type': f'multipart/mixed; boundary={response_boundary}'}, b''.join(output)
+
+    def _changeset(self, body, boundary, base_url):
+        with self.lock:
+            snapshot = ({name: dict(table.records) for name, table in self.tables.items()},
+                        {name: (a, b, set(pairs)) for name, (a, b, pairs) in self.relationships.items()},
+                        {name: dict(options) for name, options in self.option_sets.items()})
+            responses = []
+            for part_headers, content in _multipart(body, boundary):
+                status, response = self._batch_part(content, base_url, part_headers.get('Content-ID'))
+                if status >= 400:
+                    records, self.relationships, self.option_sets = snapshot
+                    for name, table in self.tables.items():
+                        table.records = records.get(name, {})
+                    return [response], True
+                responses.append(response)
+            return responses, False
+
+    def _batch_part(self, content, base_url, content_id=None):
+        head, _, body = content.partition(b'\r\n\r\n')
+        lines = head.decode('utf-8').split('\r\n')
+        method, _, target = lines[0].partition(' ')
+        target = target.rsplit(' HTTP/', 1)[0]
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip()] = value.strip()
+
+        if self.batch_part_latency:
+            time.sleep(self.batch_part_latency)
+        status, response_headers, payload = self.handle(method, target, headers, body.strip(), base_url)
+
+        lines = ['Content-Type: application/http', 'Content-Transfer-Encoding: binary']
+        if content_id:
+            lines.append(f'Content-ID: {content_id}')
+        lines.append('')
+        lines.append(f'HTTP/1.1 {status} {_REASONS.get(status, "")}')
+        for name, value in response_headers.items():
+            lines.append(f'{name}: {value}')
+        data = b''
+        if payload is not None:
+            lines.append('Content-Type: application/json; odata.metadata=minimal')
+            data = json.dumps(payload).encode('utf-8')
+        lines.append('')
+        lines.append('')
+        return status, '\r\n'.join(lines).encode() + data + b'\r\n'
+
+
+def _multipart(body, boundary):
+    """Yields (en-têtes, contenu) des parties d'un corps multipart."""
+    delimiter = f'--{boundary}'.encode()
+    for chunk in body.split(delimiter)[1:]:
+        if chunk.startswith(b'--'):
+            break
+        head, _, content = chunk.lstrip(b'\r\n').partition(b'\r\n\r\n')
+        headers = {}
+        for line in head.decode('utf-8').split('\r\n'):
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip()] = value.strip()
+        yield headers, content
+
+
+_REASONS = {200: 'OK', 201: 'Created', 204: 'No Content', 400: 'Bad Request', 404: 'Not Found',
+            405: 'Method Not Allowed', 412: 'Precondition Failed', 429: 'Too Many Requests'}
+
+
+# --- Données synthétiques ----------------------------------------------------
+
+NOMS = ['Martin', 'Bernard', 'Dubois', 'Thomas', 'Robert', 'Richard', 'Petit', 'Durand', 'Leroy', 'Moreau']
+PRENOMS = ['Marie', 'Jean', 'Pierre', 'Sophie', 'Luc', 'Camille', 'Nicolas', 'Julie', 'Paul', 'Léa']
+COMMUNES = ['Versailles', 'Le Chesnay', 'Viroflay', 'Buc', 'Jouy-en-Josas', 'Bougival']
+RUES = ['rue de la Paroisse', 'avenue de Paris', 'boulevard de la Reine', 'rue des Chantiers', 'rue Royale']
+ACTIONS_EP = ['Collecté', 'Refusé', 'Non présenté', 'Erreur de tri']
+
+
+def create_schema(mock):
+    """Déclare les tables utilisées par l'export."""
+    mock.add_table('crcfe_tournees')
+    mock.add_table('crcfe_agentstournees', lookups={'crcfe_idtournees': 'crcfe_tournees', 'crcfe_id_agent': 'new_agents'})
+    mock.add_table('new_agents')
+    mock.add_table('crcfe_listeadressesbacs')
+    mock.add_table('new_bacs', lookups={'crcfe_id_tournee': 'crcfe_tournees',
+                                        'crcfe_adressebac': 'crcfe_listeadressesbacs'})
+    mock.add_table('new_vidages', lookups={'crcfe_idtournees': 'crcfe_tournees'})
+
+
+class TourneeGenerator:
+    """Génère des tournées synthétiques reproductibles (graine)."""
+
+    def __init__(self, mock, seed=0, agents=20):
+        self.mock = mock
+        self.random = random.Random(seed)
+        self.count = 0
+        self.start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        if 'crcfe_tournees' not in mock.tables:
+            create_schema(mock)
+        self.agent_ids = [self.mock.insert('new_agents', {
+            'new_nom': self.random.choice(NOMS),
+            'new_prenom': self.random.choice(PRENOMS),
+        }, record_id=self._guid()) for _ in range(agents)]
+
+    def _guid(self):
+        return str(uuid.UUID(int=self.random.getrandbits(128), version=4))
+
+    def _date(self, moment):
+        return moment.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def add_tournee(self, type_collecte, bacs, vidages=2, id_tournee=None):
+        """Ajoute une tournée avec ses agents, bacs, adresses et vidages. Renvoie crcfe_idtournees."""
+        self.count += 1
+        id_tournee = str(id_tournee or self.count)
+        day = self.start + timedelta(days=self.count)
+        created_on = self._date(day)
+        tournee_id = self.mock.insert('crcfe_tournees', {
+            'crcfe_idtournees': id_tournee,
+            'crcfe_type_collecte': type_collecte,
+            'crcfe_date_suivi': self._date(day + timedelta(hours=4)),
+            'crcfe_heure_debut': self._date(day + timedelta(hours=4)),
+            'crcfe_heure_fin': self._date(day + timedelta(hours=11, minutes=self.random.randrange(60))),
+            'crcfe_nom_equipe': f"Équipe {self.random.randrange(1, 9)}",
+            'crcfe_immatriculation_benne': f"{self.random.choice('ABCDEFGH')}{self.random.choice('KLMNPQRS')}-"
+                                           f"{self.random.randrange(100, 999)}-VE",
+        }, record_id=self._guid(), created_on=created_on)
+
+        for agent_id in self.random.sample(self.agent_ids, 3):
+            self.mock.insert('crcfe_agentstournees', {
+                '_crcfe_idtournees_value': tournee_id,
+                '_crcfe_id_agent_value': agent_id,
+            }, record_id=self._guid(), created_on=created_on)
+
+        for _ in range(bacs):
+            adresse_id = self.mock.insert('crcfe_listeadressesbacs', {
+                'crcfe_commune': self.random.choice(COMMUNES),
+                'crcfe_numerorue': str(self.random.randrange(1, 200)),
+                'crcfe_bister': self.random.choice(['', '', '', 'bis', 'ter']),
+                'crcfe_nomrue': self.random.choice(RUES),
+                'crcfe_typehabitat': self.random.choice(['Pavillon', 'Collectif']),
+            }, record_id=self._guid(), created_on=created_on)
+            self.mock.insert('new_bacs', {
+                '_crcfe_id_tournee_value': tournee_id,
+                '_crcfe_adressebac_value': adresse_id,
+                'new_volume_bac': self.random.choice([120, 240, 340, 660]),
+                'new_taux_remplissage': self.random.randrange(0, 101, 25),
+                'new_commentaire': self.random.choice([None, None, 'Bac abîmé', 'Sortie tardive']),
+                'new_action_ep': self.random.choice(ACTIONS_EP) if type_collecte == 'EP' else None,
+            }, record_id=self._guid(), created_on=created_on)
+
+        for index in range(vidages):
+            self.mock.insert('new_vidages', {
+                '_crcfe_idtournees_value': tournee_id,
+                'new_heure_vidage': self._date(day + timedelta(hours=6 + 2 * index)),
+            }, record_id=self._guid(), created_on=created_on)
+
+        return id_tournee
+
+
+# --- Serveur HTTP ------------------------------------------------------------
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # En-têtes et corps partent en deux écritures : sans TCP_NODELAY, l'accusé de
+    # réception retardé du client ajoute ~40 ms à chaque réponse
+    disable_nagle_algorithm = True
+    mock = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status, headers, payload):
+        if isinstance(payload, (dict, list)):
+            data = json.dumps(payload).encode('utf-8')
+            headers = {'Content-Type': 'application/json; odata.metadata=minimal', **headers}
+        else:
+            data = payload or b''
+        if len(data) > 1024 and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            data = gzip.compress(data, compresslevel=5)
+            headers['Content-Encoding'] = 'gzip'
+
+        self.send_response(status)
+        headers['OData-Version'] = '4.0'
+        headers['x-ms-service-request-id'] = str(uuid.uuid4())
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+
+        mock = self.mock
+        if mock.latency:
+            time.sleep(mock.latency)
+        if mock.throttle():
+            self._respond(429, {'Retry-After': str(mock.retry_after)},
+                          {'error': {'code': '0x80072322', 'message': 'Number of requests exceeded the limit.'}})
+            return
+
+        base_url = f"http://{self.headers.get('Host')}"
+        headers = dict(self.headers.items())
+        if urlsplit(self.path).path == f'{API_PATH}$batch':
+            self._respond(*mock.batch(headers, body, base_url))
+        else:
+            self._respond(*mock.handle(self.command, self.path, headers, body, base_url))
+
+    do_GET = do_POST = do_PATCH = do_DELETE = do_PUT = _handle
+
+
+class MockDataverseServer:
+    """Serveur HTTP autour d'un MockDataverse, lancé dans un thread."""
+
+    def __init__(self, mock=None, host='127.0.0.1', port=0):
+        self.mock = mock or MockDataverse()
+        handler = type('Handler', (_Handler,), {'mock': self.mock})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def write_env(self, path):
+        """Écrit un fichier d'environnement pointant vers le serveur (sans authentification)."""
+        with open(path, 'w') as f:
+            json.dump({"environmentURI": self.url, "mock": True}, f, indent=4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serveur local imitant l'API Web de Dataverse.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--tournees", type=int, default=10, help="nombre de tournées générées (EP et OM en alternance)")
+    parser.add_argument("--bacs", type=int, default=100, help="bacs par tournée")
+    parser.add_argument("--seed", type=int, default=0, help="graine des données et des 429")
+    parser.add_argument("--page-size", type=int, default=5000, help="taille maximale des pages")
+    parser.add_argument("--latency", type=float, default=0.0, help="délai par requête HTTP, en secondes")
+    parser.add_argument("--batch-part-latency", type=float, default=0.0, help="délai par requête d'un $batch")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="proportion de réponses 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="en-tête Retry-After des 429")
+    parser.add_argument("--env-file", help="écrit un fichier d'environnement pointant vers le serveur")
+    args = parser.parse_args()
+
+    mock = MockDataverse(page_size=args.page_size, latency=args.latency, batch_part_latency=args.batch_part_latency,
+                         throttle_rate=args.throttle_rate, retry_after=args.retry_after, seed=args.seed)
+    generator = TourneeGenerator(mock, seed=args.seed)
+    for index in range(args.tournees):
+        generator.add_tournee("OM" if index % 2 == 0 else "EP", args.bacs)
+
+    server = MockDataverseServer(mock, args.host, args.port)
+    if args.env_file:
+        server.write_env(args.env_file)
+        print(f"Fichier d'environnement écrit: {args.env_file}")
+    print(f"Serveur Dataverse local sur {server.url} ({args.tournees} tournées de {args.bacs} bacs, "
+          f"identifiants 1 à {args.tournees})")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
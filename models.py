@@ -0,0 +1,167 @@
+from dataclasses import dataclass, fields
+import pandas as pd
+
+# Représentation typée et compacte des enregistrements utilisés par l'export d'une
+# tournée. Les objets sont construits directement à partir du JSON renvoyé par
+# Dataverse (NewDataverseConnector.get_records), sans passer par un DataFrame.
+# to_frame() reste disponible pour les traitements en masse.
+#
+# Les tables de référence, qui changent rarement, sont marquées `cached` : le
+# connecteur garde leurs enregistrements en cache (voir entity_cache.py).
+
+
+def _text(value):
+    """Valeur d'une colonne, ou "" si elle est vide"""
+    return "" if value is None or value != value else value
+
+
+@dataclass
+class Tournee:
+    __slots__ = ('id', 'id_tournee', 'type_collecte', 'date_suivi', 'heure_debut', 'heure_fin',
+                 'nom_equipe', 'immatriculation')
+    id: str
+    id_tournee: str
+    type_collecte: str
+    date_suivi: str
+    heure_debut: str
+    heure_fin: str
+    nom_equipe: str
+    immatriculation: str
+
+    table = 'crcfe_tournees'
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(
+            record.get('crcfe_tourneesid'),
+            record.get('crcfe_idtournees'),
+            record.get('crcfe_type_collecte', "OM"),
+            record.get('crcfe_date_suivi'),
+            record.get('crcfe_heure_debut'),
+            record.get('crcfe_heure_fin'),
+            record.get('crcfe_nom_equipe'),
+            record.get('crcfe_immatriculation_benne'),
+        )
+
+    @property
+    def is_ep(self):
+        return self.type_collecte.upper() == "EP" if self.type_collecte else False
+
+
+@dataclass
+class AgentTournee:
+    __slots__ = ('agent_id',)
+    agent_id: str
+
+    table = 'crcfe_agentstournees'
+
+    @classmethod
+    def from_record(cls, record):
+        if '_crcfe_id_agent_value' in record:
+            return cls(record['_crcfe_id_agent_value'])
+        return cls(record.get('crcfe_id_agent'))
+
+
+@dataclass
+class Agent:
+    __slots__ = ('id', 'nom', 'prenom')
+    id: str
+    nom: str
+    prenom: str
+
+    table = 'new_agents'
+    cached = True
+
+    @classmethod
+    def from_record(cls, record):
+        nom = ""
+        prenom = ""
+        # Rechercher les colonnes de nom et prénom
+        for col, value in record.items():
+            if 'nom' in col.lower() and not 'prenom' in col.lower():
+                nom = _text(value)
+            elif 'prenom' in col.lower() or 'prénom' in col.lower():
+                prenom = _text(value)
+        return cls(record.get('new_agentsid'), nom, prenom)
+
+    @property
+    def nom_complet(self):
+        if self.prenom and self.nom:
+            return f"{self.prenom} {self.nom}"
+        return self.prenom or self.nom
+
+
+@dataclass
+class Bac:
+    __slots__ = ('id', 'adresse_id', 'action_ep', 'volume', 'taux', 'commentaire')
+    id: str
+    adresse_id: str
+    action_ep: str
+    volume: str
+    taux: str
+    commentaire: str
+
+    table = 'new_bacs'
+
+    @classmethod
+    def from_record(cls, record):
+        action_ep = ""
+        volume = ""
+        taux = ""
+        commentaire = ""
+        for col, value in record.items():
+            col = col.lower()
+            if 'action_ep' in col:
+                action_ep = _text(value)
+            if 'volume' in col:
+                volume = _text(value)
+            elif 'taux' in col or 'remplissage' in col:
+                taux = _text(value)
+            elif 'commentaire' in col:
+                commentaire = _text(value)
+        return cls(record.get('new_bacsid'), record.get('_crcfe_adressebac_value'), action_ep, volume, taux,
+                   commentaire)
+
+
+@dataclass
+class Adresse:
+    __slots__ = ('id', 'commune', 'numero', 'bis_ter', 'nom_rue', 'type_habitat')
+    id: str
+    commune: str
+    numero: str
+    bis_ter: str
+    nom_rue: str
+    type_habitat: str
+
+    table = 'crcfe_listeadressesbacs'
+    cached = True
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(
+            record.get('crcfe_listeadressesbacsid'),
+            record.get('crcfe_commune', ""),
+            record.get('crcfe_numerorue', ""),
+            record.get('crcfe_bister', ""),
+            record.get('crcfe_nomrue', ""),
+            record.get('crcfe_typehabitat', ""),
+        )
+
+
+@dataclass
+class Vidage:
+    __slots__ = ('id', 'heure_vidage')
+    id: str
+    heure_vidage: str
+
+    table = 'new_vidages'
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(record.get('new_vidagesid'), record.get('new_heure_vidage'))
+
+
+def to_frame(items, model):
+    """DataFrame des objets, une colonne par champ du modèle"""
+    names = [field.name for field in fields(model)]
+    return pd.DataFrame([[getattr(item, name) for name in names] for item in items], columns=names)
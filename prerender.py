@@ -0,0 +1,372 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from models import Bac, Tournee, Vidage
+
+try:
+    import fcntl  # verrou entre les workers gunicorn (Unix)
+except ImportError:
+    fcntl = None
+
+# Pré-génération des classeurs des tournées terminées.
+#
+# Un thread (PreRenderer) interroge périodiquement crcfe_tournees pour trouver les
+# tournées terminées (heure de fin renseignée) modifiées depuis le dernier passage
+# (modifiedon), et génère leur classeur Suivi EP/OM dans un dossier d'artefacts
+# (ArtifactStore). /export-tournee sert ensuite ce fichier directement, sans
+# interroger Dataverse ni ouvrir le modèle. Une tournée peut aussi être signalée
+# directement (submit, appelé par le point d'accès POST /tournees/<id>/terminee
+# de app.py, qui tient lieu de webhook).
+#
+# Une tournée est générée à nouveau quand son modifiedon change. Les modifications
+# de ses bacs ou vidages ne changent pas le modifiedon de la tournée : avant de
+# servir un classeur, PreRenderer.current compare donc sa date de génération au
+# dernier modifiedon de la tournée, de ses bacs et de ses vidages (trois petites
+# requêtes, faites par app.py avec une place d'export). Un classeur dépassé n'est
+# pas servi : la demande fait l'export, dont le résultat remplace le classeur
+# (PreRenderer.keep). Les suppressions ne laissent pas de modifiedon : au-delà de
+# `max_age`, un classeur n'est plus servi, et la surveillance le supprime du dossier.
+#
+# Avec plusieurs workers gunicorn, un seul processus surveille Dataverse (verrou
+# sur un fichier du dossier d'artefacts) ; tous servent les artefacts.
+
+logger = logging.getLogger(__name__)
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _timestamp(modifiedon):
+    try:
+        return datetime.fromisoformat(modifiedon.replace('Z', '+00:00')).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+def _latest_modifiedon(connector, model, filter):
+    entity_set_name = connector.get_entity_set_name(model.table) or model.table
+    # Lecture complète (une ligne au plus) : la réponse est rendue au pool de connexions
+    records = list(connector.iter_records(entity_set_name, select="modifiedon", filter=filter,
+                                          orderby="modifiedon desc", top=1))
+    return records[0].get('modifiedon') if records else None
+
+
+class ArtifactStore:
+    """
+    Classeurs déjà générés, un par tournée, avec un fichier .json de description.
+
+    Args:
+        directory (str): Dossier des artefacts (créé si besoin)
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _base(self, tournee_id):
+        # Le nom lisible peut être le même pour deux identifiants (T/1 et T_1) : le
+        # condensé de l'identifiant les distingue
+        safe_id = "".join(c if c.isalnum() or c in "-_" else "_" for c in str(tournee_id))
+        digest = hashlib.sha1(str(tournee_id).encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.directory, f"tournee_{safe_id}_{digest}")
+
+    def get(self, tournee_id):
+        """Chemin du classeur de la tournée, ou None s'il n'a pas été généré"""
+        path = self._base(tournee_id) + ".xlsx"
+        return path if os.path.exists(path) else None
+
+    def info(self, tournee_id):
+        """Description de l'artefact (modifiedon de la tournée, date de génération), ou None"""
+        try:
+            with open(self._base(tournee_id) + ".json") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, tournee_id, render, modifiedon=None, started=None):
+        """
+        Génère le classeur avec render(chemin) -> bool et le publie d'un coup
+        (os.replace) : une demande ne voit jamais un fichier à moitié écrit.
+
+        Args:
+            started (float, optional): Début de la lecture des données (time.time()),
+                si elle a précédé l'appel ; par défaut, le moment de l'appel
+
+        Returns:
+            bool: True si le classeur a été généré
+        """
+        base = self._base(tournee_id)
+        started = started or time.time()
+        handle, temp_path = tempfile.mkstemp(suffix=".xlsx", dir=self.directory, prefix=".rendu_")
+        os.close(handle)
+        try:
+            if not render(temp_path):
+                return False
+            os.replace(temp_path, base + ".xlsx")
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        with open(base + ".json.tmp", "w") as f:
+            json.dump({"tournee_id": str(tournee_id), "modifiedon": modifiedon, "rendered_at": _now(),
+                       "started": started}, f)
+        os.replace(base + ".json.tmp", base + ".json")
+        return True
+
+    def prune(self, max_age):
+        """
+        Supprime les classeurs générés il y a plus de max_age secondes, et les fichiers
+        temporaires laissés par une génération interrompue.
+
+        Returns:
+            int: Nombre de classeurs supprimés
+        """
+        limit = time.time() - max_age
+        removed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".rendu_"):
+                if os.path.getmtime(path) < limit:
+                    os.remove(path)
+            elif name.startswith("tournee_") and name.endswith(".json"):
+                try:
+                    with open(path) as f:
+                        started = json.load(f).get("started", 0)
+                except (OSError, ValueError):
+                    started = 0
+                if started < limit:
+                    for suffix in (".xlsx", ".json"):
+                        if os.path.exists(path[:-len(".json")] + suffix):
+                            os.remove(path[:-len(".json")] + suffix)
+                    removed += 1
+        return removed
+
+
+class PreRenderer:
+    """
+    Surveille les tournées terminées et génère leurs classeurs en arrière-plan.
+
+    Args:
+        store (ArtifactStore): Dossier des artefacts
+        get_connector: Fonction renvoyant un NewDataverseConnector connecté
+        render: Fonction render(tournee_id, chemin) -> bool qui génère le classeur
+        interval (float): Délai entre deux interrogations de Dataverse, en secondes
+        lookback (float): Au premier démarrage, ancienneté (en heures) des tournées prises en compte
+        max_age (float): Ancienneté (en heures) au-delà de laquelle un classeur n'est plus servi ni gardé
+    """
+
+    def __init__(self, store, get_connector, render, interval=60, lookback=24, max_age=24):
+        self.store = store
+        self.get_connector = get_connector
+        self.render = render
+        self.interval = interval
+        self.lookback = lookback
+        self.max_age = max_age
+        self.queue = queue.Queue()
+        self.rendered = 0
+        self.failed = 0
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock_file = None
+        self._watermark_path = os.path.join(store.directory, "watermark.json")
+
+    # --- Surveillance -------------------------------------------------------
+
+    def _watermark(self):
+        try:
+            with open(self._watermark_path) as f:
+                return json.load(f)["modifiedon"]
+        except (OSError, ValueError, KeyError):
+            start = datetime.now(timezone.utc) - timedelta(hours=self.lookback)
+            return start.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def _save_watermark(self, modifiedon):
+        with open(self._watermark_path + ".tmp", "w") as f:
+            json.dump({"modifiedon": modifiedon}, f)
+        os.replace(self._watermark_path + ".tmp", self._watermark_path)
+
+    def poll(self):
+        """
+        Met en file les tournées terminées modifiées depuis le dernier passage.
+
+        Returns:
+            int: Nombre de tournées mises en file
+        """
+        connector = self.get_connector()
+        watermark = self._watermark()
+        entity_set_name = connector.get_entity_set_name(Tournee.table) or Tournee.table
+        # ge et non gt : modifiedon est à la seconde, les tournées déjà générées
+        # avec le même modifiedon sont écartées ci-dessous
+        filter = f"crcfe_heure_fin ne null and modifiedon ge {watermark}"
+
+        queued = 0
+        latest = watermark
+        for record in connector.iter_records(entity_set_name, select="crcfe_idtournees,modifiedon", filter=filter,
+                                             orderby="modifiedon asc"):
+            tournee_id = record.get('crcfe_idtournees')
+            modifiedon = record.get('modifiedon')
+            if not tournee_id:
+                continue
+            latest = max(latest, modifiedon or latest)
+            if self._up_to_date(tournee_id, modifiedon):
+                continue
+            self.submit(tournee_id, modifiedon)
+            queued += 1
+
+        if latest != watermark:
+            self._save_watermark(latest)
+        return queued
+
+    def _up_to_date(self, tournee_id, modifiedon):
+        """True si le classeur a été généré avec cette version de la tournée, ou après sa modification"""
+        info = self.store.info(tournee_id)
+        if info is None or not self.store.get(tournee_id):
+            return False
+        if info.get("modifiedon") == modifiedon:
+            return True
+        changed = _timestamp(modifiedon)
+        return changed is not None and info.get("started", 0) > changed
+
+    def _watch(self):
+        while not self._stop.is_set():
+            try:
+                queued = self.poll()
+                if queued:
+                    logger.info(f"Pré-génération: {queued} tournée(s) terminée(s) à générer")
+            except Exception as e:
+                logger.error(f"Pré-génération: échec de l'interrogation de Dataverse: {e}")
+            try:
+                removed = self.store.prune(self.max_age * 3600)
+                if removed:
+                    logger.info(f"Pré-génération: {removed} classeur(s) trop ancien(s) supprimé(s)")
+            except OSError as e:
+                logger.error(f"Pré-génération: nettoyage du dossier impossible: {e}")
+            self._stop.wait(self.interval)
+
+    # --- Classeurs servis ---------------------------------------------------
+
+    def last_modified(self, tournee_id):
+        """
+        Dernière modification (timestamp) de la tournée, de ses bacs et de ses vidages.
+
+        Returns:
+            float: Timestamp du modifiedon le plus récent, ou None si la tournée n'existe pas
+        """
+        connector = self.get_connector()
+        entity_set_name = connector.get_entity_set_name(Tournee.table) or Tournee.table
+        tournees = list(connector.iter_records(entity_set_name, select="crcfe_tourneesid,modifiedon",
+                                               filter=f"crcfe_idtournees eq '{tournee_id}'", top=1))
+        if not tournees:
+            return None
+        tournee = tournees[0]
+        changes = [tournee.get('modifiedon'),
+                   _latest_modifiedon(connector, Bac, f"_crcfe_id_tournee_value eq '{tournee['crcfe_tourneesid']}'"),
+                   _latest_modifiedon(connector, Vidage, f"_crcfe_idtournees_value eq '{tournee['crcfe_tourneesid']}'")]
+        timestamps = [_timestamp(modifiedon) for modifiedon in changes if modifiedon]
+        return max([t for t in timestamps if t is not None], default=None)
+
+    def current(self, tournee_id):
+        """
+        Chemin du classeur de la tournée s'il est à jour, sinon None. Fait trois
+        requêtes à Dataverse : à appeler avec une place d'export (voir app.run_export).
+        """
+        path = self.store.get(tournee_id)
+        info = self.store.info(tournee_id)
+        if not path or info is None or info.get("tournee_id") != str(tournee_id):
+            return None
+        if info.get("started", 0) < time.time() - self.max_age * 3600:
+            return None
+        try:
+            changed = self.last_modified(tournee_id)
+        except Exception as e:
+            logger.warning(f"Pré-génération: fraîcheur du classeur de la tournée {tournee_id} inconnue: {e}")
+            return None
+        # modifiedon est tronqué à la seconde : une modification faite dans la seconde
+        # où la génération a commencé compte comme postérieure
+        if changed is None or changed + 1 > info.get("started", 0):
+            return None
+        return path
+
+    def keep(self, tournee_id, output_file, started):
+        """
+        Remplace le classeur de la tournée par celui d'un export fait pour une demande
+        (commencé à `started`), au lieu de le générer à nouveau en arrière-plan.
+        """
+        def copy(path):
+            shutil.copyfile(output_file, path)
+            return True
+
+        try:
+            return self.store.put(tournee_id, copy, started=started)
+        except OSError as e:
+            logger.error(f"Pré-génération: classeur de la tournée {tournee_id} non conservé: {e}")
+            return False
+
+    # --- Génération ---------------------------------------------------------
+
+    def submit(self, tournee_id, modifiedon=None):
+        """Demande la (re)génération du classeur d'une tournée"""
+        self.queue.put((str(tournee_id), modifiedon, time.time()))
+
+    def render_one(self, tournee_id, modifiedon=None):
+        try:
+            success = self.store.put(tournee_id, lambda path: self.render(tournee_id, path), modifiedon)
+        except Exception as e:
+            logger.exception(f"Pré-génération de la tournée {tournee_id} impossible: {e}")
+            success = False
+        if success:
+            self.rendered += 1
+            logger.info(f"Pré-génération: classeur de la tournée {tournee_id} prêt")
+        else:
+            self.failed += 1
+        return success
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                tournee_id, modifiedon, queued_at = self.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            # Déjà générée depuis la demande (signalée et trouvée par la surveillance)
+            info = self.store.info(tournee_id)
+            if info is None or info.get("started", 0) < queued_at:
+                self.render_one(tournee_id, modifiedon)
+            self.queue.task_done()
+
+    def _acquire_watch_lock(self):
+        """True si ce processus doit surveiller Dataverse (un seul à la fois)"""
+        if fcntl is None:
+            return True
+        self._lock_file = open(os.path.join(self.store.directory, "watcher.lock"), "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            self._lock_file.close()
+            self._lock_file = None
+            return False
+
+    def start(self, watch=True):
+        """Lance la génération en arrière-plan, et la surveillance si watch et si aucun autre processus ne l'assure"""
+        self._threads.append(threading.Thread(target=self._work, name="prerender", daemon=True))
+        if watch and self._acquire_watch_lock():
+            self._threads.append(threading.Thread(target=self._watch, name="prerender-watch", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return len(self._threads) > 1
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        if self._lock_file is not None:
+            self._lock_file.close()
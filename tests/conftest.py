@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The root modules import PyConnectDataverse.x while the modules of PyConnectDataverse
+# import each other without prefix: both folders go on the path.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'PyConnectDataverse')]
@@ -0,0 +1,88 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionControl, CallInterrupted, ExportsSaturated, SingleFlight
+
+
+def _followers(flight, key, count):
+    """Starts `count` threads waiting on the call in progress, returns their outcomes"""
+    outcomes = []
+
+    def follow():
+        try:
+            outcomes.append(flight.do(key, lambda: pytest.fail("a follower ran the function")))
+        except BaseException as e:
+            outcomes.append(e)
+
+    threads = [threading.Thread(target=follow) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+
+@pytest.mark.parametrize('error, expected', [(ValueError("lecture"), ValueError),
+                                             (KeyboardInterrupt(), CallInterrupted),
+                                             (SystemExit(1), CallInterrupted)])
+def test_followers_get_the_leader_error(error, expected):
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    state = {}
+
+    def leader():
+        def function():
+            started.set()
+            release.wait()
+            raise error
+        try:
+            flight.do("1", function)
+        except BaseException as e:
+            state['leader'] = e
+
+    leader_thread = threading.Thread(target=leader)
+    leader_thread.start()
+    started.wait()
+    threads, outcomes = _followers(flight, "1", 3)
+    time.sleep(0.1)
+    release.set()
+    for thread in threads + [leader_thread]:
+        thread.join()
+
+    assert state['leader'] is error
+    assert len(outcomes) == 3 and all(isinstance(outcome, expected) for outcome in outcomes)
+    # The key is free again
+    assert flight.do("1", lambda: "ok") == ("ok", False)
+
+
+def test_followers_share_the_result():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def function():
+        started.set()
+        release.wait()
+        return "classeur"
+
+    leader = threading.Thread(target=lambda: flight.do("1", function))
+    leader.start()
+    started.wait()
+    threads, outcomes = _followers(flight, "1", 2)
+    time.sleep(0.1)
+    release.set()
+    for thread in threads + [leader]:
+        thread.join()
+    assert outcomes == [("classeur", True), ("classeur", True)]
+
+
+def test_admission_rejects_when_full():
+    admission = AdmissionControl(1, wait=0.05, retry_after=7)
+    with admission.slot():
+        with pytest.raises(ExportsSaturated) as info:
+            with admission.slot():
+                pass
+    assert info.value.retry_after == 7
+    with admission.slot():
+        pass
@@ -0,0 +1,65 @@
+import contextlib
+import io
+import json
+
+import pytest
+
+from authenticate_with_msal import getAuthenticatedSession
+from batch_engine import MAX_RETRY_AFTER, AdaptiveConcurrency, BatchEngine, BatchPart, retry_after
+from mock_dataverse import MockDataverse, MockDataverseServer
+
+
+class Response:
+    def __init__(self, value):
+        self.headers = {} if value is None else {'Retry-After': value}
+
+
+@pytest.mark.parametrize('value, attempt, expected', [
+    ('3', 0, 3.0),
+    ('86400', 0, MAX_RETRY_AFTER),
+    ('-5', 0, 0.0),
+    ('nan', 0, MAX_RETRY_AFTER),
+    ('soon', 2, 4),
+    (None, 10, MAX_RETRY_AFTER),
+])
+def test_retry_after_is_bounded(value, attempt, expected):
+    assert retry_after(Response(value), attempt) == expected
+
+
+def test_limit_is_halved_when_throttled_and_grows_back():
+    limiter = AdaptiveConcurrency(8, 8)
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert (limiter.limit, limiter.throttled) == (4, 1)
+
+    # One more batch in flight after `limit` consecutive successes
+    for expected in (4, 4, 4, 5):
+        limiter.acquire()
+        limiter.release()
+        assert limiter.limit == expected
+
+    limiter.acquire()
+    limiter.release(dop_hint=2)
+    assert (limiter.maximum, limiter.limit) == (2, 2)
+
+
+def test_outcomes_in_submission_order_under_throttling(tmp_path):
+    mock = MockDataverse(latency=0.01, throttle_rate=0.3, retry_after=0, seed=1)
+    server = MockDataverseServer(mock)
+    server.start()
+    try:
+        env = str(tmp_path / "env.json")
+        server.write_env(env)
+        with contextlib.redirect_stdout(io.StringIO()):
+            session, environment_uri = getAuthenticatedSession(env, 8)
+            engine = BatchEngine(session, environment_uri, concurrency=4, max_concurrency=8, max_retries=50)
+            batches = [[BatchPart('POST', 'contacts', json.dumps({'firstname': f'c{index}.{row}'}).encode())
+                        for row in range(3)] for index in range(30)]
+            outcomes = list(engine.submit(batches))
+    finally:
+        server.stop()
+
+    assert [outcome.index for outcome in outcomes] == list(range(30))
+    assert all(result.status == 204 for outcome in outcomes for result in outcome.results)
+    assert mock.throttled > 0 and engine.limiter.throttled == mock.throttled
+    assert len(mock.tables['contacts'].records) == 90
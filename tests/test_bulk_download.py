@@ -0,0 +1,61 @@
+import contextlib
+import io
+import json
+import os
+
+from bulk_operations import BulkContext, download_table
+from mock_dataverse import MockDataverse, MockDataverseServer
+
+
+def test_download_follows_next_link(tmp_path):
+    mock = MockDataverse(page_size=7)
+    for i in range(30):
+        mock.insert('contacts', {'firstname': f'c{i}'})
+    server = MockDataverseServer(mock)
+    server.start()
+    try:
+        env = str(tmp_path / "env.json")
+        server.write_env(env)
+        context = BulkContext.from_environment(env, output_dir=str(tmp_path))
+        with contextlib.redirect_stdout(io.StringIO()):
+            count = download_table(context, 'contacts', select='firstname')
+            top = download_table(context, 'contacts', top=5, output_name="top.json")
+    finally:
+        server.stop()
+
+    with open(tmp_path / "contacts.json") as f:
+        records = json.load(f)
+    assert count == 30
+    assert sorted(record['firstname'] for record in records) == sorted(f'c{i}' for i in range(30))
+    assert top == 5
+    with open(tmp_path / "top.json") as f:
+        assert len(json.load(f)) == 5
+
+
+def test_failed_download_leaves_no_file(tmp_path):
+    mock = MockDataverse(page_size=7)
+    for i in range(30):
+        mock.insert('contacts', {'firstname': f'c{i}'})
+    server = MockDataverseServer(mock)
+    server.start()
+    try:
+        env = str(tmp_path / "env.json")
+        server.write_env(env)
+        context = BulkContext.from_environment(env, output_dir=str(tmp_path / "output"))
+        get = context.get
+        calls = []
+
+        def failing_get(url, headers=None, stream=False):
+            # The second page is requested with a filter the server rejects (400)
+            calls.append(url)
+            return get(url if len(calls) == 1 else context.api_uri + 'contacts?$filter=(', headers, stream)
+
+        context.get = failing_get
+        with contextlib.redirect_stdout(io.StringIO()):
+            count = download_table(context, 'contacts')
+    finally:
+        server.stop()
+
+    assert count is None
+    assert len(calls) == 2
+    assert os.listdir(tmp_path / "output") == []
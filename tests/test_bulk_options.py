@@ -0,0 +1,29 @@
+import contextlib
+import io
+
+import pandas as pd
+
+from bulk_operations import BulkContext, add_options
+from mock_dataverse import MockDataverse, MockDataverseServer
+
+
+def test_new_labels_take_the_next_unused_values(tmp_path):
+    mock = MockDataverse()
+    mock.option_sets['colors'] = {101: ('Blue', '#0000ff', 1033)}
+    server = MockDataverseServer(mock)
+    server.start()
+    try:
+        env = str(tmp_path / "env.json")
+        server.write_env(env)
+        context = BulkContext.from_environment(env, batch_size=2, output_dir=str(tmp_path))
+        options = pd.DataFrame({'Label': ['Red', 'Green', 'Blue', 'Yellow', 'Red'],
+                                'Color': ['#ff0000', '#00ff00', '#0000ff', '#ffff00', '#ff0000']})
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = pd.read_csv(add_options(context, 'colors', 100, options))
+    finally:
+        server.stop()
+
+    labels = {value: label for value, (label, _, _) in mock.option_sets['colors'].items()}
+    assert labels == {100: 'Red', 101: 'Blue', 102: 'Green', 103: 'Yellow'}
+    assert result['codes'].tolist() == ['200 OK', '200 OK', 'skipped', '200 OK', 'skipped']
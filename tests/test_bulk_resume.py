@@ -0,0 +1,68 @@
+import contextlib
+import io
+
+import pandas as pd
+import pytest
+
+from bulk_operations import BulkContext, create_records
+from mock_dataverse import MockDataverse, MockDataverseServer
+from progress_journal import ProgressJournal
+
+
+@pytest.fixture
+def dataverse(tmp_path, monkeypatch):
+    # Anything a run writes to the working directory stays out of the repository
+    monkeypatch.chdir(tmp_path)
+    # Latency per request, so several batches are in flight when the run stops
+    mock = MockDataverse(latency=0.05)
+    server = MockDataverseServer(mock)
+    server.start()
+    env = tmp_path / "env.json"
+    server.write_env(str(env))
+    yield mock, str(env)
+    server.stop()
+
+
+def contacts(count):
+    return pd.DataFrame({'firstname': [f'c{i}' for i in range(count)],
+                         'emailaddress1': [f'c{i}@example.com' for i in range(count)]})
+
+
+def chunks(rows, size, fail_after=None, error=KeyboardInterrupt):
+    """The rows read by chunks, as read_csv with chunksize; raises `error` after fail_after chunks"""
+    for number, start in enumerate(range(0, len(rows.index), size)):
+        if number == fail_after:
+            raise error
+        yield rows.iloc[start:start + size]
+
+
+def run(env, tmp_path, source, resume):
+    context = BulkContext.from_environment(env, batch_size=5, concurrency=4, max_concurrency=4,
+                                           output_dir=str(tmp_path))
+    journal = context.open_journal(str(tmp_path / "journal.db"), "create contacts", "contacts.csv", resume=resume)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_records(context, 'contacts', source)
+        return journal.counts()
+    finally:
+        journal.close()
+
+
+@pytest.mark.parametrize('error', [KeyboardInterrupt, pd.errors.ParserError])
+def test_interrupted_run_resumes_without_duplicates(dataverse, tmp_path, error):
+    mock, env = dataverse
+    rows = contacts(25)
+
+    with pytest.raises(error):
+        run(env, tmp_path, chunks(rows, 10, fail_after=2, error=error), resume=False)
+
+    # The batches sent before the interruption are recorded as done
+    assert len(mock.tables['contacts'].records) == 20
+    journal = ProgressJournal(str(tmp_path / "journal.db"))
+    assert journal.counts() == {'done': 20}
+    journal.close()
+
+    counts = run(env, tmp_path, chunks(rows, 10), resume=True)
+
+    assert counts == {'done': 25}
+    assert len(mock.tables['contacts'].records) == 25
@@ -0,0 +1,40 @@
+import contextlib
+import io
+
+import pandas as pd
+import pytest
+
+from bulk_operations import BulkContext, alternate_key_path, upsert_records
+from mock_dataverse import MockDataverse, MockDataverseServer
+
+
+def test_key_literals():
+    assert alternate_key_path('accounts', {'accountnumber': 123.0, 'name': "O'Neil"}) == \
+        "accounts(accountnumber=123,name='O''Neil')"
+    assert alternate_key_path('accounts', {'ratio': 1.5, 'active': True}) == "accounts(ratio=1.5,active=true)"
+    with pytest.raises(ValueError):
+        alternate_key_path('accounts', {'accountnumber': float('nan')})
+
+
+def test_rows_with_an_empty_key_are_reported(tmp_path):
+    mock = MockDataverse()
+    server = MockDataverseServer(mock)
+    server.start()
+    try:
+        env = str(tmp_path / "env.json")
+        server.write_env(env)
+        # One batch at a time: the last row updates the record created by the first
+        context = BulkContext.from_environment(env, batch_size=2, concurrency=1, max_concurrency=1,
+                                               output_dir=str(tmp_path))
+        # An integer column with an empty cell is read as float64
+        rows = pd.DataFrame({'accountnumber': [1, 2, None, 1], 'name': ['a', 'b', 'c', 'a2']})
+        assert rows['accountnumber'].dtype.kind == 'f'
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = pd.read_csv(upsert_records(context, 'accounts', rows, alternate_keys=['accountnumber']))
+    finally:
+        server.stop()
+
+    records = sorted((record['accountnumber'], record['name']) for record in mock.tables['accounts'].records.values())
+    assert records == [(1, 'a2'), (2, 'b')]
+    assert result['codes'].tolist() == ['204 No Content', '204 No Content', 'invalid', '204 No Content']
@@ -0,0 +1,73 @@
+import contextlib
+import io
+
+import pytest
+import requests
+
+from dataverse_connector import NewDataverseConnector
+from export import export_tournee_vers_excel
+from mock_dataverse import MockDataverse, MockDataverseServer, TourneeGenerator
+from models import Bac
+
+
+@pytest.fixture
+def connector(tmp_path):
+    mock = MockDataverse(page_size=4)
+    TourneeGenerator(mock, seed=3).add_tournee('EP', 10)
+    server = MockDataverseServer(mock)
+    server.start()
+    env = str(tmp_path / "env.json")
+    server.write_env(env)
+    connector = NewDataverseConnector('x', 'y', server.url, path_to_env=env)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert connector.connect()
+    yield connector
+    server.stop()
+
+
+def _break_second_page(connector, error):
+    """The second page of each collection stops after its first record"""
+    read_collection = connector.read_collection
+    pages = []
+
+    def broken(request_uri, headers=None):
+        reader = read_collection(request_uri, headers)
+        pages.append(request_uri)
+        if len(pages) < 2:
+            return reader
+
+        class Reader:
+            next_link = None
+            found_value = True
+
+            def __iter__(self):
+                for record in reader:
+                    yield record
+                    raise error
+
+        return Reader()
+
+    connector.read_collection = broken
+
+
+@pytest.mark.parametrize('error', [requests.ConnectionError("connection reset"), ValueError("incomplete JSON"),
+                                   KeyError("crcfe_idtournees")])
+def test_get_records_returns_none_on_mid_stream_failure(connector, error):
+    _break_second_page(connector, error)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert connector.get_records(Bac) is None
+
+
+def test_export_returns_false_when_the_tournee_read_fails(connector, tmp_path):
+    get = connector.get
+
+    def failing_get(url, *args, **kwargs):
+        if '/crcfe_tournees?' in url:
+            raise requests.ConnectionError("connection reset")
+        return get(url, *args, **kwargs)
+
+    connector.get = failing_get
+    output = tmp_path / "tournee.xlsx"
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert export_tournee_vers_excel(tournee_id="1", output_file=str(output), connector=connector) is False
+    assert not output.exists()
@@ -0,0 +1,52 @@
+import contextlib
+import io
+
+import pandas as pd
+import pytest
+
+from dataverse_connector import NewDataverseConnector
+from download import download_table
+from mock_dataverse import MockDataverse, MockDataverseServer
+
+
+@pytest.fixture
+def connector(tmp_path):
+    mock = MockDataverse(page_size=3)
+    # Dataverse leaves out empty columns: telephone1 first appears on the third page
+    for i in range(10):
+        record = {'firstname': f'c{i}'}
+        if i >= 7:
+            record['telephone1'] = f'01 02 03 04 0{i}'
+        mock.insert('contacts', record)
+    server = MockDataverseServer(mock)
+    server.start()
+    env = str(tmp_path / "env.json")
+    server.write_env(env)
+    connector = NewDataverseConnector('x', 'y', server.url, path_to_env=env)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert connector.connect()
+    yield connector
+    server.stop()
+
+
+def _check(df):
+    df = df.sort_values('firstname')
+    assert len(df.index) == 10
+    assert df['telephone1'].isna().sum() == 7
+    assert df.loc[df['firstname'] == 'c9', 'telephone1'].tolist() == ['01 02 03 04 09']
+
+
+def test_csv_keeps_columns_of_later_pages(connector, tmp_path):
+    output = str(tmp_path / "contacts.csv")
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert download_table(connector, 'contact', output, page_size=3) == 10
+    _check(pd.read_csv(output))
+
+
+def test_parquet_keeps_columns_of_later_pages(connector, tmp_path):
+    pytest.importorskip('pyarrow')
+    output = str(tmp_path / "contacts.parquet")
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert download_table(connector, 'contact', output, page_size=3) == 10
+    _check(pd.read_parquet(output))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['contacts.parquet', 'env.json']
@@ -0,0 +1,114 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import entity_cache
+from entity_cache import REFRESH_OVERLAP, EntityCache
+
+
+class Clock:
+    """Horloge manuelle remplaçant time.monotonic et time.time du module"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return 1700000000.0 + self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(entity_cache, 'time', clock)
+    return clock
+
+
+def _records(*ids, nom='a'):
+    return [SimpleNamespace(id=record_id, nom=nom) for record_id in ids]
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = EntityCache(ttl=10)
+    cache.put_many('agents', _records('1', '2'))
+    found, missing = cache.get_many('agents', ['1', '2', '3'])
+    assert sorted(found) == ['1', '2'] and missing == ['3']
+
+    clock.now += 10
+    assert sorted(cache.get_many('agents', ['1', '2'])[0]) == ['1', '2']
+    clock.now += 0.5
+    assert cache.get_many('agents', ['1', '2']) == ({}, ['1', '2'])
+
+
+def test_least_recently_used_entries_are_evicted(clock):
+    cache = EntityCache(max_entries=3)
+    cache.put_many('agents', _records('1', '2', '3'))
+    # Lire 1 le rend plus récent que 2
+    cache.get_many('agents', ['1'])
+    cache.put_many('adresses', _records('4'))
+    assert len(cache) == 3
+    found, missing = cache.get_many('agents', ['1', '2', '3'])
+    assert sorted(found) == ['1', '3'] and missing == ['2']
+
+
+def test_update_only_replaces_cached_entries(clock):
+    cache = EntityCache(ttl=10)
+    cache.put_many('agents', _records('1'))
+    clock.now += 8
+    cache.update('agents', _records('1', '2', nom='b'))
+    assert cache.get_many('agents', ['2']) == ({}, ['2'])
+
+    # L'enregistrement remplacé repart pour un ttl complet
+    clock.now += 8
+    found, _ = cache.get_many('agents', ['1'])
+    assert found['1'].nom == 'b'
+
+
+def test_refresh_since_overlaps_the_previous_watermark(clock):
+    cache = EntityCache(refresh_interval=30)
+    assert cache.refresh_since('agents') is None  # table jamais chargée
+    cache.put_many('agents', _records('1'))
+    loaded = clock.time()
+    assert cache.refresh_since('agents') is None  # intervalle pas écoulé
+
+    clock.now += 30
+    since = cache.refresh_since('agents')
+    assert since == datetime.fromtimestamp(loaded - REFRESH_OVERLAP, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    # Une seule interrogation par intervalle, même sans réponse
+    assert cache.refresh_since('agents') is None
+
+    # Interrogation réussie : la suivante repart de son début, moins le recouvrement
+    started = clock.time()
+    cache.refreshed('agents', started)
+    clock.now += 30
+    assert cache.refresh_since('agents') == \
+        datetime.fromtimestamp(started - REFRESH_OVERLAP, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    # Sans réponse, l'interrogation suivante repart du même point
+    clock.now += 30
+    assert cache.refresh_since('agents') == \
+        datetime.fromtimestamp(started - REFRESH_OVERLAP, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def test_no_refresh_without_interval(clock):
+    cache = EntityCache()
+    cache.put_many('agents', _records('1'))
+    clock.now += 100000
+    assert cache.refresh_since('agents') is None
+
+
+def test_invalidate(clock):
+    cache = EntityCache(refresh_interval=30)
+    cache.put_many('agents', _records('1'))
+    cache.put_many('adresses', _records('1'))
+    cache.invalidate('agents')
+    assert cache.get_many('agents', ['1']) == ({}, ['1'])
+    assert '1' in cache.get_many('adresses', ['1'])[0]
+    clock.now += 30
+    assert cache.refresh_since('agents') is None
+
+    cache.invalidate()
+    assert len(cache) == 0
@@ -0,0 +1,84 @@
+import contextlib
+import io
+import json
+
+import pandas as pd
+import pytest
+
+import app as service
+import export
+from mock_dataverse import MockDataverse, MockDataverseServer, TourneeGenerator
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    mock = MockDataverse(page_size=50)
+    generator = TourneeGenerator(mock, seed=3)
+    generator.add_tournee('EP', 120)
+    generator.add_tournee('OM', 30)
+    server = MockDataverseServer(mock)
+    server.start()
+    env = str(tmp_path / "env.json")
+    server.write_env(env)
+    monkeypatch.setattr(service, 'DATAVERSE_CONFIG',
+                        {'client_id': 'x', 'tenant_id': 'y', 'env_url': server.url, 'path_to_env': env})
+    monkeypatch.setattr(service, '_connector', None)
+    monkeypatch.setattr(service, 'prerenderer', None)
+    service.entity_cache.invalidate()
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield service.app.test_client()
+    server.stop()
+
+
+def test_csv(client):
+    r = client.get('/export-tournee?id=1&format=csv')
+    assert r.status_code == 200
+    assert r.content_type == 'text/csv; charset=utf-8'
+    assert r.headers['Content-Disposition'] == 'attachment; filename=Tournee_1.csv'
+    df = pd.read_csv(io.StringIO(r.data.decode('utf-8')), dtype=str)
+    assert len(df.index) == 120
+    assert df.columns[0] == 'tournee_id' and set(df['type_collecte']) == {'EP'}
+
+
+def test_ndjson(client):
+    r = client.post('/export-tournee', json={'id': '2', 'format': 'ndjson'})
+    assert r.status_code == 200
+    assert r.content_type == 'application/x-ndjson'
+    lignes = [json.loads(ligne) for ligne in r.data.decode('utf-8').splitlines()]
+    assert len(lignes) == 30
+    assert {ligne['tournee_id'] for ligne in lignes} == {'2'} and 'Volume du Bac' in lignes[0]
+
+
+def test_parquet(client):
+    pytest.importorskip('pyarrow')
+    r = client.get('/export-tournee?id=2&format=parquet')
+    assert r.status_code == 200
+    assert len(pd.read_parquet(io.BytesIO(r.data)).index) == 30
+
+
+def test_parquet_without_pyarrow(client, monkeypatch):
+    monkeypatch.setattr(export, 'pa', None)
+    r = client.get('/export-tournee?id=2&format=parquet')
+    assert r.status_code == 501
+    assert 'pyarrow' in r.json['error']
+
+
+def test_unknown_format(client):
+    r = client.get('/export-tournee?id=2&format=xml')
+    assert r.status_code == 400
+    assert 'xml' in r.json['error']
+
+
+def test_unknown_tournee(client):
+    assert client.get('/export-tournee?id=inconnue&format=csv').status_code == 500
+
+
+def test_stream_reads_are_counted_by_format(client):
+    before = service.metrics.render()
+    client.get('/export-tournee?id=1&format=csv')
+    after = service.metrics.render()
+    line = 'exports_total{format="csv",type="EP",status="success"}'
+
+    def value(text):
+        return sum(float(l.split()[-1]) for l in text.splitlines() if l.startswith(line))
+    assert value(after) == value(before) + 1
@@ -0,0 +1,85 @@
+import contextlib
+import io
+import math
+
+import openpyxl
+import pandas as pd
+import pytest
+
+import export
+from dataverse_connector import NewDataverseConnector
+from mock_dataverse import MockDataverse, MockDataverseServer, TourneeGenerator
+
+
+@pytest.fixture(scope="module")
+def connector(tmp_path_factory):
+    mock = MockDataverse()
+    generator = TourneeGenerator(mock, seed=5)
+    generator.add_tournee('EP', 80)
+    generator.add_tournee('OM', 60)
+    # Bacs sans adresse ni volume : cellules vides de la feuille
+    for record in list(mock.table('new_bacs').records.values())[::7]:
+        record.pop('_crcfe_adressebac_value', None)
+        record.pop('new_volume_bac', None)
+    server = MockDataverseServer(mock)
+    server.start()
+    env = str(tmp_path_factory.mktemp("env") / "env.json")
+    server.write_env(env)
+    connector = NewDataverseConnector('x', 'y', server.url, path_to_env=env)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert connector.connect()
+    yield connector
+    server.stop()
+
+
+def ecrire_lignes_iterrows(sheet, start_row, column_mapping, df):
+    """Écriture de la version précédente d'export_tournee_vers_excel, comme référence"""
+    for i, row in df.iterrows():
+        for col_name, col_index in column_mapping.items():
+            sheet.cell(row=start_row + i, column=col_index, value=row.get(col_name, ''))
+
+
+def _cells(path):
+    workbook = openpyxl.load_workbook(path)
+    cells = {}
+    for sheet in workbook.worksheets:
+        for row in sheet.iter_rows():
+            for cell in row:
+                value = cell.value
+                if isinstance(value, float) and math.isnan(value):
+                    value = 'nan'
+                cells[(sheet.title, cell.coordinate)] = value
+    return cells
+
+
+@pytest.mark.parametrize('tournee_id', ['1', '2'])
+def test_workbook_matches_the_iterrows_version(connector, tmp_path, monkeypatch, tournee_id):
+    output = str(tmp_path / "classeur.xlsx")
+    reference = str(tmp_path / "reference.xlsx")
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert export.export_tournee_vers_excel(tournee_id=tournee_id, output_file=output, connector=connector)
+        monkeypatch.setattr(export, 'ecrire_lignes', ecrire_lignes_iterrows)
+        assert export.export_tournee_vers_excel(tournee_id=tournee_id, output_file=reference, connector=connector)
+
+    cells = _cells(output)
+    assert cells == _cells(reference)
+    # La feuille contient bien les bacs
+    assert sum(1 for value in cells.values() if value not in (None, '')) > 100
+
+
+@pytest.mark.parametrize('column_mapping', [export.COLONNES_EP, export.COLONNES_OM])
+def test_missing_columns_and_empty_values(column_mapping):
+    # Colonnes absentes, NaN, None et entiers mêlés
+    df = pd.DataFrame({
+        'COMMUNE': ['Versailles', None, 'Le Chesnay'],
+        'N°': [12, 3, 7],
+        'Volume du Bac': [240.0, float('nan'), 660.0],
+        'Commentaires': [float('nan'), 'bac cassé', ''],
+        'SACS_OM': [1, 0, 2],
+    })
+    sheets = []
+    for ecrire in (export.ecrire_lignes, ecrire_lignes_iterrows):
+        sheet = openpyxl.Workbook().active
+        ecrire(sheet, 8, column_mapping, df)
+        sheets.append([[cell.value for cell in row] for row in sheet.iter_rows()])
+    assert repr(sheets[0]) == repr(sheets[1])
@@ -0,0 +1,86 @@
+import contextlib
+import io
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from dataverse_connector import NewDataverseConnector
+from mock_dataverse import MockDataverse, MockDataverseServer, TourneeGenerator
+from prerender import ArtifactStore, PreRenderer
+
+
+@pytest.fixture
+def dataverse(tmp_path):
+    mock = MockDataverse()
+    generator = TourneeGenerator(mock, seed=3)
+    generator.add_tournee('EP', 10)
+    server = MockDataverseServer(mock)
+    server.start()
+    env = str(tmp_path / "env.json")
+    server.write_env(env)
+    connector = NewDataverseConnector('x', 'y', server.url, path_to_env=env)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert connector.connect()
+    yield mock, connector
+    server.stop()
+
+
+def _render(tournee_id, path):
+    with open(path, "wb") as f:
+        f.write(b"classeur")
+    return True
+
+
+def test_current_detects_changed_bacs(dataverse, tmp_path):
+    mock, connector = dataverse
+    store = ArtifactStore(str(tmp_path / "artefacts"))
+    prerenderer = PreRenderer(store, lambda: connector, _render)
+    assert prerenderer.render_one("1")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert prerenderer.current("1") == store.get("1")
+        assert prerenderer.current("inconnue") is None
+
+        # Bac modifié après la génération : le classeur n'est plus servi
+        bac = next(iter(mock.table('new_bacs').records.values()))
+        later = datetime.now(timezone.utc) + timedelta(seconds=10)
+        bac['modifiedon'] = later.strftime('%Y-%m-%dT%H:%M:%SZ')
+        assert prerenderer.current("1") is None
+
+        # Le classeur d'un export fait après la modification le remplace
+        output = tmp_path / "export.xlsx"
+        output.write_bytes(b"nouveau classeur")
+        assert prerenderer.keep("1", str(output), later.timestamp() + 1)
+        assert prerenderer.current("1") == store.get("1")
+    with open(store.get("1"), "rb") as f:
+        assert f.read() == b"nouveau classeur"
+    assert prerenderer.queue.empty()
+
+
+def test_ids_with_the_same_readable_name_do_not_share_a_workbook(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    assert store.put("T/1", lambda path: _render("T/1", path))
+    assert store.get("T_1") is None and store.info("T_1") is None
+    assert store.info("T/1")["tournee_id"] == "T/1"
+
+
+def test_max_age_and_prune(dataverse, tmp_path):
+    mock, connector = dataverse
+    store = ArtifactStore(str(tmp_path / "artefacts"))
+    prerenderer = PreRenderer(store, lambda: connector, _render, max_age=1)
+    assert prerenderer.render_one("1")
+    assert prerenderer.render_one("2")
+
+    # Classeur de la tournée 1 généré il y a deux heures
+    info = store.info("1")
+    info["started"] = time.time() - 7200
+    with open(store._base("1") + ".json", "w") as f:
+        json.dump(info, f)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert prerenderer.current("1") is None
+    assert store.prune(3600) == 1
+    assert store.get("1") is None and store.info("1") is None
+    assert store.get("2") is not None
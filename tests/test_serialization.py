@@ -0,0 +1,32 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from serialization import record_bytes, row_dicts
+
+
+def test_empty_cells_of_every_dtype_become_null():
+    df = pd.DataFrame({
+        'count': pd.array([1, None], dtype='Int64'),
+        'active': pd.array([True, None], dtype='boolean'),
+        'name': pd.array(['a', None], dtype='string'),
+        'date': pd.to_datetime(['2024-01-02T03:04:05', None]),
+        'ratio': [0.5, np.nan],
+        'label': ['x', None],
+        'plain': np.array([7, 8], dtype='int64'),
+        'parentcustomerid_account@odata.bind': ['/accounts(1)', None],
+    })
+
+    records = [json.loads(body) for body in record_bytes(df)]
+
+    assert records[0] == {'count': 1, 'active': True, 'name': 'a', 'date': '2024-01-02T03:04:05', 'ratio': 0.5,
+                          'label': 'x', 'plain': 7, 'parentcustomerid_account@odata.bind': '/accounts(1)'}
+    # Lookups left empty are left out, the other empty cells are null
+    assert records[1] == {'count': None, 'active': None, 'name': None, 'date': None, 'ratio': None,
+                          'label': None, 'plain': 8}
+
+
+def test_columns_without_empty_cells_keep_their_values():
+    df = pd.DataFrame({'values': [[1, 2], [3]], 'flag': [False, True]})
+    assert list(row_dicts(df)) == [{'values': [1, 2], 'flag': False}, {'values': [3], 'flag': True}]
@@ -0,0 +1,103 @@
+import logging
+import time
+from contextlib import contextmanager
+
+# Durées des étapes d'un export (connexion, lectures Dataverse, jointure,
+# modèle Excel, écriture des cellules, enregistrement).
+#
+# Chaque étape est mesurée avec ExportTimings.span(), qui note sa durée, le nombre
+# de lignes traitées (renseigné par l'appelant), le nombre d'allers-retours avec
+# Dataverse et les octets reçus pendant l'étape (d'après les compteurs du thread
+# courant dans le TransferStats du connecteur, qui peut être partagé par plusieurs
+# exports simultanés). Les étapes sont
+# journalisées (logger "timings", niveau DEBUG) au fur et à mesure et restent
+# disponibles dans l'objet une fois l'export terminé.
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """Une étape mesurée"""
+    __slots__ = ('name', 'seconds', 'rows', 'requests', 'bytes')
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.rows = None
+        self.requests = 0
+        self.bytes = 0
+
+    def as_dict(self):
+        return {'name': self.name, 'seconds': round(self.seconds, 4), 'rows': self.rows, 'requests': self.requests,
+                'bytes': self.bytes}
+
+
+class ExportTimings:
+    """
+    Étapes d'un export, dans l'ordre où elles ont eu lieu.
+
+    Args:
+        label (str, optional): Libellé repris dans les journaux (ex: l'ID de la tournée)
+        transfer_stats (TransferStats, optional): Compteurs d'octets du connecteur
+    """
+
+    def __init__(self, label="", transfer_stats=None):
+        self.label = label
+        self.transfer_stats = transfer_stats
+        self.type_collecte = None  # "EP" ou "OM", une fois la tournée lue
+        self.spans = []
+        self.start = time.perf_counter()
+        self.end = None
+
+    def _counters(self):
+        if self.transfer_stats is None:
+            return 0, 0
+        return self.transfer_stats.thread_counters()
+
+    @contextmanager
+    def span(self, name):
+        """Mesure le bloc ; l'appelant peut renseigner span.rows"""
+        span = Span(name)
+        requests, received = self._counters()
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.seconds = time.perf_counter() - start
+            span.requests = self._counters()[0] - requests
+            span.bytes = self._counters()[1] - received
+            self.spans.append(span)
+            logger.debug("export %s - %s: %.3f s, %s lignes, %d requêtes, %d octets", self.label, name, span.seconds,
+                         span.rows if span.rows is not None else "-", span.requests, span.bytes)
+
+    def finish(self):
+        self.end = time.perf_counter()
+
+    @property
+    def total(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    def slowest(self):
+        return max(self.spans, key=lambda span: span.seconds, default=None)
+
+    @property
+    def requests(self):
+        return sum(span.requests for span in self.spans)
+
+    def as_dict(self):
+        return {'label': self.label, 'total_seconds': round(self.total, 4), 'requests': self.requests,
+                'spans': [span.as_dict() for span in self.spans]}
+
+    def summary(self):
+        """Résumé sur une ligne, ex: 'total 1.20 s | bacs 0.40 s (1000 lignes, 120.0 kB) | ...'"""
+        parts = [f"total {self.total:.2f} s, {self.requests} requêtes"]
+        for span in self.spans:
+            details = []
+            if span.rows is not None:
+                details.append(f"{span.rows} lignes")
+            if span.requests:
+                details.append(f"{span.requests} requêtes")
+            if span.bytes:
+                details.append(f"{span.bytes / 1024:.1f} kB")
+            parts.append(f"{span.name} {span.seconds:.2f} s" + (f" ({', '.join(details)})" if details else ""))
+        return " | ".join(parts)